@@ -3,41 +3,101 @@
 # "new locaiton" (specified as a program argument with the -n flag) of the tracks in the
 # rekordbox.xml file (filepath specified as a program argument with the -r flag) and saves it to a
 # new location (out filepath specified as a program argument with the -p flag).
+# To relocate several folders at once, pass a yaml file with the -m flag instead of -o and -n.
+# Each entry of it maps an old location prefix to a new one, e.g.
+#   "file://localhost/Volumes/Old%20Drive/": "file://localhost/Volumes/New%20Drive/"
+# With the -f flag just the Location attributes are rewritten, without parsing the whole xml file.
+# Everything else stays byte-identical. Add the -v flag to verify the result against the full parse.
 
 
 # system imports
 from argparse import ArgumentParser
 import logging
+import os
 import sys
+import tempfile
 
 sys.path.append("./src")
 # user imports
+import shared.dataloading as dataloading
 from shared.RB_handler import RB_handler
 from shared.logging_config import setup_logging
+import shared.rekordbox_xml as rekordbox_xml
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
 
-def main(args):
-    logger.info("Start of program: change_location.py...")
-    # instantiating the RB Handler and giving him the name benny ;)
-    benny = RB_handler(args.path_to_rb)
+def get_rules(args) -> dict:
+    """returns the relocation rules given as program arguments
 
+    Returns:
+        dict: key is the location prefix you want to change and value the prefix you want to change it to
+    """
+    if args.mapping_file != "":
+        return dataloading.load_yaml(args.mapping_file)
     if args.old_location == "" or args.new_location == "":
         raise ValueError(
             "Please provide a location where the tracks are stored and where you want them to be stored."
         )
+    return {args.old_location: args.new_location}
+
+
+def verify_fast_path(path_to_rb: str, patched_path: str, rules: dict) -> bool:
+    """relocates the tracks again with the full parse of the xml file and compares the result with the patched xml file
+
+    Args:
+        path_to_rb (str): path to the original rekordbox xml file
+        patched_path (str): path to the xml file written by the fast path
+        rules (dict): the relocation rules
+
+    Returns:
+        bool: True if both contain exactly the same data
+    """
+    logger.info("Verifying the result against the full parse...")
+    benny = RB_handler(path_to_rb)
+    benny.relocate_tracks(rules=rules)
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        full_parse_path = os.path.join(temp_folder, "full_parse.xml")
+        benny.export_data_to_xml(out_path=full_parse_path)
+        is_equal = rekordbox_xml.load_rekordbox_xml(patched_path) == rekordbox_xml.load_rekordbox_xml(full_parse_path)
+
+    if is_equal:
+        logger.info("✅ The patched xml file is identical to the result of the full parse.")
+    else:
+        logger.error("🚨 The patched xml file DIFFERS from the result of the full parse!")
+    return is_equal
 
-    # changing the tracks location
-    benny.change_tracks_source_path(
-        old_location=args.old_location,
-        new_location=args.new_location,
-        location_of_interest=args.location_of_interest,
-    )
 
-    # saving the changed xml
-    benny.export_data_to_xml(out_path=args.save_location)
+def main(args):
+    logger.info("Start of program: change_location.py...")
+    rules = get_rules(args)
+
+    if args.fast:
+        if args.location_of_interest != "":
+            raise ValueError(
+                "The fast mode does not remove tracks. Don't pass a location of interest together with -f."
+            )
+        cnt_per_rule = rekordbox_xml.patch_track_locations(args.path_to_rb, args.save_location, rules)
+        logger.info(f"Changed location of {sum(cnt_per_rule.values())} tracks.")
+        for prefix, count in cnt_per_rule.items():
+            logger.info(f'- {count} tracks from "{prefix}" to "{rules[prefix]}"')
+
+        if args.verify:
+            verify_fast_path(args.path_to_rb, args.save_location, rules)
+    else:
+        # instantiating the RB Handler and giving him the name benny ;)
+        benny = RB_handler(args.path_to_rb)
+
+        # changing the tracks location
+        benny.relocate_tracks(
+            rules=rules,
+            location_of_interest=args.location_of_interest,
+        )
+
+        # saving the changed xml
+        benny.export_data_to_xml(out_path=args.save_location)
     logger.info("End of program: change_location.py\n")
 
 
@@ -48,6 +108,9 @@ if __name__ == "__main__":
     parser.add_argument("-n", "--new_location", default="")
     parser.add_argument("-p", "--save_location", default="")
     parser.add_argument("-l", "--location_of_interest", default="")
+    parser.add_argument("-m", "--mapping_file", default="")
+    parser.add_argument("-f", "--fast", action="store_true")
+    parser.add_argument("-v", "--verify", action="store_true")
 
     args = parser.parse_args()
     main(args)
@@ -1,18 +1,280 @@
 # This script checks for duplicates in your rekordbox xml file.
 # Pass the path to your rekordbox.xml file as a program argument with the -p flag.
+# First it searches for tracks pointing to the same file on your harddisk.
+# Then it searches for the same song stored as different files (re-downloads, "(1)" copies, ...):
+# the tracks are put into buckets by their length, size and normalized name and artist,
+# just the files inside a bucket are compared by a hash of their audio data (the tags are ignored).
+# The number of processes used for hashing can be set with the -w flag,
+# with the -r flag the clusters are also written into a .csv or .json report.
+# With the -a flag the whole collection is also compared by acoustic fingerprints, to find the same song in a different encoding.
+# The fingerprints are cached (folder given with the -c flag, by default next to the xml file), so later runs just decode the new files.
 
 
 # system imports
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import logging
+import os
+import re
+import struct
+import unicodedata
+
+# 3rd party imports
+import numpy as np
+import pandas as pd
 
 # user imports
+import shared.audio_fingerprint as audio_fingerprint
 import shared.dataloading as dataloading
+import shared.locations as locations
 from shared.logging_config import setup_logging
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
+FINGERPRINT_CACHE_FOLDER_NAME = '.fingerprint_cache'
+HASH_CHUNK_SIZE = 1024 * 1024
+# the clusters of tracks with the same title, artist and length, but a different audio data hash
+UNVERIFIED_KIND = 'unverified: same title, artist and length'
+# suffixes of copies, like "Song (1)" or "Song copy"
+COPY_SUFFIX_PATTERN = re.compile(r'(\s*\(\d+\)|\s+copy)+$')
+
+
+def _normalize_title(text) -> str:
+    if not isinstance(text, str):
+        return ''
+    text = unicodedata.normalize('NFC', text).casefold()
+    text = COPY_SUFFIX_PATTERN.sub('', text)
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
+
+
+def _get_audio_range(file) -> tuple:
+    """finds the part of the audio file holding the audio data, so the tags are not part of the hash
+
+    Args:
+        file: the opened audio file
+
+    Returns:
+        tuple: start and end of the audio data in bytes
+    """
+    file.seek(0, os.SEEK_END)
+    end = file.tell()
+    file.seek(0)
+    header = file.read(12)
+
+    # mp4 / m4a: the audio data is in the mdat atom
+    if header[4:8] == b'ftyp':
+        position = 0
+        while position + 8 <= end:
+            file.seek(position)
+            size, atom_type = struct.unpack('>I4s', file.read(8))
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', file.read(8))[0]
+                header_size = 16
+            elif size == 0:
+                size = end - position
+            if atom_type == b'mdat':
+                return position + header_size, position + size
+            if size < header_size:
+                break
+            position += size
+        return 0, end
+
+    # flac: the audio frames follow the metadata blocks
+    if header[:4] == b'fLaC':
+        position = 4
+        is_last = False
+        while not is_last and position + 4 <= end:
+            file.seek(position)
+            block_header = file.read(4)
+            is_last = bool(block_header[0] & 0x80)
+            position += 4 + int.from_bytes(block_header[1:4], 'big')
+        return position, end
+
+    # mp3: skipping the ID3v2 tags at the start and the ID3v1 and APE tags at the end
+    start = 0
+    file.seek(0)
+    tag_header = file.read(10)
+    while tag_header[:3] == b'ID3' and len(tag_header) == 10:
+        size = 0
+        for byte in tag_header[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        start += 10 + size + (10 if tag_header[5] & 0x10 else 0)
+        file.seek(start)
+        tag_header = file.read(10)
+
+    if end - start >= 128:
+        file.seek(end - 128)
+        if file.read(3) == b'TAG':
+            end -= 128
+    if end - start >= 32:
+        file.seek(end - 32)
+        ape_footer = file.read(32)
+        if ape_footer[:8] == b'APETAGEX':
+            tag_size = struct.unpack('<I', ape_footer[12:16])[0]
+            has_header = struct.unpack('<I', ape_footer[20:24])[0] & 0x80000000
+            end -= tag_size + (32 if has_header else 0)
+
+    return start, max(start, end)
+
+
+def hash_audio_payload(path: str):
+    """calculates the hash of the audio data of the file, without its tags
+
+    Args:
+        path (str): path to the audio file
+
+    Returns:
+        str: the hex digest, or None if the file cannot be read
+    """
+    try:
+        with open(path, 'rb') as file:
+            start, end = _get_audio_range(file)
+            file.seek(start)
+            payload_hash = hashlib.blake2b(digest_size=16)
+            remaining = end - start
+            while remaining > 0:
+                chunk = file.read(min(HASH_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                payload_hash.update(chunk)
+                remaining -= len(chunk)
+            return payload_hash.hexdigest()
+    except (OSError, struct.error, ValueError):
+        # unreadable or truncated files (e.g. a cut off mp4 atom or ID3 header)
+        return None
+
+
+def get_candidate_buckets(data: pd.DataFrame) -> pd.Series:
+    """puts the tracks into buckets, that could hold the same song: same length and normalized name and artist,
+    or same length and size. Tracks connected through any of those keys end up in the same bucket.
+    Tracks with a missing length, name or size are not put into a bucket by the key missing it.
+
+    Args:
+        data (pd.DataFrame): the tracks
+
+    Returns:
+        pd.Series: the bucket of each track, just for the tracks in a bucket with at least two tracks
+    """
+    # an empty name is missing as well, otherwise all the tracks without a name of the same length would be one bucket
+    title_key = [data['@TotalTime'], data['@Name'].map(_normalize_title).replace('', None), data['@Artist'].map(_normalize_title)]
+    size_key = [data['@TotalTime'], data['@Size']]
+
+    def get_smallest_label(labels: pd.Series, key: list) -> pd.Series:
+        # the rows with a missing key get NaN from the groupby and keep their label
+        return labels.groupby(key, dropna=True).transform('min').fillna(labels).astype(labels.dtype)
+
+    # connected components: every track takes the smallest label of its buckets, until nothing changes anymore
+    labels = pd.Series(np.arange(len(data)), index=data.index)
+    while True:
+        new_labels = get_smallest_label(labels, title_key)
+        new_labels = get_smallest_label(new_labels, size_key)
+        if new_labels.equals(labels):
+            break
+        labels = new_labels
+
+    return labels[labels.duplicated(keep=False)]
+
+
+def _sort_by_keeper(cluster: pd.DataFrame) -> pd.DataFrame:
+    """sorts the tracks of a cluster, the one to keep comes first: highest bitrate, most played, best rated, oldest"""
+    return cluster.sort_values(
+        by=['@BitRate', '@PlayCount', '@Rating', '@DateAdded'],
+        ascending=[False, False, False, True],
+        na_position='last',
+    )
+
+
+def find_content_duplicates(data: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    """searches for tracks with the same audio data inside the candidate buckets.
+    Buckets whose tracks have a different audio data are returned as unverified clusters, with every track kept.
+
+    Args:
+        data (pd.DataFrame): the tracks
+        workers (int, optional): number of processes used for hashing. Defaults to the number of cpus.
+
+    Returns:
+        pd.DataFrame: the tracks of all the clusters with the columns cluster, kind, keep, @Name, @Artist and @Location
+    """
+    buckets = get_candidate_buckets(data)
+    candidates = data.loc[buckets.index, ['@Name', '@Artist', '@Location', '@BitRate', '@PlayCount', '@Rating', '@DateAdded']].copy()
+    candidates['bucket'] = buckets
+    logger.info(f'Found {len(candidates)} candidates in {buckets.nunique()} buckets out of {len(data)} tracks. Hashing their audio data...')
+
+    paths = locations.decode_locations(candidates['@Location']).tolist()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        candidates['payload_hash'] = list(executor.map(hash_audio_payload, paths, chunksize=8))
+
+    missing = candidates['payload_hash'].isna()
+    if missing.any():
+        logger.warning(f'Could not read {missing.sum()} files:')
+        for location in candidates.loc[missing, '@Location']:
+            logger.warning('- ' + location)
+
+    clusters = []
+    # same audio data: these are for sure duplicates
+    identical = candidates[~missing & candidates.duplicated(subset=['bucket', 'payload_hash'], keep=False)]
+    for _, cluster in identical.groupby(['bucket', 'payload_hash'], sort=False):
+        clusters.append(_sort_by_keeper(cluster).assign(kind='identical audio'))
+
+    # the rest of the buckets: maybe the same song in a different file (like another format or bitrate),
+    # but the hash didn't confirm it, so every track of these clusters is kept
+    rest = candidates[~candidates.index.isin(identical.index)]
+    rest = rest[rest.duplicated(subset=['bucket'], keep=False)]
+    for _, cluster in rest.groupby('bucket', sort=False):
+        clusters.append(_sort_by_keeper(cluster).assign(kind=UNVERIFIED_KIND))
+
+    if len(clusters) == 0:
+        return pd.DataFrame(columns=['cluster', 'kind', 'keep', '@Name', '@Artist', '@Location'])
+
+    for cluster_id, cluster in enumerate(clusters):
+        cluster['cluster'] = cluster_id
+        if cluster['kind'].iloc[0] == UNVERIFIED_KIND:
+            cluster['keep'] = True
+        else:
+            cluster['keep'] = [True] + [False] * (len(cluster) - 1)
+    return pd.concat(clusters, ignore_index=True)[['cluster', 'kind', 'keep', '@Name', '@Artist', '@Location']]
+
+
+def find_acoustic_duplicates(data: pd.DataFrame, cache_folder: str, workers: int = None) -> pd.DataFrame:
+    """searches the whole collection for tracks with a similar acoustic fingerprint
+
+    Args:
+        data (pd.DataFrame): the tracks
+        cache_folder (str): folder of the fingerprint cache
+        workers (int, optional): number of processes used for decoding. Defaults to the number of cpus.
+
+    Returns:
+        pd.DataFrame: the tracks of all the clusters with the columns cluster, kind, keep, @Name, @Artist and @Location
+    """
+    data = data.reset_index(drop=True)
+    paths = locations.decode_locations(data['@Location']).tolist()
+    fingerprints = audio_fingerprint.load_fingerprints(paths, cache_folder, workers=workers)
+    similar_tracks = audio_fingerprint.find_similar_tracks(fingerprints)
+
+    # connected components of the similar pairs
+    labels = {}
+    for index_a, index_b, _ in similar_tracks:
+        label_a = labels.setdefault(index_a, {index_a})
+        label_b = labels.setdefault(index_b, {index_b})
+        if label_a is not label_b:
+            label_a |= label_b
+            for index in label_b:
+                labels[index] = label_a
+
+    clusters = []
+    for members in {id(members): members for members in labels.values()}.values():
+        cluster = _sort_by_keeper(data.loc[sorted(members)]).assign(kind='similar audio')
+        cluster['cluster'] = len(clusters)
+        cluster['keep'] = [True] + [False] * (len(cluster) - 1)
+        clusters.append(cluster)
+
+    if len(clusters) == 0:
+        return pd.DataFrame(columns=['cluster', 'kind', 'keep', '@Name', '@Artist', '@Location'])
+    return pd.concat(clusters, ignore_index=True)[['cluster', 'kind', 'keep', '@Name', '@Artist', '@Location']]
+
 
 def main(args):
     logger.info('Start of program: check_for_duplicates.py...')
@@ -22,16 +284,10 @@ def main(args):
         raise ValueError(
             'Please provide a valid .xml filepath to your rekordbox database as a program argument!')
 
-    data = dataloading.load_dataframe_from_rekordbox_xml(filepath)
+    data = dataloading.load_typed_dataframe_from_rekordbox_xml(filepath)
 
     # searching for duplicates
-    results = data['@Location'].duplicated()
-
-    # printing the names of the duplicated songs
-    duplicate_songnames = []
-    for index, result in enumerate(results):
-        if result:
-            duplicate_songnames.append(data.iloc[index]['@Name'])
+    duplicate_songnames = data.loc[data['@Location'].duplicated(), '@Name'].tolist()
 
     if len(duplicate_songnames) != 0:
         logger.warning(
@@ -40,13 +296,52 @@ def main(args):
             logger.warning('- ' + currsong)
     else:
         logger.info('✅ No songs appearing more than once were found.')
-    
+
+    # searching for the same song stored in different files
+    data = data[locations.is_local_file(data['@Location'])].drop_duplicates(subset=['@Location'])
+    df_clusters = find_content_duplicates(data, workers=args.workers)
+    if args.acoustic:
+        cache_folder = args.cache_folder or os.path.join(os.path.dirname(os.path.abspath(filepath)), FINGERPRINT_CACHE_FOLDER_NAME)
+        df_acoustic = find_acoustic_duplicates(data, cache_folder, workers=args.workers)
+        # the clusters already found by their audio data are not reported twice
+        known_locations = set(df_clusters.loc[df_clusters['kind'] == 'identical audio', '@Location'])
+        is_known = df_acoustic.groupby('cluster')['@Location'].transform(lambda locations: locations.isin(known_locations).all())
+        df_acoustic = df_acoustic[~is_known.astype(bool)]
+        if len(df_clusters) != 0:
+            df_acoustic['cluster'] += df_clusters['cluster'].max() + 1
+        df_clusters = pd.concat([df_clusters, df_acoustic], ignore_index=True)
+    is_unverified = df_clusters['kind'] == UNVERIFIED_KIND
+    if (~is_unverified).any():
+        logger.warning(f'🚨 {df_clusters.loc[~is_unverified, "cluster"].nunique()} SONGS WHERE FOUND stored in more than one file:')
+        for _, cluster in df_clusters[~is_unverified].groupby('cluster', sort=False):
+            logger.warning(f'- {cluster["@Name"].iloc[0]} - {cluster["@Artist"].iloc[0]} ({cluster["kind"].iloc[0]}):')
+            for keep, location in zip(cluster['keep'], cluster['@Location']):
+                logger.warning(f'    {"KEEP  " if keep else "REMOVE"} {location}')
+    else:
+        logger.info('✅ No songs stored in more than one file were found.')
+    if is_unverified.any():
+        logger.warning(f'{df_clusters.loc[is_unverified, "cluster"].nunique()} songs have the same title, artist and length, '
+                       + 'but a different audio data (not verified as duplicates, check them yourself or use the -a flag):')
+        for _, cluster in df_clusters[is_unverified].groupby('cluster', sort=False):
+            logger.warning(f'- {cluster["@Name"].iloc[0]} - {cluster["@Artist"].iloc[0]}:')
+            for location in cluster['@Location']:
+                logger.warning(f'    CHECK  {location}')
+
+    if args.report.endswith('.json'):
+        df_clusters.to_json(args.report, orient='records', indent=2, force_ascii=False)
+    elif args.report.endswith('.csv'):
+        df_clusters.to_csv(args.report, index=False)
+
     logger.info('End of program: check_for_duplicates.py\n')
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('-p', '--path_to_xml')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-r', '--report', default='')
+    parser.add_argument('-a', '--acoustic', action='store_true')
+    parser.add_argument('-c', '--cache_folder', default='')
     args = parser.parse_args()
 
     main(args)
@@ -25,7 +25,7 @@ def main(args):
                                args.loc_of_musicfiles, keys_to_update)
 
     # updating rekordbox 6 according to 5
-    mark.update_rb6_according_to_5()
+    mark.update_rb6_according_to_5(playlist_paths=args.playlists)
 
     # writing the log message. This holds information about what tracks were updated, which were skipped and so on
     mark.write_log_message()
@@ -42,6 +42,8 @@ if __name__ == "__main__":
     parser.add_argument('-6', '--path_to_rb6', default='')
     parser.add_argument('-l', '--loc_of_musicfiles', default='')
     parser.add_argument('-o', '--output_file', default='output.xml')
+    # e.g. -p "ROOT/My Folder" "ROOT/My Playlist". If not given, all playlists are converted
+    parser.add_argument('-p', '--playlists', nargs='*', default=None)
     
     args = parser.parse_args()
 
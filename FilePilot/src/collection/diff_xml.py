@@ -3,6 +3,7 @@
 # the new_xml_file should be in this format: rekordbox6_YYYY-MM-DD.xml
 # The changed files are outputted into the log file
 # Newly added songs are ignored.
+# Pass a .csv or .json filepath with the -r flag to also write all the differences into a report.
 
 
 # system imports
@@ -14,6 +15,7 @@ import sys
 sys.path.append('../src/')
 
 # 3rd party imports
+import numpy as np
 import pandas as pd
 
 # user imports
@@ -24,33 +26,128 @@ import shared.utils as utils
 setup_logging()
 logger = logging.getLogger(__name__)
 
-def drop_by_columns(new_file: pd.DataFrame, old_file: pd.DataFrame, columns_to_reimport: list, columns_to_delete_and_reimport: list):
-    df_reimport = pd.concat([new_file, old_file], axis=0).drop_duplicates(subset=columns_to_reimport, keep=False)
-    df_delete_reimport = pd.concat([new_file, old_file], axis=0).drop_duplicates(subset=columns_to_delete_and_reimport, keep=False)
-
-    # if we have a specific song, which was not dropped by the previous drop duplicates, we have a difference!
-    # The song shows up twice, because it is present in new_file and old_file - we only want it once, to be able to print it out
-    df_reimport.drop_duplicates(subset=['@Location'], keep='first', inplace=True)
-    df_delete_reimport.drop_duplicates(subset=['@Location'], keep='first', inplace=True)
-
-    df_reimport['action'] = 'REIMPORT'
-    df_delete_reimport['action'] = 'DELETE & REIMPORT'
-
-    df_changed = pd.concat([df_reimport, df_delete_reimport], axis=0).drop_duplicates(subset=['@Location'], keep='last')
-
-    df_changed = df_changed.sort_values(by='action', inplace=False).reset_index(drop=True)
-
-    logger.info(f'Found {len(df_changed)} differences (excluding the ones, that are simply new, or not in the specified location of interest')
-    files_to_remove = []
-    for _, row in df_changed.iterrows():
-        if row['ComesFrom'] == 'old_file':
-            files_to_remove.append(row)
-        else:
-            logger.info(f'Please {row["action"]} {row["@Name"]} - {row["@Artist"]}')
-    
-    logger.info(f"Found {len(files_to_remove)} files that should be missing within rekordbox:")
-    for row in files_to_remove:
-        logger.info(f'Please DELETE {row["@Name"]} - {row["@Artist"]}')
+# the order in which the differences are reported
+ACTIONS = ['DELETE & REIMPORT', 'REIMPORT', 'DELETE', 'NEW']
+
+
+def _hash_rows(df: pd.DataFrame, columns: list) -> pd.Series:
+    """calculates one 64-bit hash per row over the given columns
+
+    Args:
+        df (pd.DataFrame): the tracks
+        columns (list): the columns that go into the hash
+
+    Returns:
+        pd.Series: the hash of each row as nullable UInt64, so it survives an outer join
+    """
+    return pd.util.hash_pandas_object(df[columns], index=False).astype('UInt64')
+
+
+def _prepare_for_diff(df: pd.DataFrame, columns: list, columns_to_reimport: list, columns_to_delete_and_reimport: list) -> pd.DataFrame:
+    len_before = len(df)
+    df = df.drop_duplicates(subset=['@Location'], keep='first')
+    if len_before != len(df):
+        logger.warning(f'Ignored {len_before - len(df)} tracks pointing to a location, that is already used by another track')
+
+    # the categories of both files differ, comparing them is only possible as plain values
+    df_prepared = df[columns].astype({column: object for column in columns if df[column].dtype == 'category'})
+    df_prepared['hash_reimport'] = _hash_rows(df, columns_to_reimport)
+    df_prepared['hash_delete_and_reimport'] = _hash_rows(df, columns_to_delete_and_reimport)
+    return df_prepared
+
+
+def diff_collections(new_file: pd.DataFrame, old_file: pd.DataFrame, columns_to_reimport: list, columns_to_delete_and_reimport: list) -> pd.DataFrame:
+    """compares the tracks of both files, joined on their @Location. For every track one hash per column set is compared:
+    tracks that differ in columns_to_delete_and_reimport need to be deleted and reimported,
+    tracks that differ just in columns_to_reimport need to be reimported.
+    Tracks that are only in the old file need to be deleted, the ones only in the new file are new.
+
+    Args:
+        new_file (pd.DataFrame): tracks of the new xml file
+        old_file (pd.DataFrame): tracks of the old xml file
+        columns_to_reimport (list): columns, that need a reimport when they change
+        columns_to_delete_and_reimport (list): columns, that need a delete and reimport when they change
+
+    Returns:
+        pd.DataFrame: one row per difference with the columns action, @Location, @Name, @Artist and changed_columns
+    """
+    columns = list(dict.fromkeys(['@Location', '@Name', '@Artist'] + columns_to_reimport + columns_to_delete_and_reimport))
+    df_new = _prepare_for_diff(new_file, columns, columns_to_reimport, columns_to_delete_and_reimport)
+    df_old = _prepare_for_diff(old_file, columns, columns_to_reimport, columns_to_delete_and_reimport)
+
+    df_merged = df_new.merge(df_old, on='@Location', how='outer', suffixes=('_new', '_old'), indicator=True)
+    in_both = (df_merged['_merge'] == 'both').to_numpy()
+
+    def differs(column: str):
+        return (df_merged[f'{column}_new'] != df_merged[f'{column}_old']).to_numpy(dtype=bool, na_value=False) & in_both
+
+    df_merged['action'] = np.select(
+        [
+            differs('hash_delete_and_reimport'),
+            differs('hash_reimport'),
+            (df_merged['_merge'] == 'right_only').to_numpy(),
+            (df_merged['_merge'] == 'left_only').to_numpy(),
+        ],
+        ACTIONS,
+        default='',
+    )
+    df_changed = df_merged[df_merged['action'] != ''].reset_index(drop=True)
+
+    # listing the columns that changed, a missing value on both sides is no change
+    changed_columns = pd.Series('', index=df_changed.index)
+    for column in columns:
+        if column == '@Location':
+            continue
+        values_new = df_changed[f'{column}_new']
+        values_old = df_changed[f'{column}_old']
+        is_changed = ~((values_new == values_old).fillna(False) | (values_new.isna() & values_old.isna()))
+        is_changed &= df_changed['_merge'] == 'both'
+        changed_columns[is_changed] += column + ' '
+
+    df_diff = pd.DataFrame({
+        'action': pd.Categorical(df_changed['action'], categories=ACTIONS, ordered=True),
+        '@Location': df_changed['@Location'],
+        '@Name': df_changed['@Name_new'].combine_first(df_changed['@Name_old']),
+        '@Artist': df_changed['@Artist_new'].combine_first(df_changed['@Artist_old']),
+        'changed_columns': changed_columns.str.strip(),
+    })
+    return df_diff.sort_values(by=['action', '@Name'], kind='stable').reset_index(drop=True)
+
+
+def log_differences(df_diff: pd.DataFrame) -> None:
+    """writes the differences into the log
+
+    Args:
+        df_diff (pd.DataFrame): the differences as returned by diff_collections
+    """
+    counts = df_diff['action'].value_counts()
+    logger.info(f'Found {counts["REIMPORT"] + counts["DELETE & REIMPORT"]} differences (excluding the ones, that are simply new, or not in the specified location of interest')
+    df_changed = df_diff[df_diff['action'].isin(['DELETE & REIMPORT', 'REIMPORT'])]
+    for action, name, artist, changed_columns in zip(df_changed['action'], df_changed['@Name'], df_changed['@Artist'], df_changed['changed_columns']):
+        logger.info(f'Please {action} {name} - {artist} ({changed_columns})')
+
+    logger.info(f"Found {counts['DELETE']} files that should be missing within rekordbox:")
+    df_delete = df_diff[df_diff['action'] == 'DELETE']
+    for name, artist in zip(df_delete['@Name'], df_delete['@Artist']):
+        logger.info(f'Please DELETE {name} - {artist}')
+
+    logger.info(f"Found {counts['NEW']} tracks, that are only in the new file (not reported in detail)")
+
+
+def write_report(df_diff: pd.DataFrame, report_path: str) -> None:
+    """writes the differences into a .csv or .json file
+
+    Args:
+        df_diff (pd.DataFrame): the differences as returned by diff_collections
+        report_path (str): path of the report. The format is chosen by the file extension.
+    """
+    if report_path.endswith('.json'):
+        df_diff.to_json(report_path, orient='records', indent=2, force_ascii=False)
+    elif report_path.endswith('.csv'):
+        df_diff.to_csv(report_path, index=False)
+    else:
+        raise ValueError(f'Please provide a .csv or .json file for the report. You passed {report_path}')
+    logger.info(f'Wrote the differences to {report_path}')
 
 
 def main(args):
@@ -62,10 +159,11 @@ def main(args):
     new_file_path = os.path.join(datapath, config['new_xml_file'])
     old_file_path = os.path.join(datapath, config['old_xml_file'])
     logger.info(f"Calculating the difference between new_file: {new_file_path} and old_file: {old_file_path}")
-    new_file = dataloading.load_dataframe_from_rekordbox_xml(new_file_path)
-    old_file = dataloading.load_dataframe_from_rekordbox_xml(old_file_path)
+    new_file = dataloading.load_typed_dataframe_from_rekordbox_xml(new_file_path)
+    old_file = dataloading.load_typed_dataframe_from_rekordbox_xml(old_file_path)
 
-    columns_to_consider = config['columns_to_consider'] + config['columns_to_consider_and_reimport']
+    # a column could be listed in both lists, but it must be selected just once. Name and artist are needed for the report
+    columns_to_consider = list(dict.fromkeys(['@Location', '@Name', '@Artist'] + config['columns_to_consider'] + config['columns_to_consider_and_reimport']))
     new_file = new_file[columns_to_consider]
     old_file = old_file[columns_to_consider]
 
@@ -85,11 +183,10 @@ def main(args):
 
     assert len(old_file[old_file['@Location'].str.startswith(config['location_to_consider'])]) == len(old_file), logger.error(f'Found files with a different location than {config["location_to_consider"]} in old file')
     
-    # i need those to understand afterwars where the rows come from
-    new_file['ComesFrom'] = 'new_file'
-    old_file['ComesFrom'] = 'old_file'
-
-    drop_by_columns(new_file, old_file, config['columns_to_consider'], config['columns_to_consider_and_reimport'])
+    df_diff = diff_collections(new_file, old_file, config['columns_to_consider'], config['columns_to_consider_and_reimport'])
+    log_differences(df_diff)
+    if args.report != '':
+        write_report(df_diff, args.report)
 
     # TODO: I don't want to calculate the filename again. Can't i get the logger handler somehow?
     if utils.query_yes_no('Open the log file?'):
@@ -100,6 +197,7 @@ def main(args):
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('-c', '--config')
+    parser.add_argument('-r', '--report', default='')
 
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,130 @@
+# This script searches for the tracks of your rekordbox xml file, whose file doesn't exist anymore.
+# Pass the path to your rekordbox.xml file as a program argument with the -p flag.
+# Every folder of the collection is listed just once (in parallel, the number of threads is set with the -w flag),
+# instead of checking each file on its own.
+# If you pass your music folder with the -m flag, it is walked once and for every missing track
+# a new location is suggested: a file with the same name (and if possible the same size).
+# With the -r flag the missing tracks are also written into a .csv or .json report.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import os
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+import shared.dataloading as dataloading
+import shared.locations as locations
+import shared.music_folder as music_folder
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def find_missing_tracks(data: pd.DataFrame, workers: int = music_folder.SCAN_WORKERS) -> pd.DataFrame:
+    """searches for the tracks whose file doesn't exist
+
+    Args:
+        data (pd.DataFrame): the tracks
+        workers (int, optional): number of threads listing the folders. Defaults to music_folder.SCAN_WORKERS.
+
+    Returns:
+        pd.DataFrame: the missing tracks, with the additional column path
+    """
+    paths = locations.decode_locations(data['@Location']).map(music_folder.normalize_path)
+    parts = paths.str.rpartition('/')
+    folders, filenames = parts[0], parts[2]
+
+    listings = music_folder.list_directories(folders.unique().tolist(), workers=workers)
+    logger.info(f'Listed {len(listings)} folders of {len(data)} tracks.')
+    # compared like in find_orphaned_files.py, so a file is never missing and orphaned at the same time
+    existing_paths = {music_folder.get_path_key(folder + '/' + filename) for folder, filenames_in_folder in listings.items()
+                      if filenames_in_folder is not None for filename in filenames_in_folder}
+
+    is_missing = ~paths.map(music_folder.get_path_key).isin(existing_paths)
+    return data[is_missing].assign(path=paths[is_missing])
+
+
+def suggest_relocations(df_missing: pd.DataFrame, music_files: pd.DataFrame) -> pd.DataFrame:
+    """looks up the filenames of the missing tracks in the files of the music folder.
+    A file with the same name and size is preferred over one with just the same name.
+
+    Args:
+        df_missing (pd.DataFrame): the missing tracks, with the column path
+        music_files (pd.DataFrame): the files of the music folder, as returned by music_folder.walk_music_folder
+
+    Returns:
+        pd.DataFrame: df_missing with the additional columns suggested_location, match and candidates
+    """
+    music_files = music_files.assign(
+        name_key=music_files['path'].map(lambda path: music_folder.get_path_key(os.path.basename(path))))
+    df_missing = df_missing.assign(
+        name_key=df_missing['path'].map(lambda path: music_folder.get_path_key(os.path.basename(path))),
+        row=range(len(df_missing)))
+
+    df_matches = df_missing[['row', 'name_key', '@Size']].merge(music_files[['name_key', 'path', 'size']], on='name_key')
+    df_matches['same_size'] = df_matches['@Size'].eq(df_matches['size']).fillna(False).astype(bool)
+    df_matches = df_matches.sort_values(['row', 'same_size'], ascending=[True, False])
+    df_best = df_matches.drop_duplicates(subset=['row']).set_index('row')
+
+    rows = df_missing['row']
+    df_missing['suggested_location'] = rows.map(locations.encode_paths(df_best['path'])).fillna('')
+    df_missing['match'] = rows.map(df_best['same_size'].map({True: 'name and size', False: 'name'})).fillna('')
+    df_missing['candidates'] = rows.map(df_matches.groupby('row').size()).fillna(0).astype(int)
+    return df_missing.drop(columns=['name_key', 'row'])
+
+
+def main(args):
+    logger.info('Start of program: find_missing_files.py...')
+    filepath = args.path_to_xml
+
+    if filepath is None:
+        raise ValueError(
+            'Please provide a valid .xml filepath to your rekordbox database as a program argument!')
+
+    data = dataloading.load_typed_dataframe_from_rekordbox_xml(filepath)
+    data = data[locations.is_local_file(data['@Location'])].drop_duplicates(subset=['@Location'])
+
+    df_missing = find_missing_tracks(data, workers=args.workers)
+    if len(df_missing) == 0:
+        logger.info('✅ The files of all the tracks exist.')
+        logger.info('End of program: find_missing_files.py\n')
+        return
+
+    if args.music_folder != '':
+        music_files = music_folder.walk_music_folder(args.music_folder, workers=args.workers)
+        logger.info(f'Found {len(music_files)} audio files in {args.music_folder}.')
+        df_missing = suggest_relocations(df_missing, music_files)
+    else:
+        df_missing = df_missing.assign(suggested_location='', match='', candidates=0)
+
+    logger.warning(f'🚨 {len(df_missing)} TRACKS WHERE FOUND whose file does not exist:')
+    for name, location, suggested_location, match in zip(
+            df_missing['@Name'], df_missing['@Location'], df_missing['suggested_location'], df_missing['match']):
+        logger.warning(f'- {name}: {location}')
+        if suggested_location != '':
+            logger.warning(f'    found by {match}: {suggested_location}')
+    logger.info(f'Found a new location for {(df_missing["suggested_location"] != "").sum()} of them.')
+
+    df_report = df_missing[['@Name', '@Artist', '@Location', 'suggested_location', 'match', 'candidates']]
+    if args.report.endswith('.json'):
+        df_report.to_json(args.report, orient='records', indent=2, force_ascii=False)
+    elif args.report.endswith('.csv'):
+        df_report.to_csv(args.report, index=False)
+
+    logger.info('End of program: find_missing_files.py\n')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--path_to_xml')
+    parser.add_argument('-m', '--music_folder', default='')
+    parser.add_argument('-w', '--workers', type=int, default=music_folder.SCAN_WORKERS)
+    parser.add_argument('-r', '--report', default='')
+    args = parser.parse_args()
+
+    main(args)
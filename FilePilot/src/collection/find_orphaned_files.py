@@ -0,0 +1,92 @@
+# This script searches for the audio files in your music folder, that are not part of your rekordbox collection.
+# Pass the path to your rekordbox.xml file as a program argument with the -p flag and your music folder with the -m flag.
+# The music folder is walked once, the top-level folders in parallel (the number of threads is set with the -w flag).
+# Just the files with the extensions given with the -e flag (by default all the audio files)
+# and older than the number of days given with the -d flag are listed.
+# With the -r flag the orphaned files are also written into a .csv or .json report.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+import shared.dataloading as dataloading
+import shared.locations as locations
+import shared.music_folder as music_folder
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def find_orphaned_files(data: pd.DataFrame, music_files: pd.DataFrame) -> pd.DataFrame:
+    """searches for the files of the music folder, that no track of the collection points to
+
+    Args:
+        data (pd.DataFrame): the tracks
+        music_files (pd.DataFrame): the files of the music folder, as returned by music_folder.walk_music_folder
+
+    Returns:
+        pd.DataFrame: the orphaned files with the columns path, size and mtime
+    """
+    is_local_file = locations.is_local_file(data['@Location'])
+    collection_paths = set(locations.decode_locations(data.loc[is_local_file, '@Location']).map(music_folder.get_path_key))
+    is_orphaned = ~music_files['path'].map(music_folder.get_path_key).isin(collection_paths)
+    return music_files[is_orphaned].sort_values('path').reset_index(drop=True)
+
+
+def main(args):
+    logger.info('Start of program: find_orphaned_files.py...')
+    filepath = args.path_to_xml
+
+    if filepath is None:
+        raise ValueError(
+            'Please provide a valid .xml filepath to your rekordbox database as a program argument!')
+    if args.music_folder == '':
+        raise ValueError('Please provide the music folder you want to search for orphaned files.')
+
+    extensions = music_folder.AUDIO_EXTENSIONS
+    if args.extensions:
+        extensions = tuple('.' + extension.lower().lstrip('.') for extension in args.extensions)
+
+    data = dataloading.load_typed_dataframe_from_rekordbox_xml(filepath)
+    music_files = music_folder.walk_music_folder(args.music_folder, extensions=extensions, workers=args.workers)
+    logger.info(f'Found {len(music_files)} audio files in {args.music_folder}.')
+
+    df_orphaned = find_orphaned_files(data, music_files)
+    if args.days > 0:
+        # the modification times are naive UTC (see music_folder.walk_music_folder), so now is taken in UTC as well
+        now = pd.Timestamp.now(tz='UTC').tz_localize(None)
+        df_orphaned = df_orphaned[df_orphaned['mtime'] < now - pd.Timedelta(days=args.days)]
+
+    if len(df_orphaned) != 0:
+        logger.warning(f'🚨 {len(df_orphaned)} FILES WHERE FOUND that are not part of your collection '
+                       + f'({df_orphaned["size"].sum() / 1024 ** 3:.2f} GB):')
+        for path, size in zip(df_orphaned['path'], df_orphaned['size']):
+            logger.warning(f'- {path} ({size / 1024 ** 2:.1f} MB)')
+    else:
+        logger.info('✅ No audio files were found that are not part of your collection.')
+
+    if args.report.endswith('.json'):
+        df_orphaned.to_json(args.report, orient='records', indent=2, force_ascii=False, date_format='iso')
+    elif args.report.endswith('.csv'):
+        df_orphaned.to_csv(args.report, index=False)
+
+    logger.info('End of program: find_orphaned_files.py\n')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--path_to_xml')
+    parser.add_argument('-m', '--music_folder', default='')
+    parser.add_argument('-e', '--extensions', nargs='*', default=[])
+    parser.add_argument('-d', '--days', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int, default=music_folder.SCAN_WORKERS)
+    parser.add_argument('-r', '--report', default='')
+    args = parser.parse_args()
+
+    main(args)
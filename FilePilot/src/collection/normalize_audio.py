@@ -1,71 +1,235 @@
 # This script normalizes the audio of all the files inside a given folder and saves the normalized audios to a new folder.
 # This new folder must already exist, and you need to pass the path to it via program argument.
 # NOTE: m4a songs are converted into mp3 songs, since the algorithm used cannot handle m4a songs.
-# under the hood pydub is used
+# The songs to normalize are chosen by their loudness: every song of the xml file (-x flag) is analyzed once
+# (integrated loudness like EBU R 128, cached in a .csv table next to the xml file or given with the -c flag)
+# and the songs below the loudness (-l flag, in LUFS) are copied into the source folder. Normalizing the peak just makes
+# songs louder, so songs that are too loud are left as they are.
+# Pass a keyword with the -k flag to choose the songs with this keyword in their comments instead (e.g. leise).
+# under the hood pydub and ffmpeg are used: each file is probed once and streamed through ffmpeg, several files at the same time
+# (the number of processes is set with the -w flag). The normalized files are recorded by their content hash in a manifest
+# in the destination folder; pass the -r flag to reuse the existing folders and continue an interrupted run.
 
 
 # system imports
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import hashlib
+import json
 import logging
 import os
-import shutil
+import re
+import subprocess
 import sys
 sys.path.append('../src/')
 
 # 3rd party imports
-from pydub import AudioSegment
-from pydub.effects import normalize
-from pydub.utils import mediainfo
+from pydub.utils import get_encoder_name, mediainfo
 from tqdm import tqdm
-import pandas as pd
 
 # user imports
 from shared.logging_config import setup_logging
+import shared.copy_engine as copy_engine
 import shared.dataloading as dataloading
+import shared.locations as locations
+import shared.loudness as loudness
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = '.normalize_manifest.json'
+LOUDNESS_CACHE_NAME = '.loudness_cache.csv'
+# integrated loudness in LUFS, the songs below it are normalized
+MIN_LOUDNESS = -12.0
+# dB left below 0 dBFS: ffmpeg reports the peak rounded to 0.1 dB and lossy encoders overshoot the peak a little
+NORMALIZE_HEADROOM = 0.5
+LOSSY_FORMATS = ('mp3', 'aac', 'ogg')
+# ffmpeg names some of the formats differently than their file extension
+FFMPEG_FORMATS = {'aif': 'aiff'}
+MAX_VOLUME_PATTERN = re.compile(r'max_volume:\s*(-?[\d.]+|-inf) dB')
+
 
 def copy_leise_songs_to_directory(xml_file: str, destination_folder: str, keyword: str):
     logger.info(f'Searcihng the {xml_file} for songs with the keyword {keyword}.')
-    data_dict = dataloading.get_dict_from_xml(xml_file)
-    data = pd.DataFrame(data_dict['DJ_PLAYLISTS']['COLLECTION']['TRACK'])
+    data = dataloading.load_dataframe_from_rekordbox_xml(xml_file)
+
+    # the tracks of streaming services have no file to copy
+    data = data[locations.is_local_file(data['@Location'])]
+    location_series = data[data['@Comments'].str.contains(keyword, case=False, na=False)]['@Location'].drop_duplicates()
+    location_list = locations.decode_locations(location_series).to_list()
 
-    location_series = data[data['@Comments'].str.contains(keyword, case=False)]['@Location']
-    location_list = location_series.apply(lambda x: x[16:].replace('%20', ' ').replace(
-        '%26', '&').replace('%27', '\'').replace('%c3%ab', 'ë').replace('%5b', '[').replace('%5d', ']').replace('%c3%b6', 'ö').replace('%c3%bc', 'ü')).to_list()
-    
     logger.info(f'Found {len(location_list)} songs that have the keyword leise in it.')
     logger.info(f'Copy those songs to {destination_folder}.')
 
-    for file in tqdm(location_list):
-        shutil.copy(file, destination_folder)
+    copy_engine.copy_files_to_folder(location_list, destination_folder)
 
     return
-    
 
-def normalize_files(files: list, source_folder, destination_folder):
 
-    for file in tqdm(files, desc='Normalizing Audio', unit='song'):
-        # Load the audio file
-        audio = AudioSegment.from_file(os.path.join(source_folder, file))
+def copy_quiet_songs_to_directory(xml_file: str, destination_folder: str, min_loudness: float, cache_file: str,
+                                  workers: int = None):
+    """analyzes the loudness of all the songs of the xml file and copies the ones that are too quiet and can be made louder
+
+    Args:
+        xml_file (str): path to the rekordbox xml file
+        destination_folder (str): folder the songs are copied to
+        min_loudness (float): integrated loudness in LUFS, the songs below it are copied
+        cache_file (str): path to the .csv table caching the loudness of the files
+        workers (int, optional): number of processes analyzing the files. Defaults to the number of cpus.
+    """
+    logger.info(f'Analyzing the loudness of the songs in {xml_file}.')
+    data = dataloading.load_dataframe_from_rekordbox_xml(xml_file)
+    location_series = data[locations.is_local_file(data['@Location'])]['@Location'].drop_duplicates()
+
+    df_loudness = loudness.load_loudness(locations.decode_locations(location_series).to_list(), cache_file, workers=workers)
+    location_list = loudness.get_quiet_paths(df_loudness, min_loudness, -NORMALIZE_HEADROOM)
+
+    logger.info(f'Found {len(location_list)} songs with an integrated loudness below {min_loudness} LUFS.')
+    logger.info(f'Copy those songs to {destination_folder}.')
+
+    copy_engine.copy_files_to_folder(location_list, destination_folder)
+
+    return
+
+
+def _get_content_hash(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+def _load_manifest(manifest_path: str) -> dict:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _write_manifest(manifest: dict, manifest_path: str) -> None:
+    # written into a temporary file first, so an interruption never leaves a broken manifest
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+
+def get_max_volume(path: str) -> float:
+    """detects the peak of the audio file with the volumedetect filter of ffmpeg.
+    The file is decoded as a stream, so just the running peak is kept in memory.
 
-        # Normalize the audio without clipping
-        normalized_audio = normalize(audio, headroom=0)
+    Args:
+        path (str): path to the audio file
 
-        current_bitrate = mediainfo(os.path.join(source_folder, files[1]))['bit_rate']
-        curr_format = file[-3:]
-        
-        # ffmpeg not compatible with m4a... converting it to mp3
-        if curr_format == 'm4a':
-            logger.warning(f'Converted {file} from m4a to mp3 format!')
-            curr_format = 'mp3'
-            file = file[:-3] + 'mp3'
+    Returns:
+        float: the peak in dBFS, -inf for a silent file
+    """
+    result = subprocess.run(
+        [get_encoder_name(), '-hide_banner', '-nostats', '-i', path, '-map', '0:a:0', '-af', 'volumedetect', '-f', 'null', '-'],
+        capture_output=True, text=True, check=True)
+    match = MAX_VOLUME_PATTERN.search(result.stderr)
+    if match is None:
+        raise ValueError(f'ffmpeg did not report the peak of {path}')
+    return float(match.group(1))
 
-        # Export the normalized audio
-        normalized_audio.export(os.path.join(destination_folder, file),
-                                format=curr_format, bitrate=current_bitrate)
+
+def normalize_file(file: str, source_folder: str, destination_folder: str, content_hash: str = None) -> dict:
+    """normalizes the peak of the file to 0 dBFS (minus NORMALIZE_HEADROOM) and saves it in the destination folder.
+    The file is probed once, ffmpeg streams the decoding and the encoding, so no file is held in memory as a whole.
+    The output is written into a hidden partial file first and renamed when it is complete.
+
+    Args:
+        file (str): filename of the audio file
+        source_folder (str): folder of the audio file
+        destination_folder (str): folder the normalized file is saved in
+        content_hash (str, optional): the content hash of the file, if it is already known. Defaults to None.
+
+    Returns:
+        dict: the keys file, hash, output and status ('normalized' or 'converted' for m4a files saved as mp3)
+    """
+    source_path = os.path.join(source_folder, file)
+    if content_hash is None:
+        content_hash = _get_content_hash(source_path)
+
+    current_bitrate = mediainfo(source_path).get('bit_rate')
+    name, extension = os.path.splitext(file)
+    curr_format = extension[1:].lower()
+    status = 'normalized'
+
+    # ffmpeg not compatible with m4a... converting it to mp3
+    if curr_format == 'm4a':
+        curr_format = 'mp3'
+        status = 'converted'
+    output = name + '.' + curr_format if status == 'converted' else file
+
+    gain = 0.0
+    max_volume = get_max_volume(source_path)
+    if max_volume != float('-inf'):
+        gain = -max_volume - NORMALIZE_HEADROOM
+
+    temp_path = os.path.join(destination_folder, '.partial-' + output)
+    command = [get_encoder_name(), '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path,
+               '-map', '0:a:0', '-map_metadata', '0', '-af', f'volume={gain:.2f}dB']
+    if curr_format in LOSSY_FORMATS and current_bitrate:
+        command += ['-b:a', current_bitrate]
+    command += ['-f', FFMPEG_FORMATS.get(curr_format, curr_format), temp_path]
+    subprocess.run(command, capture_output=True, text=True, check=True)
+    os.replace(temp_path, os.path.join(destination_folder, output))
+
+    return {'file': file, 'hash': content_hash, 'output': output, 'status': status}
+
+
+def normalize_files(files: list, source_folder: str, destination_folder: str, workers: int = None):
+    """normalizes the files in a process pool. Every normalized file is recorded by its content hash in a manifest
+    in the destination folder, so files normalized before are skipped and an interrupted run just continues.
+    The files are hashed and checked against the manifest in this process (in threads, hashlib releases the GIL
+    while hashing), so just the files to normalize and their hashes are sent to the processes.
+
+    Args:
+        files (list): filenames of the audio files
+        source_folder (str): folder of the audio files
+        destination_folder (str): folder the normalized files are saved in
+        workers (int, optional): number of processes. Defaults to the number of cpus.
+    """
+    manifest_path = os.path.join(destination_folder, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    done = {content_hash: record['output'] for content_hash, record in manifest.items()}
+
+    cnt_per_status = {'skipped': 0, 'normalized': 0, 'converted': 0, 'failed': 0}
+    files_to_normalize = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_get_content_hash, os.path.join(source_folder, file)): file for file in files}
+        for future in as_completed(futures):
+            try:
+                content_hash = future.result()
+            except OSError as e:
+                cnt_per_status['failed'] += 1
+                logger.error(f'Could not read {futures[future]}: {e}')
+                continue
+
+            output = done.get(content_hash)
+            if output is not None and os.path.exists(os.path.join(destination_folder, output)):
+                cnt_per_status['skipped'] += 1
+            else:
+                files_to_normalize.append((futures[future], content_hash))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(normalize_file, file, source_folder, destination_folder, content_hash): file
+                   for file, content_hash in files_to_normalize}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Normalizing Audio', unit='song'):
+            try:
+                result = future.result()
+            except Exception as e:
+                cnt_per_status['failed'] += 1
+                logger.error(f'Could not normalize {futures[future]}: {e}')
+                continue
+
+            cnt_per_status[result['status']] += 1
+            if result['status'] == 'converted':
+                logger.warning(f'Converted {result["file"]} from m4a to mp3 format!')
+            manifest[result['hash']] = {'file': result['file'], 'output': result['output']}
+            _write_manifest(manifest, manifest_path)
+
+    logger.info(f'Normalized {cnt_per_status["normalized"] + cnt_per_status["converted"]} files, '
+                + f'skipped {cnt_per_status["skipped"]} already normalized ones, {cnt_per_status["failed"]} failed.')
 
 
 def main(args):
@@ -74,24 +238,32 @@ def main(args):
     destination_folder = args.destination
     xml_file = args.xmlfile
 
-    if not os.path.exists(args.source):
-        os.mkdir(args.source)
+    if args.resume:
+        os.makedirs(source_folder, exist_ok=True)
+        os.makedirs(destination_folder, exist_ok=True)
     else:
-        logger.warning(f'Folder {source_folder} already exists. Aborting...')
-        raise FileExistsError(f'Folder {source_folder} already exists. Aborting...')
-    if not os.path.exists(args.destination):
-        os.mkdir(args.destination)
-    else:
-        logger.warning(f'Folder {destination_folder} already exists. Aborting...')
-        raise FileExistsError(f'Folder {destination_folder} already exists. Aborting...')
+        if not os.path.exists(args.source):
+            os.mkdir(args.source)
+        else:
+            logger.warning(f'Folder {source_folder} already exists. Aborting...')
+            raise FileExistsError(f'Folder {source_folder} already exists. Aborting...')
+        if not os.path.exists(args.destination):
+            os.mkdir(args.destination)
+        else:
+            logger.warning(f'Folder {destination_folder} already exists. Aborting...')
+            raise FileExistsError(f'Folder {destination_folder} already exists. Aborting...')
     
     # copy files into a new folder
-    copy_leise_songs_to_directory(xml_file, source_folder, 'leise')
+    if args.keyword != '':
+        copy_leise_songs_to_directory(xml_file, source_folder, args.keyword)
+    else:
+        cache_file = args.cache_file or os.path.join(os.path.dirname(os.path.abspath(xml_file)), LOUDNESS_CACHE_NAME)
+        copy_quiet_songs_to_directory(xml_file, source_folder, args.min_loudness, cache_file, workers=args.workers)
 
     files = [f for f in os.listdir(source_folder) if os.path.isfile(os.path.join(source_folder, f)) and not f.startswith('.')]
-    # normalize_files(files, source_folder, destination_folder)
+    normalize_files(files, source_folder, destination_folder, workers=args.workers)
 
-    logger.info('Start of program: normalize_audio.py\n')
+    logger.info('End of program: normalize_audio.py\n')
 
 
 if __name__ == "__main__":
@@ -100,6 +272,11 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--source')
     parser.add_argument('-d', '--destination')
     parser.add_argument('-x', '--xmlfile')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-r', '--resume', action='store_true')
+    parser.add_argument('-l', '--min_loudness', type=float, default=MIN_LOUDNESS)
+    parser.add_argument('-c', '--cache_file', default='')
+    parser.add_argument('-k', '--keyword', default='')
 
     args = parser.parse_args()
 
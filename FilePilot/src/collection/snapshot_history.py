@@ -0,0 +1,243 @@
+# This script keeps the history of your rekordbox collection in a snapshot store.
+# Register your exports (named like rekordbox6_YYYY-MM-DD.xml) with the mode "register" (-x flag for the xml files).
+# For each snapshot just the values that changed since the previous one are appended to the store,
+# the current state is kept as one digest per track and column, so registering an unchanged collection costs almost nothing.
+# Afterwards you can ask the store without parsing the old exports again:
+# - mode "diff": what changed between two dates (-f and -t flags), optionally written to a .csv or .json report (-r flag)
+# - mode "history": the history of the tracks whose location contains the given text (-l flag)
+# The store folder is given with the -s flag.
+
+
+# system imports
+from argparse import ArgumentParser
+from datetime import date
+import logging
+import os
+import pickle
+import re
+import sys
+sys.path.append('../src/')
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+import shared.dataloading as dataloading
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# pseudo column of the changes, that tells if the track is part of the collection
+TRACK_PRESENCE = '__track__'
+SNAPSHOT_DATE_PATTERN = re.compile(r'rekordbox6_(\d{4}-\d{2}-\d{2})\.xml$')
+
+
+def _get_snapshot_date(xml_path: str) -> date:
+    match = SNAPSHOT_DATE_PATTERN.search(os.path.basename(xml_path))
+    if match is None:
+        raise ValueError(f'The file {xml_path} does not follow the naming convention rekordbox6_YYYY-MM-DD.xml')
+    return date.fromisoformat(match.group(1))
+
+
+def _to_values(series: pd.Series) -> pd.Series:
+    """converts the values into strings, missing values become None
+
+    Args:
+        series (pd.Series): values of one column
+
+    Returns:
+        pd.Series: the values as strings
+    """
+    values = series.astype(str).astype(object)
+    values[series.isna().to_numpy()] = None
+    return values
+
+
+def _get_column_digests(df: pd.DataFrame) -> pd.DataFrame:
+    """calculates one 64-bit digest per track and column
+
+    Args:
+        df (pd.DataFrame): the tracks, indexed by @Location
+
+    Returns:
+        pd.DataFrame: the digests, same index and columns as df
+    """
+    return pd.DataFrame(
+        {column: pd.util.hash_pandas_object(df[column], index=False).to_numpy() for column in df.columns},
+        index=df.index,
+    )
+
+
+def _load_state(store_folder: str) -> tuple:
+    """loads the digests of the last registered snapshot
+
+    Returns:
+        tuple: (date of the last snapshot or None, digests as DataFrame indexed by @Location)
+    """
+    state_path = os.path.join(store_folder, 'state.pkl')
+    if not os.path.exists(state_path):
+        return None, pd.DataFrame(index=pd.Index([], name='@Location'), dtype='uint64')
+    with open(state_path, 'rb') as file:
+        return pickle.load(file)
+
+
+def _changes_to_records(snapshot_date: date, locations: pd.Index, column: str, values: pd.Series) -> pd.DataFrame:
+    return pd.DataFrame({
+        'date': pd.Timestamp(snapshot_date),
+        '@Location': locations,
+        'column': column,
+        'value': values.to_numpy(),
+    })
+
+
+def register_snapshot(store_folder: str, xml_path: str) -> None:
+    """appends the changes of the snapshot since the last registered one to the store
+
+    Args:
+        store_folder (str): folder of the snapshot store
+        xml_path (str): path to the rekordbox xml export, named like rekordbox6_YYYY-MM-DD.xml
+    """
+    snapshot_date = _get_snapshot_date(xml_path)
+    changes_folder = os.path.join(store_folder, 'changes')
+    os.makedirs(changes_folder, exist_ok=True)
+
+    last_date, state = _load_state(store_folder)
+    if last_date is not None and snapshot_date <= last_date:
+        logger.warning(f'Skipped {xml_path}: the store already holds the snapshots up to {last_date}')
+        return
+
+    df = dataloading.load_typed_dataframe_from_rekordbox_xml(xml_path)
+    df = df.drop_duplicates(subset=['@Location'], keep='first').set_index('@Location')
+    digests = _get_column_digests(df)
+
+    added = digests.index.difference(state.index)
+    removed = state.index.difference(digests.index)
+    common = digests.index.intersection(state.index)
+
+    # a column that wasn't there before gets the digest 0, so every value of it counts as a change
+    changed = digests.loc[common].ne(state.reindex(index=common, columns=digests.columns, fill_value=0))
+
+    records = [
+        _changes_to_records(snapshot_date, added, TRACK_PRESENCE, pd.Series('added', index=added)),
+        _changes_to_records(snapshot_date, removed, TRACK_PRESENCE, pd.Series(None, index=removed, dtype=object)),
+    ]
+    for column in df.columns:
+        # the values of the new tracks are stored completely, for the others just the changed ones
+        locations = added.append(changed.index[changed[column].to_numpy()])
+        if len(locations) > 0:
+            records.append(_changes_to_records(snapshot_date, locations, column, _to_values(df.loc[locations, column])))
+    df_changes = pd.concat(records, ignore_index=True)
+
+    df_changes.to_pickle(os.path.join(changes_folder, f'{snapshot_date}.pkl'))
+    with open(os.path.join(store_folder, 'state.pkl'), 'wb') as file:
+        pickle.dump((snapshot_date, digests), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    logger.info(f'Registered snapshot {snapshot_date}: {len(added)} added, {len(removed)} removed '
+                + f'and {int(changed.any(axis=1).sum())} changed tracks ({len(df_changes)} stored values)')
+
+
+def load_changes(store_folder: str) -> pd.DataFrame:
+    """loads all the changes of the store
+
+    Args:
+        store_folder (str): folder of the snapshot store
+
+    Returns:
+        pd.DataFrame: the changes with the columns date, @Location, column and value, sorted by date
+    """
+    changes_folder = os.path.join(store_folder, 'changes')
+    filenames = sorted(f for f in os.listdir(changes_folder) if f.endswith('.pkl'))
+    if len(filenames) == 0:
+        raise ValueError(f'No snapshots registered in {store_folder}')
+    return pd.concat([pd.read_pickle(os.path.join(changes_folder, f)) for f in filenames], ignore_index=True)
+
+
+def _get_values_at(df_changes: pd.DataFrame, snapshot_date: date) -> pd.Series:
+    """returns the latest value of every track and column at the given date
+
+    Returns:
+        pd.Series: the value, indexed by @Location and column
+    """
+    df_changes = df_changes[df_changes['date'] <= pd.Timestamp(snapshot_date)]
+    return df_changes.drop_duplicates(subset=['@Location', 'column'], keep='last').set_index(['@Location', 'column'])['value']
+
+
+def changes_between(store_folder: str, date_from: date, date_to: date) -> pd.DataFrame:
+    """returns the values that differ between the collection at date_from and at date_to
+
+    Args:
+        store_folder (str): folder of the snapshot store
+        date_from (date): date of the first snapshot
+        date_to (date): date of the second snapshot
+
+    Returns:
+        pd.DataFrame: the columns @Location, column, value_from and value_to
+    """
+    df_changes = load_changes(store_folder)
+    is_in_between = (df_changes['date'] > pd.Timestamp(date_from)) & (df_changes['date'] <= pd.Timestamp(date_to))
+    keys = pd.MultiIndex.from_frame(df_changes.loc[is_in_between, ['@Location', 'column']].drop_duplicates())
+
+    # just the tracks that changed in between are of interest
+    df_changes = df_changes[df_changes['@Location'].isin(keys.get_level_values('@Location'))]
+    values_from = _get_values_at(df_changes, date_from).reindex(keys)
+    values_to = _get_values_at(df_changes, date_to).reindex(keys)
+    is_changed = (values_from != values_to) & ~(values_from.isna() & values_to.isna())
+
+    return pd.DataFrame({
+        'value_from': values_from[is_changed],
+        'value_to': values_to[is_changed],
+    }).reset_index()
+
+
+def track_history(store_folder: str, location_text: str) -> pd.DataFrame:
+    """returns all the changes of the tracks whose location contains location_text
+
+    Args:
+        store_folder (str): folder of the snapshot store
+        location_text (str): text to search for in the @Location of the tracks
+
+    Returns:
+        pd.DataFrame: the changes with the columns date, @Location, column and value
+    """
+    df_changes = load_changes(store_folder)
+    return df_changes[df_changes['@Location'].str.contains(location_text, regex=False)].reset_index(drop=True)
+
+
+def main(args):
+    logger.info('Start of program: snapshot_history.py...')
+
+    if args.mode == 'register':
+        for xml_path in sorted(args.xml_files, key=_get_snapshot_date):
+            register_snapshot(args.store, xml_path)
+    elif args.mode == 'diff':
+        df_diff = changes_between(args.store, date.fromisoformat(args.date_from), date.fromisoformat(args.date_to))
+        logger.info(f'Found {len(df_diff)} changed values between {args.date_from} and {args.date_to}:')
+        for location, column, value_from, value_to in df_diff.itertuples(index=False, name=None):
+            logger.info(f'{location}: {column} "{value_from}" -> "{value_to}"')
+        if args.report.endswith('.json'):
+            df_diff.to_json(args.report, orient='records', indent=2, force_ascii=False)
+        elif args.report.endswith('.csv'):
+            df_diff.to_csv(args.report, index=False)
+    elif args.mode == 'history':
+        df_history = track_history(args.store, args.location)
+        for snapshot_date, location, column, value in df_history.itertuples(index=False, name=None):
+            logger.info(f'{snapshot_date.date()} {location}: {column} = "{value}"')
+    else:
+        raise ValueError('Mode must be either "register", "diff" or "history"')
+
+    logger.info('End of program: snapshot_history.py\n')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('-m', '--mode', required=True)
+    parser.add_argument('-s', '--store', required=True)
+    parser.add_argument('-x', '--xml_files', nargs='*', default=[])
+    parser.add_argument('-f', '--date_from', default='')
+    parser.add_argument('-t', '--date_to', default='')
+    parser.add_argument('-l', '--location', default='')
+    parser.add_argument('-r', '--report', default='')
+
+    args = parser.parse_args()
+    main(args)
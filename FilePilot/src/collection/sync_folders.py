@@ -1,9 +1,18 @@
-# This script syncs folders given as arguments using rsync.
+# This script syncs folders given as arguments: the slave folder (-s flag) becomes a copy of the master folder (-m flag).
 # Updating a Versions.txt file with a row containing "Music Collection" Key word
+# Both folders keep a manifest of their files (.sync_manifest.json, see shared/folder_manifest.py). Just the folders of the
+# master folder that changed since the last sync are listed again (the files of all the others are checked against
+# the manifest one by one), and the slave folder isn't scanned at all: its manifest
+# tells what was copied there the last time. The plan (files to copy and to delete) comes from comparing the two
+# manifests, afterwards the files are copied and deleted in parallel (-w flag: copies at the same time per drive).
+# Pass --dry-run to just log the plan, and -f to scan both folders completely (e.g. if the slave folder was changed by hand).
+# Pass -v to verify instead of syncing: both folders are hashed (the hashes of unchanged files are kept in the manifests)
+# and compared through Merkle trees, descending just into the folders whose content differs. With -f every file is read again.
 
 
 # system imports
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 import os
@@ -11,10 +20,9 @@ import sys
 
 sys.path.append("./src")
 
-# 3rd party imports
-from dirsync import sync
-
 # user imports
+import shared.copy_engine as copy_engine
+import shared.folder_manifest as folder_manifest
 from shared.logging_config import setup_logging
 
 setup_logging()
@@ -64,23 +72,237 @@ def update_versions_txt(version_file: str, folder_name: str) -> None:
         file.writelines(lines)
 
 
-def sync_folders(master_folder: str, slave_folder: str):
-    sync(
-        master_folder,
-        slave_folder,
-        "sync",
-        verbose=True,
-        ignore=["\."],
-        logger=logger,
-        purge=True,
+def _is_same_file(master_file: dict, slave_file: dict) -> bool:
+    return (
+        master_file["size"] == slave_file["size"]
+        and abs(master_file["mtime"] - slave_file["mtime"]) <= copy_engine.MTIME_TOLERANCE
+    )
+
+
+def plan_sync(master_manifest: dict, slave_manifest: dict) -> dict:
+    """compares the manifests of master and slave folder
+
+    Args:
+        master_manifest (dict): manifest of the master folder
+        slave_manifest (dict): manifest of the slave folder
+
+    Returns:
+        dict: relative paths of the files to copy and to delete, and of the folders to create and to delete
+    """
+    master_files = master_manifest["files"]
+    slave_files = slave_manifest["files"]
+    master_directories = set(master_manifest["directories"]) - {""}
+    slave_directories = set(slave_manifest["directories"]) - {""}
+    return {
+        "copy": sorted(
+            path for path, file in master_files.items() if path not in slave_files or not _is_same_file(file, slave_files[path])
+        ),
+        "delete": sorted(path for path in slave_files if path not in master_files),
+        "create_directories": sorted(master_directories - slave_directories),
+        # the deepest folders first, so each folder is empty when it is deleted
+        "delete_directories": sorted(slave_directories - master_directories, key=lambda path: path.count("/"), reverse=True),
+    }
+
+
+def log_plan(plan: dict, master_manifest: dict, list_files: bool = False) -> None:
+    megabytes = sum(master_manifest["files"][path]["size"] for path in plan["copy"]) / 1024**2
+    logger.info(
+        f'Plan: copy {len(plan["copy"])} files ({megabytes:.1f} MB), delete {len(plan["delete"])} files, '
+        + f'create {len(plan["create_directories"])} and delete {len(plan["delete_directories"])} folders'
     )
+    log = logger.info if list_files else logger.debug
+    for path in plan["copy"]:
+        log(f"+ {path}")
+    for path in plan["delete"]:
+        log(f"- {path}")
+    for path in plan["delete_directories"]:
+        log(f"- {path}/")
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not delete {path}: {e}")
+        return False
+    return True
+
+
+def execute_plan(plan: dict, master_folder: str, slave_folder: str, master_manifest: dict, slave_manifest: dict,
+                 workers_per_device: int = copy_engine.COPY_WORKERS_PER_DEVICE) -> dict:
+    """deletes and copies the files of the plan in parallel
+
+    Args:
+        plan (dict): the plan, as returned by plan_sync
+        master_folder (str): the master folder
+        slave_folder (str): the slave folder
+        master_manifest (dict): manifest of the master folder
+        slave_manifest (dict): manifest of the slave folder
+        workers_per_device (int, optional): files copied at the same time. Defaults to copy_engine.COPY_WORKERS_PER_DEVICE.
+
+    Returns:
+        dict: the new manifest of the slave folder
+    """
+    slave_files = dict(slave_manifest["files"])
+    slave_paths = [folder_manifest.to_absolute_path(slave_folder, path) for path in plan["delete"]]
+    with ThreadPoolExecutor(max_workers=workers_per_device) as executor:
+        for path, was_deleted in zip(plan["delete"], executor.map(_remove_file, slave_paths)):
+            if was_deleted:
+                del slave_files[path]
+    for path in plan["delete_directories"]:
+        try:
+            os.rmdir(folder_manifest.to_absolute_path(slave_folder, path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not delete the folder {path}: {e}")
+    for path in plan["create_directories"]:
+        os.makedirs(folder_manifest.to_absolute_path(slave_folder, path), exist_ok=True)
+
+    pairs = [
+        (folder_manifest.to_absolute_path(master_folder, path), folder_manifest.to_absolute_path(slave_folder, path))
+        for path in plan["copy"]
+    ]
+    copy_engine.copy_files(pairs, workers_per_device=workers_per_device)
+    for path, (source, destination) in zip(plan["copy"], pairs):
+        if copy_engine.is_up_to_date(source, destination):
+            # without the hash of the master file: the copy has to be read itself to be verified
+            slave_files[path] = {key: master_manifest["files"][path][key] for key in ("size", "mtime")}
+
+    # the slave folder is listed completely the next time it is scanned, its modification times are unknown
+    slave_directories = {path: {"mtime_ns": None, "subdirectories": []} for path in master_manifest["directories"]}
+    return {"version": folder_manifest.MANIFEST_VERSION, "directories": slave_directories, "files": slave_files}
+
+
+def sync_folders(master_folder: str, slave_folder: str, dry_run: bool = False, full: bool = False,
+                 workers_per_device: int = copy_engine.COPY_WORKERS_PER_DEVICE) -> dict:
+    """makes the slave folder a copy of the master folder
+
+    Args:
+        master_folder (str): the master folder
+        slave_folder (str): the slave folder
+        dry_run (bool, optional): just log the plan, don't change anything. Defaults to False.
+        full (bool, optional): scan both folders completely instead of trusting the manifests. Defaults to False.
+        workers_per_device (int, optional): files copied at the same time. Defaults to copy_engine.COPY_WORKERS_PER_DEVICE.
+
+    Returns:
+        dict: the plan
+    """
+    master_manifest = folder_manifest.scan_folder(master_folder, folder_manifest.load_manifest(master_folder), full=full)
+    slave_manifest = folder_manifest.load_manifest(slave_folder)
+    if full or not os.path.exists(os.path.join(slave_folder, folder_manifest.MANIFEST_NAME)):
+        slave_manifest = folder_manifest.scan_folder(slave_folder, full=True)
+
+    plan = plan_sync(master_manifest, slave_manifest)
+    log_plan(plan, master_manifest, list_files=dry_run)
+    if dry_run:
+        logger.info("Dry run, nothing was changed.")
+        return plan
+
+    slave_manifest = execute_plan(plan, master_folder, slave_folder, master_manifest, slave_manifest, workers_per_device)
+    folder_manifest.write_manifest(master_manifest, master_folder)
+    folder_manifest.write_manifest(slave_manifest, slave_folder)
+    return plan
+
+
+def compare_merkle_trees(master_manifest: dict, slave_manifest: dict) -> list:
+    """compares the folders starting at the root, descending just into the subfolders whose hashes differ
+
+    Args:
+        master_manifest (dict): manifest of the master folder, with the hashes of the files
+        slave_manifest (dict): manifest of the slave folder, with the hashes of the files
+
+    Returns:
+        list: (relative path, reason) of each differing file
+    """
+    master_tree = folder_manifest.build_merkle_tree(master_manifest)
+    slave_tree = folder_manifest.build_merkle_tree(slave_manifest)
+    master_files_by_directory = folder_manifest.group_files_by_directory(master_manifest["files"])
+    slave_files_by_directory = folder_manifest.group_files_by_directory(slave_manifest["files"])
+
+    def get_files_below(files: dict, folder: str) -> list:
+        return sorted(path for path in files if path.startswith(folder + "/"))
+
+    differences = []
+    compared_folders = 0
+    folders = [""]
+    while folders:
+        folder = folders.pop()
+        if master_tree.get(folder) == slave_tree.get(folder):
+            continue
+        compared_folders += 1
+
+        master_files = master_files_by_directory.get(folder, {})
+        slave_files = slave_files_by_directory.get(folder, {})
+        for path in sorted(set(master_files) | set(slave_files)):
+            if path not in slave_files:
+                differences.append((path, "missing in slave"))
+            elif path not in master_files:
+                differences.append((path, "only in slave"))
+            elif master_files[path].get("hash") != slave_files[path].get("hash"):
+                differences.append((path, "different content"))
+
+        master_subdirectories = set(master_manifest["directories"][folder]["subdirectories"])
+        slave_subdirectories = set(slave_manifest["directories"][folder]["subdirectories"])
+        for subdirectory in sorted(master_subdirectories | slave_subdirectories):
+            path = folder_manifest.join_relative_path(folder, subdirectory)
+            if subdirectory not in slave_subdirectories:
+                differences.extend((file, "missing in slave") for file in get_files_below(master_manifest["files"], path))
+            elif subdirectory not in master_subdirectories:
+                differences.extend((file, "only in slave") for file in get_files_below(slave_manifest["files"], path))
+            else:
+                folders.append(path)
+
+    logger.info(f"Compared the content of {compared_folders} of {len(master_tree)} folders")
+    return differences
+
+
+def verify_folders(master_folder: str, slave_folder: str, full: bool = False) -> list:
+    """proves that the slave folder holds the same content as the master folder. Both folders are scanned, the files
+    are hashed (or their hashes taken from the manifests, if they didn't change) and compared through Merkle trees.
+
+    Args:
+        master_folder (str): the master folder
+        slave_folder (str): the slave folder
+        full (bool, optional): hash every file again, instead of trusting the hashes of the manifests. Defaults to False.
+
+    Returns:
+        list: (relative path, reason) of each differing file
+    """
+    manifests = []
+    for folder in (master_folder, slave_folder):
+        manifest = folder_manifest.scan_folder(folder, folder_manifest.load_manifest(folder), full=full)
+        if full:
+            for file in manifest["files"].values():
+                file.pop("hash", None)
+        folder_manifest.hash_files(folder, manifest)
+        folder_manifest.write_manifest(manifest, folder)
+        manifests.append(manifest)
+
+    differences = compare_merkle_trees(*manifests)
+    if len(differences) != 0:
+        logger.warning(f"🚨 {len(differences)} FILES WHERE FOUND that differ between master and slave:")
+        for path, reason in differences:
+            logger.warning(f"- {path}: {reason}")
+    else:
+        logger.info("✅ The slave folder holds exactly the same files as the master folder.")
+    return differences
 
 
 def main(args):
     logger.info("Start of program: sync_folders.py...")
-    sync_folders(args.master_folder, args.slave_folder)
+    if args.verify:
+        verify_folders(args.master_folder, args.slave_folder, full=args.full)
+        logger.info("End of program: sync_folders.py\n")
+        return
+
+    sync_folders(args.master_folder, args.slave_folder, dry_run=args.dry_run, full=args.full, workers_per_device=args.workers)
 
-    if args.master_folder.endswith("Music Collection"):
+    if args.dry_run:
+        logger.info("Dry run, not updating Versions.txt")
+    elif args.master_folder.endswith("Music Collection"):
         update_versions_txt(
             version_file=os.path.join(
                 os.path.dirname(args.slave_folder), "Versions.txt"
@@ -98,6 +320,10 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("-m", "--master_folder")
     parser.add_argument("-s", "--slave_folder")
+    parser.add_argument("-w", "--workers", type=int, default=copy_engine.COPY_WORKERS_PER_DEVICE)
+    parser.add_argument("-f", "--full", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("-v", "--verify", action="store_true")
 
     args = parser.parse_args()
     main(args)
@@ -16,6 +16,7 @@ import spotipy
 # user imports
 import shared.dataloading as dataloading
 import shared.utils as utils
+import storage
 
 
 def drop_known_tracks(
@@ -43,11 +44,12 @@ def create_playlist_playlists_new_arrivals(
         connection: dict,
         playlist_name: str,
 ):
-    df_playlists = utils.read_csv_custom(config['datapath'], 'playlists.csv')
-    df_playlists_names = utils.read_csv_custom(
-        config['datapath'], 'playlists_names.csv')
-    df_popularity = utils.read_csv_custom(config['datapath'], 'popularity.csv')
-    df_tracks = utils.read_csv_custom(config['datapath'], 'tracks.csv')
+    backend = storage.get_storage(config)
+    df_playlists = backend.read('playlists')
+    df_playlists_names = backend.read('playlists_names')
+    # the ids are enough for finding the known tracks, the values are read just for the date of interest
+    df_popularity = backend.read_popularity(columns=['id'])
+    df_tracks = backend.read('tracks')
 
     date_of_interest = df_playlists.sort_values(
         by=['date_added'], inplace=False, ascending=False).iloc[0].date_added
@@ -76,8 +78,7 @@ def create_playlist_playlists_new_arrivals(
     )
 
     # getting the popularity info into it
-    df_popularity = df_popularity[df_popularity.date == date_of_interest]
-    df_popularity.drop(columns=['date'], inplace=True)
+    df_popularity = backend.read_popularity(dates=[date_of_interest], columns=['id', 'value'])
     df_playlists = df_playlists.join(
         df_popularity.set_index('id'), on='track_id', how='left')
 
@@ -123,11 +124,11 @@ def create_playlist_artists_new_arrivals(
         config: dict,
         connection: dict,
 ):
-    df_artists = utils.read_csv_custom(config['datapath'], 'artists.csv')
-    df_artists_names = utils.read_csv_custom(
-        config['datapath'], 'artists_names.csv')
-    df_tracks = utils.read_csv_custom(config['datapath'], 'tracks.csv')
-    df_popularity = utils.read_csv_custom(config['datapath'], 'popularity.csv')
+    backend = storage.get_storage(config)
+    df_artists = backend.read('artists')
+    df_artists_names = backend.read('artists_names')
+    df_tracks = backend.read('tracks')
+    df_popularity = backend.read_popularity(columns=['id'])
 
     date_of_interest = df_artists.sort_values(
         by=['date_added'], inplace=False, ascending=False).iloc[0].date_added
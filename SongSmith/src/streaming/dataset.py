@@ -1,6 +1,5 @@
 # system imports
 from argparse import ArgumentParser
-import os
 import math
 import sys
 
@@ -13,29 +12,18 @@ from tqdm import tqdm
 
 # user imports
 import shared.dataloading as dataloading
+import shared.spotify_fetching as spotify_fetching
 import shared.utils as utils
+import storage
 
 
 def create(config: dict):
+    storage.get_storage(config).create_tables()
 
-    def create_table(table_name, columns):
-        outpath = os.path.join(config['datapath'], f'{table_name}.csv')
-        if os.path.exists(outpath):
-            raise ValueError(
-                f'File {outpath} already exists. Delete it or run with mode "update"')
-        pd.DataFrame(columns=columns).to_csv(outpath, index=False)
 
-    create_table('tracks', ['id', 'name', 'artists', 'preview_url'])
-    create_table('tracks_fav', ['id', 'date_added', 'date_removed'])
-    create_table('popularity', ['id', 'date', 'value'])
-    create_table('playlists', ['id', 'track_id', 'date_added', 'date_removed'])
-    create_table('playlists_names', ['id', 'name'])
-    create_table('artists', ['id', 'track_id', 'date_added', 'date_removed'])
-    create_table('artists_names', ['id', 'name'])
-
-
-def _update_playlists_names(sp: spotipy.Spotify, config: dict, connection: dict):
-    playlists = sp.user_playlists(connection['username'])
+def _update_playlists_names(sp: spotipy.Spotify, config: dict, connection: dict, backend,
+                            limiter: spotify_fetching.TokenBucket):
+    playlists = spotify_fetching.call_with_retry(limiter, sp.user_playlists, connection['username'])
 
     df_all = pd.DataFrame(playlists['items'])
     df_playlists_names = df_all[['id', 'name']].copy(deep=True)
@@ -45,35 +33,41 @@ def _update_playlists_names(sp: spotipy.Spotify, config: dict, connection: dict)
     df_playlists_names = df_playlists_names[df_playlists_names.id.isin(
         list(config['playlist_to_allowed_tracks'].keys())
     )].reset_index(drop=True)
-    df_playlists_names.to_csv(os.path.join(
-        config['datapath'], 'playlists_names.csv'),
-        index=False
-    )
+    backend.write('playlists_names', df_playlists_names)
 
 
-def _update_artists_names(sp: spotipy.Spotify, config: dict):
+def _update_artists_names(sp: spotipy.Spotify, config: dict, backend, limiter: spotify_fetching.TokenBucket):
     artists_names = {'id': [], 'name': []}
 
     for id in tqdm(config['artists_followed'], desc='Gettings artists names'):
         artists_names['id'].append(id)
-        artists_names['name'].append(sp.artist(artist_id=id)['name'])
-    pd.DataFrame(artists_names).to_csv(
-        os.path.join(config['datapath'], 'artists_names.csv'), index=False)
+        artists_names['name'].append(spotify_fetching.call_with_retry(limiter, sp.artist, artist_id=id)['name'])
+    backend.write('artists_names', pd.DataFrame(artists_names))
+
 
+def _build_index(df_tracks: pd.DataFrame, df_popularity: pd.DataFrame, today) -> dict:
+    """Builds the lookups deciding if a track needs a new row in the tracks and popularity tables.
+    They are built once per run and updated with every row added, so each decision is a set lookup
+    instead of scanning the tables for every track.
 
-def _drop_trackid_duplicates(df: pd.DataFrame):
-    len_before = len(df)
-    df = df.drop_duplicates(subset=['track_id'], keep='first')
-    if len(df) != len_before:
-        df.reset_index(drop=True, inplace=True)
-        print(
-            f'Dropped {len_before - len(df)} duplicates from playlist {df.iloc[0]["id"]}')
-    return df
+    Args:
+        df_tracks (pd.DataFrame): the tracks table
+        df_popularity (pd.DataFrame): the popularity table
+        today: the date of the update
+
+    Returns:
+        dict: 'track_ids' (set of the ids in the tracks table) and
+            'popularity_keys' (set of the (id, date) pairs of today in the popularity table)
+    """
+    df_popularity_today = df_popularity[df_popularity.date == today]
+    return {
+        'track_ids': set(df_tracks.id),
+        'popularity_keys': set(zip(df_popularity_today.id, df_popularity_today.date)),
+    }
 
 
 def _update_popularity_and_tracks_dicts(
-        df_popularity: pd.DataFrame,
-        df_tracks: pd.DataFrame,
+        index: dict,
         popularity_to_add: dict,
         tracks_to_add: dict,
         current_track,
@@ -82,14 +76,16 @@ def _update_popularity_and_tracks_dicts(
     track_id_curr = current_track['id']
 
     # update Popularity table
-    if df_popularity.loc[(df_popularity.id == track_id_curr) & (df_popularity.date == today)].empty and track_id_curr not in popularity_to_add['id']:
+    if (track_id_curr, today) not in index['popularity_keys']:
+        index['popularity_keys'].add((track_id_curr, today))
         popularity_to_add['id'].append(track_id_curr)
         popularity_to_add['date'].append(today)
         track_popularity = current_track['popularity'] if current_track is not None else None
         popularity_to_add['value'].append(track_popularity)
 
     # update tracks table
-    if df_tracks[df_tracks.id == track_id_curr].empty and track_id_curr not in tracks_to_add['id']:
+    if track_id_curr not in index['track_ids']:
+        index['track_ids'].add(track_id_curr)
         tracks_to_add['id'].append(track_id_curr)
         tracks_to_add['name'].append(current_track['name'])
         tracks_to_add['artists'].append(
@@ -98,59 +94,79 @@ def _update_popularity_and_tracks_dicts(
     return popularity_to_add, tracks_to_add
 
 
+def _fetch_group_tracks(sp: spotipy.Spotify, group_id: str, mode: str, connection: dict,
+                        limiter: spotify_fetching.TokenBucket) -> list:
+    """fetches the current tracks of one playlist or artist"""
+    if mode == 'playlists':
+        return list(dataloading.get_playlist_total_tracks(
+            sp=sp,
+            username=connection['username'],
+            playlist_id=group_id,
+            limiter=limiter,
+        ))
+    return spotify_fetching.call_with_retry(limiter, sp.artist_top_tracks, artist_id=group_id)['tracks']
+
+
 def _update_grouped_table(df_names: pd.DataFrame,
                           df_group: pd.DataFrame,
                           tracks_to_add: dict,
                           popularity_to_add: dict,
-                          df_popularity: pd.DataFrame,
-                          df_tracks: pd.DataFrame,
+                          index: dict,
                           sp: spotipy.Spotify,
                           mode: str,
-                          connection: dict
+                          connection: dict,
+                          limiter: spotify_fetching.TokenBucket = None,
+                          workers: int = spotify_fetching.FETCH_WORKERS,
+                          today=None,
 ):
-    """A groud can be playlists or artists
+    """A groud can be playlists or artists.
+    The tracks of all the groups are fetched concurrently first, then the groups are gone through in their order.
     """
-    today = pd.Timestamp.today().date()
+    if mode not in ('playlists', 'artists'):
+        raise ValueError('Mode must be either "playlists" or "artists"')
+    today = today or pd.Timestamp.today().date()
     lst_group_new = []
+    # row positions of each group, so a group is selected without scanning the whole table
+    group_positions = df_group.groupby('id', sort=False).indices
+
+    #################### fetching the tracks of all the groups ####################
+    limiter = limiter or spotify_fetching.TokenBucket()
+    tracks_per_group = spotify_fetching.fetch_in_order(
+        lambda group_id: _fetch_group_tracks(sp, group_id, mode, connection, limiter),
+        list(df_names.id),
+        workers=workers,
+        desc=f'Fetching the {mode}',
+    )
 
-    # NOTE: maybe use parallel processing here
-    for _, row in tqdm(df_names.iterrows(), total=len(df_names), desc='Going through groups'):
+    for (_, row), group_tracks in tqdm(zip(df_names.iterrows(), tracks_per_group), total=len(df_names), desc='Going through groups'):
         #################### going through the current group ####################
         # one group at a time
-        df_current_group = df_group[df_group.id == row.id]
-        df_current_group = _drop_trackid_duplicates(df_current_group)
+        df_current_group = df_group.iloc[group_positions.get(row.id, [])].copy()
         group_to_add = {'id': [], 'track_id': [],
                         'date_added': [], 'date_removed': []}
 
         if mode == 'playlists':
-            group_tracks = dataloading.get_playlist_total_tracks(
-                sp=sp,
-                username=connection['username'],
-                playlist_id=row.id,
-            )
             track_ids_present = [f['track']['id']
                                  for f in group_tracks if f['track'] is not None]
-        elif mode == 'artists':
-            group_tracks = sp.artist_top_tracks(artist_id=row.id)['tracks']
+        else:
             track_ids_present = [f['id']
                                  for f in group_tracks if f['id'] is not None]
-        else:
-            raise ValueError('Mode must be either "playlists" or "artists"')
 
-        # add date_removed information
-        df_current_group.loc[~df_current_group.track_id.isin(
+        # add date_removed information to every open row of the tracks not in the group anymore,
+        # the rows removed before keep their date_removed (a column without any date is read as datetime64, not as dates)
+        df_current_group.date_removed = df_current_group.date_removed.astype(object)
+        df_current_group.loc[df_current_group.date_removed.isnull() & ~df_current_group.track_id.isin(
             track_ids_present), 'date_removed'] = today
+        # the tracks currently in the group: the ones with an open row
+        track_ids_active = set(df_current_group.track_id[df_current_group.date_removed.isnull()])
 
         #################### going through the songs in the current group group ####################
-        for index, current_track in tqdm(enumerate(group_tracks), total=len(group_tracks), desc='Going through current group songs'):
+        for index_track, current_track in tqdm(enumerate(group_tracks), total=len(group_tracks), desc='Going through current group songs'):
             # going through the tracks in the current playlist
 
-            track_id_curr = track_ids_present[index]
-            df_ = df_current_group.loc[(df_current_group.track_id == track_id_curr) & (
-                df_current_group.date_removed.isnull())]
-            if not df_.empty:
-                assert len(df_) == 1, 'There should be only one row'
-            else:
+            track_id_curr = track_ids_present[index_track]
+            if track_id_curr not in track_ids_active:
+                track_ids_active.add(track_id_curr)
                 if mode == 'playlists':
                     current_track = current_track['track']
                 assert current_track['id'] == track_id_curr, 'The track_ids must match'
@@ -163,7 +179,7 @@ def _update_grouped_table(df_names: pd.DataFrame,
                 group_to_add['date_removed'].append(None)
 
                 popularity_to_add, tracks_to_add = _update_popularity_and_tracks_dicts(
-                    df_popularity, df_tracks, popularity_to_add, tracks_to_add, current_track, today)
+                    index, popularity_to_add, tracks_to_add, current_track, today)
 
         lst_group_new.append(
             pd.concat([df_current_group, pd.DataFrame(group_to_add)], ignore_index=True))
@@ -179,19 +195,20 @@ def _update_tracks_fav(
         df_tracks_fav: pd.DataFrame,
         tracks_to_add: dict,
         popularity_to_add: dict,
-        df_popularity: pd.DataFrame,
-        df_tracks: pd.DataFrame,
+        index: dict,
+        limiter: spotify_fetching.TokenBucket,
+        today=None,
 ):
     results = []
 
     # Loop through the results until we have retrieved all tracks
-    total_tracks = sp.current_user_saved_tracks(limit=1, offset=0)['total']
+    total_tracks = spotify_fetching.call_with_retry(limiter, sp.current_user_saved_tracks, limit=1, offset=0)['total']
     # 50 is the max amount you can fetch in a single request
     iterations = math.ceil(total_tracks / 50)
 
     for curr_iteration in tqdm(range(iterations), desc='Updating favourite tracks table', unit='packs of 50 songs'):
-        track_results = sp.current_user_saved_tracks(
-            limit=50, offset=curr_iteration * 50)
+        track_results = spotify_fetching.call_with_retry(
+            limiter, sp.current_user_saved_tracks, limit=50, offset=curr_iteration * 50)
 
         # Add the retrieved tracks to our results list
         results += track_results['items']
@@ -202,19 +219,18 @@ def _update_tracks_fav(
                          for f in results if f['track']['id'] is not None]
 
     track_fav_to_add = {'id': [], 'date_added': [], 'date_removed': []}
-    today = pd.Timestamp.today().date()
-    df_tracks_fav.loc[~df_tracks_fav.id.isin(
+    today = today or pd.Timestamp.today().date()
+    df_tracks_fav.date_removed = df_tracks_fav.date_removed.astype(object)
+    df_tracks_fav.loc[df_tracks_fav.date_removed.isnull() & ~df_tracks_fav.id.isin(
         track_ids_present), 'date_removed'] = today
+    track_ids_active = set(df_tracks_fav.id[df_tracks_fav.date_removed.isnull()])
 
     for current_track in tqdm(results, total=len(results), desc='Going through the favourite songs'):
         # going through the tracks
 
         track_id_curr = current_track['track']['id']
-        df_ = df_tracks_fav.loc[(df_tracks_fav.id == track_id_curr) & (
-            df_tracks_fav.date_removed.isnull())]
-        if not df_.empty:
-            assert len(df_) == 1, 'There should be only one row'
-        else:
+        if track_id_curr not in track_ids_active:
+            track_ids_active.add(track_id_curr)
             track_fav_to_add['date_added'].append(current_track['added_at'])
             current_track = current_track['track']
             assert current_track['id'] == track_id_curr, 'The track_ids must match'
@@ -223,7 +239,7 @@ def _update_tracks_fav(
             track_fav_to_add['date_removed'].append(None)
 
             popularity_to_add, tracks_to_add = _update_popularity_and_tracks_dicts(
-                df_popularity, df_tracks, popularity_to_add, tracks_to_add, current_track, today)
+                index, popularity_to_add, tracks_to_add, current_track, today)
     df_tracks_fav_to_add = pd.DataFrame(track_fav_to_add)
     df_tracks_fav_to_add["date_added"] = pd.to_datetime(
         df_tracks_fav_to_add["date_added"]
@@ -235,81 +251,97 @@ def _update_tracks_fav(
     return df_tracks_fav, tracks_to_add, popularity_to_add
 
 
-def update(config: dict, connection: dict):
-    sp = utils.get_auth_spotipy_obj(connection, scope='user-library-read')
+def update(config: dict, connection: dict, sp: spotipy.Spotify = None, today=None):
+    """Updates the dataset with the current tracks of the playlists, the artists and the favourite tracks
+
+    Args:
+        config (dict): the configuration
+        connection (dict): the credentials and the username
+        sp (spotipy.Spotify, optional): the Spotify client. Defaults to None (one authorized with the connection).
+        today (datetime.date, optional): the date of the update, the same for all the tables. Defaults to None (today).
+    """
+    if sp is None:
+        # the 429 answers are left to the shared rate limit of spotify_fetching, instead of being retried by the session.
+        # Every thread fetching a playlist requests several pages at the same time, the session keeps a connection for each
+        session = spotify_fetching.get_requests_session(
+            pool_size=spotify_fetching.FETCH_WORKERS * dataloading.PLAYLIST_PAGE_WORKERS)
+        sp = utils.get_auth_spotipy_obj(connection, scope='user-library-read', requests_session=session)
+    backend = storage.get_storage(config)
+    today = today or pd.Timestamp.today().date()
+    # all the requests of the update share one rate limit
+    limiter = spotify_fetching.TokenBucket()
 
     ############ tracks and popularity tables ############
-    _update_playlists_names(sp, config, connection)
-    _update_artists_names(sp, config)
+    _update_playlists_names(sp, config, connection, backend, limiter)
+    _update_artists_names(sp, config, backend, limiter)
 
-    df_tracks = utils.read_csv_custom(config['datapath'], 'tracks.csv')
+    df_tracks = backend.read('tracks')
     tracks_to_add = {'id': [], 'name': [], 'artists': [], 'preview_url': []}
 
-    df_popularity = utils.read_csv_custom(config['datapath'], 'popularity.csv')
+    # just the rows of today are needed for deciding which tracks get a new popularity row
+    df_popularity = backend.read_popularity(dates=[today], columns=['id', 'date'])
     popularity_to_add = {'id': [], 'date': [], 'value': []}
 
+    index = _build_index(df_tracks, df_popularity, today)
+
     ############ playlists and artists table ############
 
-    df_playlists = utils.read_csv_custom(config['datapath'], 'playlists.csv')
-    df_playlists_names = utils.read_csv_custom(
-        config['datapath'], 'playlists_names.csv')
+    df_playlists = backend.read('playlists')
+    df_playlists_before = df_playlists.copy()
+    df_playlists_names = backend.read('playlists_names')
 
     df_playlists, tracks_to_add, popularity_to_add = _update_grouped_table(
         df_names=df_playlists_names,
         df_group=df_playlists,
         tracks_to_add=tracks_to_add,
         popularity_to_add=popularity_to_add,
-        df_popularity=df_popularity,
-        df_tracks=df_tracks,
+        index=index,
         sp=sp,
         mode='playlists',
         connection=connection,
+        limiter=limiter,
+        today=today,
     )
-    df_playlists.to_csv(os.path.join(
-        config['datapath'], 'playlists.csv'), index=False)
+    backend.upsert('playlists', storage.get_changed_rows(df_playlists_before, df_playlists))
 
-    df_artists = utils.read_csv_custom(config['datapath'], 'artists.csv')
-    df_artists_names = utils.read_csv_custom(
-        config['datapath'], 'artists_names.csv')
+    df_artists = backend.read('artists')
+    df_artists_before = df_artists.copy()
+    df_artists_names = backend.read('artists_names')
 
     df_artists, tracks_to_add, popularity_to_add = _update_grouped_table(
         df_names=df_artists_names,
         df_group=df_artists,
         tracks_to_add=tracks_to_add,
         popularity_to_add=popularity_to_add,
-        df_popularity=df_popularity,
-        df_tracks=df_tracks,
+        index=index,
         sp=sp,
         mode='artists',
         connection=connection,
+        limiter=limiter,
+        today=today,
     )
-    df_artists.to_csv(os.path.join(
-        config['datapath'], 'artists.csv'), index=False)
+    backend.upsert('artists', storage.get_changed_rows(df_artists_before, df_artists))
 
     ############ tracks_fav table ############
-    df_tracks_fav = utils.read_csv_custom(config['datapath'], 'tracks_fav.csv')
+    df_tracks_fav = backend.read('tracks_fav')
+    df_tracks_fav_before = df_tracks_fav.copy()
 
     df_tracks_fav, tracks_to_add, popularity_to_add = _update_tracks_fav(
         df_tracks_fav=df_tracks_fav,
         tracks_to_add=tracks_to_add,
         popularity_to_add=popularity_to_add,
-        df_popularity=df_popularity,
-        df_tracks=df_tracks,
+        index=index,
         sp=sp,
+        limiter=limiter,
+        today=today,
     )
-    df_tracks_fav.to_csv(os.path.join(
-        config['datapath'], 'tracks_fav.csv'), index=False)
+    backend.upsert('tracks_fav', storage.get_changed_rows(df_tracks_fav_before, df_tracks_fav))
 
     ############ writing tracks and popularity table ############
-    pd.concat([
-        df_popularity,
-        pd.DataFrame(popularity_to_add)],
-        ignore_index=True).to_csv(os.path.join(config['datapath'], 'popularity.csv'), index=False)
+    # just the new rows are written (the csv storage still rewrites the whole files)
+    backend.upsert('popularity', pd.DataFrame(popularity_to_add))
+    backend.upsert('tracks', pd.DataFrame(tracks_to_add))
 
-    pd.concat([
-        df_tracks,
-        pd.DataFrame(tracks_to_add)],
-        ignore_index=True).to_csv(os.path.join(config['datapath'], 'tracks.csv'), index=False)
 
 if __name__ == "__main__":
     print('Start of program: dataset.py...')
@@ -331,7 +363,16 @@ if __name__ == "__main__":
     elif args.mode == 'update':
         print('Updating dataset...')
         update(config, connection)
+    elif args.mode == 'migrate':
+        print('Migrating the csv files into the configured storage...')
+        storage.migrate_from_csv(config)
+    elif args.mode == 'compact':
+        print('Compacting the popularity store...')
+        backend = storage.get_storage(config)
+        if backend.popularity_store is None:
+            raise ValueError('Compacting needs "popularity_storage: parquet" in the configuration')
+        backend.popularity_store.compact()
     else:
-        raise ValueError('Mode must be either "create" or "update"')
+        raise ValueError('Mode must be either "create", "update", "migrate" or "compact"')
 
     print('End of program: dataset.py')
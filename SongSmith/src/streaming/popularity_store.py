@@ -0,0 +1,123 @@
+# This file stores the popularity table as Parquet files partitioned by month: popularity/month=YYYY-MM/*.parquet
+# The popularity table gets a row for every seen track every day, so it grows the fastest of all the tables.
+# Here a daily update just adds one small file to the partition of its month, nothing is read or rewritten.
+# The track ids are dictionary-encoded (each id is stored once per file), the dates as date32 and the values as int16.
+# Reading with dates or columns uses predicate and projection pushdown: just the partitions (and row groups)
+# of these dates are read, and just the requested columns.
+# Compacting merges the daily files of each month into one file, e.g. once a month with mode "compact" of dataset.py.
+
+
+# system imports
+import datetime
+import os
+import uuid
+
+# 3rd party imports
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+SCHEMA = pa.schema([
+    ('id', pa.dictionary(pa.int32(), pa.string())),
+    ('date', pa.date32()),
+    ('value', pa.int16()),
+])
+
+
+def _get_partition_name(date: datetime.date) -> str:
+    return f'month={date:%Y-%m}'
+
+
+def _to_table(df: pd.DataFrame) -> pa.Table:
+    df = pd.DataFrame({
+        'id': df['id'].astype(str).astype('category'),
+        'date': pd.to_datetime(df['date']).dt.date,
+        'value': pd.to_numeric(df['value']).astype('Int16'),
+    })
+    return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+
+class PopularityStore():
+    """Stores the popularity table as Parquet files partitioned by month"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _get_files(self) -> dict:
+        """returns the parquet files of each partition folder"""
+        if not os.path.isdir(self.folder):
+            return {}
+        files = {}
+        for partition in sorted(os.listdir(self.folder)):
+            partition_folder = os.path.join(self.folder, partition)
+            if partition.startswith('month=') and os.path.isdir(partition_folder):
+                # the hidden files are still being written
+                files[partition] = sorted(f for f in os.listdir(partition_folder) if f.endswith('.parquet') and not f.startswith('.'))
+        return files
+
+    def append(self, df_rows: pd.DataFrame):
+        """adds the rows as new files, one per month of the rows. The existing files aren't touched.
+
+        Args:
+            df_rows (pd.DataFrame): rows with the columns id, date and value
+        """
+        if df_rows.empty:
+            return
+        df_rows = df_rows.assign(date=pd.to_datetime(df_rows['date']).dt.date)
+        for date, df_month in df_rows.groupby(df_rows['date'].map(lambda d: d.replace(day=1))):
+            partition_folder = os.path.join(self.folder, _get_partition_name(date))
+            os.makedirs(partition_folder, exist_ok=True)
+            filename = f'part-{df_month["date"].min():%Y-%m-%d}-{uuid.uuid4().hex[:8]}.parquet'
+            # written into a hidden file first, so a reader never sees a half written file
+            temp_path = os.path.join(partition_folder, '.' + filename)
+            pq.write_table(_to_table(df_month), temp_path)
+            os.replace(temp_path, os.path.join(partition_folder, filename))
+
+    def read(self, dates: list = None, columns: list = None) -> pd.DataFrame:
+        """reads the popularity table
+
+        Args:
+            dates (list, optional): just the rows of these dates (datetime.date). Defaults to None (all the rows).
+            columns (list, optional): just these columns. Defaults to None (id, date and value).
+
+        Returns:
+            pd.DataFrame: the rows, with the dates as datetime.date like utils.read_csv_custom
+        """
+        columns = columns or SCHEMA.names
+        files = self._get_files()
+        if dates is not None:
+            # pruning the partitions by their name, before pyarrow opens any file
+            partitions = {_get_partition_name(date) for date in dates}
+            files = {partition: names for partition, names in files.items() if partition in partitions}
+        paths = [os.path.join(self.folder, partition, name) for partition, names in files.items() for name in names]
+        if len(paths) == 0:
+            return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+
+        filters = [('date', 'in', list(dates))] if dates is not None else None
+        table = pq.read_table(paths, columns=columns, filters=filters, schema=SCHEMA)
+        df = table.to_pandas()
+        if 'id' in df.columns:
+            df['id'] = df['id'].astype(str)
+        return df
+
+    def compact(self):
+        """merges the files of each month into one file, sorted by date and id"""
+        for partition, names in self._get_files().items():
+            if len(names) < 2:
+                continue
+            partition_folder = os.path.join(self.folder, partition)
+            paths = [os.path.join(partition_folder, name) for name in names]
+            df = pq.read_table(paths, schema=SCHEMA).to_pandas()
+            df['id'] = df['id'].astype(str)
+            df = df.drop_duplicates(subset=['id', 'date'], keep='last').sort_values(['date', 'id'])
+
+            # the new file is complete before the old ones are removed, so an interruption never loses rows.
+            # Day 00 sorts it before the files appended afterwards, which win when rows are duplicated.
+            filename = f'part-{partition[len("month="):]}-00-{uuid.uuid4().hex[:8]}.parquet'
+            temp_path = os.path.join(partition_folder, '.' + filename)
+            pq.write_table(_to_table(df), temp_path)
+            os.replace(temp_path, os.path.join(partition_folder, filename))
+            for path in paths:
+                os.remove(path)
+            print(f'Compacted {len(names)} files of {partition} into one ({len(df)} rows)')
@@ -0,0 +1,281 @@
+# This file holds the storage backends of the dataset tables (tracks, tracks_fav, popularity, playlists,
+# playlists_names, artists and artists_names). Choose the backend with the key 'storage' in the configuration:
+# - 'csv' (default): one .csv file per table in config['datapath'], every write rewrites the whole file
+# - 'sqlite': one SQLite database (config['database'], by default dataset.sqlite in config['datapath'])
+#   with primary keys and indexes, where just the new and changed rows are written, in one transaction per table
+# With the key 'popularity_storage' set to 'parquet', the popularity table is kept in date-partitioned Parquet files
+# instead (see popularity_store.py), in the folder popularity of config['datapath'].
+# Existing .csv files are moved into the configured storage with migrate_from_csv (mode "migrate" of dataset.py).
+
+
+# system imports
+import os
+import sqlite3
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+from popularity_store import PopularityStore
+import shared.utils as utils
+
+
+TABLES = {
+    'tracks': {'columns': ['id', 'name', 'artists', 'preview_url'], 'primary_key': ['id'], 'indexes': []},
+    'tracks_fav': {'columns': ['id', 'date_added', 'date_removed'], 'primary_key': ['id', 'date_added'], 'indexes': []},
+    'popularity': {'columns': ['id', 'date', 'value'], 'primary_key': ['id', 'date'], 'indexes': [['date']]},
+    'playlists': {'columns': ['id', 'track_id', 'date_added', 'date_removed'],
+                  'primary_key': ['id', 'track_id', 'date_added'], 'indexes': [['track_id'], ['date_added']]},
+    'playlists_names': {'columns': ['id', 'name'], 'primary_key': ['id'], 'indexes': []},
+    'artists': {'columns': ['id', 'track_id', 'date_added', 'date_removed'],
+                'primary_key': ['id', 'track_id', 'date_added'], 'indexes': [['track_id'], ['date_added']]},
+    'artists_names': {'columns': ['id', 'name'], 'primary_key': ['id'], 'indexes': []},
+}
+DATE_COLUMNS = ['date', 'date_added', 'date_removed']
+DATABASE_NAME = 'dataset.sqlite'
+POPULARITY_FOLDER_NAME = 'popularity'
+
+
+def _to_comparable_rows(df: pd.DataFrame) -> list:
+    """turns the rows into tuples of strings, so rows are equal independent of the dtypes (dates, missing values)"""
+    df = df.copy()
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column]).dt.strftime('%Y-%m-%d')
+    df = df.astype(object)
+    return list(df.where(df.notna(), '').astype(str).itertuples(index=False, name=None))
+
+
+def get_changed_rows(df_before: pd.DataFrame, df_after: pd.DataFrame) -> pd.DataFrame:
+    """Returns the rows of df_after, that are not identical to a row of df_before (the new and the changed rows)
+
+    Args:
+        df_before (pd.DataFrame): the table as it was read
+        df_after (pd.DataFrame): the table after the update
+
+    Returns:
+        pd.DataFrame: the new and changed rows
+    """
+    rows_before = set(_to_comparable_rows(df_before[df_after.columns]))
+    is_changed = [row not in rows_before for row in _to_comparable_rows(df_after)]
+    return df_after[is_changed].reset_index(drop=True)
+
+
+def _convert_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column]).dt.date
+    return df
+
+
+class Storage():
+    """Base of the storage backends. The popularity table can be kept in a PopularityStore instead of the backend."""
+
+    def __init__(self, popularity_store: PopularityStore = None):
+        self.popularity_store = popularity_store
+
+    def _get_table_names(self) -> list:
+        return [table_name for table_name in TABLES if table_name != 'popularity' or self.popularity_store is None]
+
+    def read(self, table_name: str) -> pd.DataFrame:
+        if table_name == 'popularity' and self.popularity_store is not None:
+            return self.popularity_store.read()
+        return self._read(table_name)
+
+    def read_popularity(self, dates: list = None, columns: list = None) -> pd.DataFrame:
+        """reads just the rows of the dates and the columns needed from the popularity table
+
+        Args:
+            dates (list, optional): the dates (datetime.date). Defaults to None (all the rows).
+            columns (list, optional): the columns. Defaults to None (all the columns).
+
+        Returns:
+            pd.DataFrame: the rows
+        """
+        if self.popularity_store is not None:
+            return self.popularity_store.read(dates=dates, columns=columns)
+        return self._read_popularity(dates, columns)
+
+    def _read_popularity(self, dates: list, columns: list) -> pd.DataFrame:
+        df = self._read('popularity')
+        if dates is not None:
+            df = df[df.date.isin(dates)]
+        return df[columns or TABLES['popularity']['columns']].reset_index(drop=True)
+
+    def write(self, table_name: str, df: pd.DataFrame):
+        """replaces the whole table"""
+        if table_name == 'popularity' and self.popularity_store is not None:
+            raise ValueError('The popularity store is append only, use upsert to add rows')
+        self._write(table_name, df)
+
+    def upsert(self, table_name: str, df_rows: pd.DataFrame):
+        """adds the rows to the table, replacing the rows with the same primary key.
+        The popularity store just appends the rows, the duplicates are dropped when it is compacted."""
+        if df_rows.empty:
+            return
+        if table_name == 'popularity' and self.popularity_store is not None:
+            self.popularity_store.append(df_rows)
+            return
+        self._upsert(table_name, df_rows)
+
+
+class CsvStorage(Storage):
+    """Stores every table as .csv file in the data folder"""
+
+    def __init__(self, datapath: str, popularity_store: PopularityStore = None):
+        super().__init__(popularity_store)
+        self.datapath = datapath
+        # the tables as they were read, so an upsert doesn't need to read the file again
+        self._tables_read = {}
+
+    def create_tables(self):
+        for table_name in self._get_table_names():
+            outpath = os.path.join(self.datapath, f'{table_name}.csv')
+            if os.path.exists(outpath):
+                raise ValueError(
+                    f'File {outpath} already exists. Delete it or run with mode "update"')
+            pd.DataFrame(columns=TABLES[table_name]['columns']).to_csv(outpath, index=False)
+
+    def _read(self, table_name: str) -> pd.DataFrame:
+        if table_name not in self._tables_read:
+            self._tables_read[table_name] = utils.read_csv_custom(self.datapath, f'{table_name}.csv')
+        return self._tables_read[table_name].copy()
+
+    def _write(self, table_name: str, df: pd.DataFrame):
+        df.to_csv(os.path.join(self.datapath, f'{table_name}.csv'), index=False)
+        self._tables_read.pop(table_name, None)
+
+    def _upsert(self, table_name: str, df_rows: pd.DataFrame):
+        # the whole file is rewritten
+        df = pd.concat([self._read(table_name), df_rows], ignore_index=True)
+        df = df.drop_duplicates(subset=TABLES[table_name]['primary_key'], keep='last')
+        self._write(table_name, df)
+
+
+class SqliteStorage(Storage):
+    """Stores the tables in one SQLite database, with primary keys and indexes"""
+
+    def __init__(self, database: str, popularity_store: PopularityStore = None):
+        super().__init__(popularity_store)
+        self.database = database
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.database)
+
+    def create_tables(self):
+        with self._connect() as connection:
+            existing_tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if existing_tables & set(TABLES):
+                raise ValueError(
+                    f'Database {self.database} already holds tables. Delete it or run with mode "update"')
+            for table_name in self._get_table_names():
+                table = TABLES[table_name]
+                connection.execute(
+                    f'CREATE TABLE {table_name} ({", ".join(table["columns"])}, PRIMARY KEY ({", ".join(table["primary_key"])}))')
+                for columns in table['indexes']:
+                    connection.execute(
+                        f'CREATE INDEX {table_name}_{"_".join(columns)} ON {table_name} ({", ".join(columns)})')
+        connection.close()
+
+    def _query(self, query: str, parameters: list = ()) -> pd.DataFrame:
+        connection = self._connect()
+        try:
+            df = pd.read_sql_query(query, connection, params=parameters)
+        finally:
+            connection.close()
+        return _convert_date_columns(df)
+
+    def _read(self, table_name: str) -> pd.DataFrame:
+        return self._query(f'SELECT * FROM {table_name}')
+
+    def _read_popularity(self, dates: list, columns: list) -> pd.DataFrame:
+        # the dates are looked up in the index of the date column
+        query = f'SELECT {", ".join(columns or TABLES["popularity"]["columns"])} FROM popularity'
+        if dates is None:
+            return self._query(query)
+        return self._query(query + f' WHERE date IN ({", ".join("?" * len(dates))})', [date.isoformat() for date in dates])
+
+    def _to_records(self, df: pd.DataFrame, columns: list) -> list:
+        df = df[columns].astype(object)
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                # NaT has isoformat as well, it must be stored as NULL and not as the text NaT
+                df[column] = df[column].map(lambda value: None if pd.isna(value) else value.isoformat() if hasattr(value, 'isoformat') else value)
+        return df.where(df.notna(), None).values.tolist()
+
+    def _write(self, table_name: str, df: pd.DataFrame):
+        columns = TABLES[table_name]['columns']
+        with self._connect() as connection:
+            connection.execute(f'DELETE FROM {table_name}')
+            connection.executemany(
+                f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                self._to_records(df, columns))
+        connection.close()
+
+    def _upsert(self, table_name: str, df_rows: pd.DataFrame):
+        columns = TABLES[table_name]['columns']
+        primary_key = TABLES[table_name]['primary_key']
+        updates = [f'{column} = excluded.{column}' for column in columns if column not in primary_key]
+        conflict = f'DO UPDATE SET {", ".join(updates)}' if updates else 'DO NOTHING'
+        with self._connect() as connection:
+            connection.executemany(
+                f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                + f'ON CONFLICT ({", ".join(primary_key)}) {conflict}',
+                self._to_records(df_rows, columns))
+        connection.close()
+
+
+def get_storage(config: dict) -> Storage:
+    """Returns the storage backend chosen in the configuration
+
+    Args:
+        config (dict): the configuration, with the keys datapath, storage (csv or sqlite), database (optional)
+            and popularity_storage (optional, parquet for the PopularityStore)
+
+    Raises:
+        ValueError: if the storage is unknown
+
+    Returns:
+        Storage: the backend
+    """
+    popularity_store = None
+    if config.get('popularity_storage') == 'parquet':
+        popularity_store = PopularityStore(os.path.join(config['datapath'], POPULARITY_FOLDER_NAME))
+
+    backend = config.get('storage', 'csv')
+    if backend == 'csv':
+        return CsvStorage(config['datapath'], popularity_store)
+    elif backend == 'sqlite':
+        return SqliteStorage(config.get('database', os.path.join(config['datapath'], DATABASE_NAME)), popularity_store)
+    raise ValueError('Storage must be either "csv" or "sqlite"')
+
+
+def migrate_from_csv(config: dict):
+    """Copies the tables from the .csv files of config['datapath'] into the storage of the configuration
+    (a new SQLite database and/or the popularity store)
+
+    Args:
+        config (dict): the configuration
+
+    Raises:
+        ValueError: if the configuration keeps every table in .csv files, so there is nothing to migrate
+    """
+    if config.get('storage', 'csv') != 'sqlite' and config.get('popularity_storage') != 'parquet':
+        raise ValueError('Migrating needs "storage: sqlite" and/or "popularity_storage: parquet" in the configuration')
+    csv_storage = CsvStorage(config['datapath'])
+    backend = get_storage(config)
+    if isinstance(backend, SqliteStorage):
+        backend.create_tables()
+        table_names = TABLES
+    else:
+        table_names = []
+    if backend.popularity_store is not None and 'popularity' not in table_names:
+        table_names = ['popularity']
+
+    for table_name in table_names:
+        df = csv_storage.read(table_name)
+        # rows with the same primary key in the .csv file are stored once, the last one wins
+        backend.upsert(table_name, df)
+        print(f'Migrated {len(df)} rows of {table_name}')
+    if backend.popularity_store is not None:
+        backend.popularity_store.compact()
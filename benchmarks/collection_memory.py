@@ -0,0 +1,53 @@
+# This script compares the memory usage of the rekordbox collection loaded as string columns
+# with the typed collection (numeric, datetime and categorical columns plus side tables).
+# Pass the path to your rekordbox.xml file as a program argument with the -r flag.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import sys
+
+sys.path.append("./src")
+
+# user imports
+import shared.dataloading as dataloading
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def get_size_mb(df) -> float:
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/collection_memory.py...")
+    df_strings = dataloading.load_dataframe_from_rekordbox_xml(args.path_to_rb, use_cache=False)
+    # the nested elements are python objects, the deep memory usage doesn't see their content
+    df_strings = df_strings.drop(columns=["TEMPO", "POSITION_MARK"], errors="ignore")
+
+    df_tracks, df_tempos, df_position_marks = dataloading.load_collection_from_rekordbox_xml(args.path_to_rb, use_cache=False)
+
+    size_strings = get_size_mb(df_strings)
+    size_tracks = get_size_mb(df_tracks)
+    logger.info(f"{len(df_tracks)} tracks, {len(df_tempos)} tempos and {len(df_position_marks)} position marks")
+    logger.info(f"string columns: {size_strings:.1f} MB")
+    logger.info(f"typed columns: {size_tracks:.1f} MB ({100 * (1 - size_tracks / size_strings):.0f}% less)")
+    logger.info(f"side tables: {get_size_mb(df_tempos):.1f} MB tempos, {get_size_mb(df_position_marks):.1f} MB position marks")
+
+    for column in df_tracks.columns:
+        logger.info(f"- {column}:".ljust(16) + f"{str(df_tracks[column].dtype):10} "
+                    + f"{df_strings[column].memory_usage(deep=True) / 1024**2:7.2f} MB -> "
+                    + f"{df_tracks[column].memory_usage(deep=True) / 1024**2:7.2f} MB")
+
+    logger.info("End of program: benchmarks/collection_memory.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--path_to_rb", required=True)
+
+    args = parser.parse_args()
+    main(args)
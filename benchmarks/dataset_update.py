@@ -0,0 +1,166 @@
+# This script compares the decisions of dataset.update (which tracks get a new row in the group, tracks and popularity tables)
+# made with the set/dict index of SongSmith/src/streaming/dataset.py against the previous per-track DataFrame scans.
+# A synthetic dataset is used: the number of years of history is given with the -y flag, the number of groups with -g.
+# The Spotify answers are replaced by the tracks of the synthetic groups, so nothing is fetched.
+
+
+# system imports
+from argparse import ArgumentParser
+import datetime
+import logging
+import random
+import sys
+import time
+
+sys.path.append("./src")
+sys.path.append("./SongSmith/src/streaming")
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+from shared.logging_config import setup_logging
+import shared.spotify_fetching as spotify_fetching
+import dataset
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+TRACKS_PER_GROUP = 50
+# share of the tracks of a group, that are new on the day of the update
+NEW_TRACKS_SHARE = 0.1
+TRACKS_SEEN_PER_DAY = 2000
+
+
+class ArtistTopTracks:
+    """stands in for spotipy.Spotify, answering artist_top_tracks with the synthetic tracks"""
+
+    def __init__(self, tracks_per_group: dict):
+        self.tracks_per_group = tracks_per_group
+
+    def artist_top_tracks(self, artist_id: str) -> dict:
+        return {'tracks': self.tracks_per_group[artist_id]}
+
+
+def get_track(track_id: str) -> dict:
+    return {'id': track_id, 'name': f'Song {track_id}', 'artists': [{'name': f'Artist {track_id[-2:]}'}],
+            'popularity': int(track_id[-2:]), 'preview_url': None}
+
+
+def generate_dataset(years: int, number_of_groups: int) -> tuple:
+    """generates the tables of a dataset updated daily for the given years
+
+    Returns:
+        tuple: (df_tracks, df_popularity, df_names, df_group, tracks of each group on the day of the update)
+    """
+    rng = random.Random(0)
+    today = pd.Timestamp.today().date()
+    days = [today - datetime.timedelta(days=day) for day in range(1, 365 * years + 1)]
+    number_of_tracks = TRACKS_SEEN_PER_DAY * 10
+    track_ids = [f'track{i:08d}' for i in range(number_of_tracks)]
+
+    df_tracks = pd.DataFrame({'id': track_ids, 'name': [f'Song {i}' for i in track_ids],
+                              'artists': [f'Artist {i[-2:]}' for i in track_ids], 'preview_url': None})
+    popularity_ids = []
+    popularity_dates = []
+    for day in days:
+        popularity_ids.extend(rng.sample(track_ids, TRACKS_SEEN_PER_DAY))
+        popularity_dates.extend([day] * TRACKS_SEEN_PER_DAY)
+    df_popularity = pd.DataFrame({'id': popularity_ids, 'date': popularity_dates, 'value': 50})
+
+    group_ids = [f'group{i:04d}' for i in range(number_of_groups)]
+    df_names = pd.DataFrame({'id': group_ids, 'name': group_ids})
+    group_rows = []
+    tracks_per_group = {}
+    new_track_number = number_of_tracks
+    for group_id in group_ids:
+        group_track_ids = rng.sample(track_ids, TRACKS_PER_GROUP)
+        group_rows.extend((group_id, track_id, rng.choice(days), None) for track_id in group_track_ids)
+        # on the day of the update some tracks were removed from the group and some never seen tracks were added
+        number_of_new_tracks = int(TRACKS_PER_GROUP * NEW_TRACKS_SHARE)
+        current_track_ids = group_track_ids[number_of_new_tracks:] + [f'track{new_track_number + i:08d}' for i in range(number_of_new_tracks)]
+        new_track_number += number_of_new_tracks
+        tracks_per_group[group_id] = [get_track(track_id) for track_id in current_track_ids]
+    df_group = pd.DataFrame(group_rows, columns=['id', 'track_id', 'date_added', 'date_removed'])
+    return df_tracks, df_popularity, df_names, df_group, tracks_per_group
+
+
+def decide_with_scans(df_tracks, df_popularity, df_names, df_group, tracks_per_group) -> tuple:
+    """the previous implementation: the tables are scanned for every group and every track"""
+    today = pd.Timestamp.today().date()
+    tracks_to_add = {'id': [], 'name': [], 'artists': [], 'preview_url': []}
+    popularity_to_add = {'id': [], 'date': [], 'value': []}
+    for group_id in df_names.id:
+        df_current_group = df_group[df_group.id == group_id]
+        for current_track in tracks_per_group[group_id]:
+            track_id_curr = current_track['id']
+            if not df_current_group.loc[(df_current_group.track_id == track_id_curr) & (df_current_group.date_removed.isnull())].empty:
+                continue
+            if df_popularity.loc[(df_popularity.id == track_id_curr) & (df_popularity.date == today)].empty and track_id_curr not in popularity_to_add['id']:
+                popularity_to_add['id'].append(track_id_curr)
+                popularity_to_add['date'].append(today)
+                popularity_to_add['value'].append(current_track['popularity'])
+            if df_tracks[df_tracks.id == track_id_curr].empty and track_id_curr not in tracks_to_add['id']:
+                tracks_to_add['id'].append(track_id_curr)
+                tracks_to_add['name'].append(current_track['name'])
+                tracks_to_add['artists'].append(', '.join([f['name'] for f in current_track['artists']]))
+                tracks_to_add['preview_url'].append(current_track['preview_url'])
+    return tracks_to_add, popularity_to_add
+
+
+def decide_with_index(df_tracks, df_popularity, df_names, df_group, tracks_per_group) -> tuple:
+    """the implementation of dataset.py"""
+    tracks_to_add = {'id': [], 'name': [], 'artists': [], 'preview_url': []}
+    popularity_to_add = {'id': [], 'date': [], 'value': []}
+    index = dataset._build_index(df_tracks, df_popularity, pd.Timestamp.today().date())
+    _, tracks_to_add, popularity_to_add = dataset._update_grouped_table(
+        df_names=df_names,
+        df_group=df_group,
+        tracks_to_add=tracks_to_add,
+        popularity_to_add=popularity_to_add,
+        index=index,
+        sp=ArtistTopTracks(tracks_per_group),
+        mode='artists',
+        connection={},
+        # nothing is requested, the rate limit would just add waiting
+        limiter=spotify_fetching.TokenBucket(rate=1e9),
+    )
+    return tracks_to_add, popularity_to_add
+
+
+def measure(function, *args) -> tuple:
+    """runs function with the given arguments and measures the time
+
+    Returns:
+        tuple: (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/dataset_update.py...")
+    tables = generate_dataset(args.years, args.number_of_groups)
+    logger.info(f"{len(tables[0])} tracks, {len(tables[1])} popularity rows, {len(tables[3])} group rows, "
+                + f"{sum(len(tracks) for tracks in tables[4].values())} tracks fetched")
+
+    result_scans, time_scans = measure(decide_with_scans, *tables)
+    result_index, time_index = measure(decide_with_index, *tables)
+    logger.info(f"per-track scans {time_scans:.2f}s, index {time_index:.2f}s ({time_scans / time_index:.0f}x faster)")
+
+    if result_scans == result_index:
+        logger.info(f"Both decided identically: {len(result_index[0]['id'])} new tracks, {len(result_index[1]['id'])} new popularity rows")
+    else:
+        logger.error("The decisions DIFFER")
+
+    logger.info("End of program: benchmarks/dataset_update.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-y", "--years", type=int, default=3)
+    parser.add_argument("-g", "--number_of_groups", type=int, default=20)
+
+    args = parser.parse_args()
+    main(args)
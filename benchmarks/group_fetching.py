@@ -0,0 +1,127 @@
+# This script measures the fetching of the playlists and artists in dataset._update_grouped_table offline,
+# against the Spotify stub of spotify_stub_server.py (with the latency given with -l and the rate limit with -r).
+# The groups are fetched one at a time (one worker) and then concurrently (-w workers), both sharing a token bucket
+# of -q requests per second. Set -q above -r to see the 429 answers being handled.
+# The tables and the new tracks and popularity rows of both runs must be identical.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import sys
+import time
+import warnings
+
+sys.path.append("./src")
+sys.path.append("./SongSmith/src/streaming")
+
+# 3rd party imports
+import pandas as pd
+import spotipy
+
+# user imports
+import shared.dataloading as dataloading
+from shared.logging_config import setup_logging
+import shared.spotify_fetching as spotify_fetching
+import dataset
+import spotify_stub_server
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# spotipy warns about the deprecated endpoints on every call
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+def get_empty_tables(number_of_groups: int, prefix: str) -> tuple:
+    group_ids = [f"{prefix}{i:04d}" for i in range(number_of_groups)]
+    df_names = pd.DataFrame({"id": group_ids, "name": group_ids})
+    df_group = pd.DataFrame(columns=["id", "track_id", "date_added", "date_removed"])
+    return df_names, df_group
+
+
+def update_groups(sp: spotipy.Spotify, args, workers: int) -> tuple:
+    """runs the playlists and artists stages of dataset.update with the given number of workers
+
+    Returns:
+        tuple: (df_playlists, df_artists, tracks_to_add, popularity_to_add)
+    """
+    tracks_to_add = {"id": [], "name": [], "artists": [], "preview_url": []}
+    popularity_to_add = {"id": [], "date": [], "value": []}
+    index = {"track_ids": set(), "popularity_keys": set()}
+    limiter = spotify_fetching.TokenBucket(rate=args.client_requests_per_second)
+    results = []
+    for mode, number_of_groups in (("playlists", args.number_of_playlists), ("artists", args.number_of_artists)):
+        df_names, df_group = get_empty_tables(number_of_groups, mode[:-1])
+        df_group, tracks_to_add, popularity_to_add = dataset._update_grouped_table(
+            df_names=df_names,
+            df_group=df_group,
+            tracks_to_add=tracks_to_add,
+            popularity_to_add=popularity_to_add,
+            index=index,
+            sp=sp,
+            mode=mode,
+            connection={"username": "stub"},
+            limiter=limiter,
+            workers=workers,
+        )
+        results.append(df_group)
+    return results[0], results[1], tracks_to_add, popularity_to_add
+
+
+def measure(server, sp: spotipy.Spotify, args, workers: int) -> tuple:
+    """returns the result of update_groups, the seconds it took and the requests it made"""
+    counters_before = dict(server.counters)
+    start = time.perf_counter()
+    result = update_groups(sp, args, workers)
+    seconds = time.perf_counter() - start
+    counters = {key: server.counters[key] - counters_before[key] for key in counters_before}
+    return result, seconds, counters
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/group_fetching.py...")
+    server = spotify_stub_server.start_server(args.latency / 1000, args.requests_per_second, args.tracks_per_playlist)
+    # the session doesn't retry 429 answers, so they reach spotify_fetching with their Retry-After header,
+    # and it keeps a connection for every page requested at the same time
+    session = spotify_fetching.get_requests_session(pool_size=args.workers * dataloading.PLAYLIST_PAGE_WORKERS)
+    sp = spotipy.Spotify(auth="stub", requests_session=session)
+    sp.prefix = server.url
+
+    result_sequential, time_sequential, counters_sequential = measure(server, sp, args, 1)
+    # the stub's window of one second starts empty again
+    time.sleep(1)
+    result_concurrent, time_concurrent, counters_concurrent = measure(server, sp, args, args.workers)
+    server.shutdown()
+
+    for name, seconds, counters in (("one worker", time_sequential, counters_sequential),
+                                    (f"{args.workers} workers", time_concurrent, counters_concurrent)):
+        logger.info(f"{name}: {seconds:.2f}s, {counters['requests']} requests, {counters['rate_limited']} rate limited")
+    logger.info(f"{time_sequential / time_concurrent:.1f}x faster")
+
+    identical = (
+        result_sequential[0].equals(result_concurrent[0])
+        and result_sequential[1].equals(result_concurrent[1])
+        and result_sequential[2:] == result_concurrent[2:]
+    )
+    if identical:
+        logger.info(f"Both runs gave identical tables: {len(result_concurrent[0])} playlist rows, "
+                    + f"{len(result_concurrent[1])} artist rows, {len(result_concurrent[2]['id'])} new tracks")
+    else:
+        logger.error("The results DIFFER")
+
+    logger.info("End of program: benchmarks/group_fetching.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--number_of_playlists", type=int, default=20)
+    parser.add_argument("-a", "--number_of_artists", type=int, default=50)
+    parser.add_argument("-t", "--tracks_per_playlist", type=int, default=250)
+    parser.add_argument("-l", "--latency", type=float, default=100, help="milliseconds")
+    parser.add_argument("-r", "--requests_per_second", type=int, default=50, help="rate limit of the stub")
+    parser.add_argument("-q", "--client_requests_per_second", type=float, default=40, help="rate of the token bucket")
+    parser.add_argument("-w", "--workers", type=int, default=spotify_fetching.FETCH_WORKERS)
+
+    args = parser.parse_args()
+    main(args)
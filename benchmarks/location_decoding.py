@@ -0,0 +1,93 @@
+# This script compares the decoding of the @Location information with shared/locations.py
+# against the previous lambda of normalize_audio.py, which replaced a fixed list of percent-escapes row by row.
+# By default synthetic locations are used (the number of rows is given with the -n flag),
+# pass the path to your rekordbox.xml file with the -r flag to use the locations of your collection instead.
+# Besides the time it counts the rows the lambda decodes wrongly and checks that the paths encode back into the locations.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import random
+import sys
+import time
+from urllib.parse import quote
+
+sys.path.append("./src")
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+import shared.dataloading as dataloading
+import shared.locations as locations
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# characters appearing in the filenames of a music collection
+FILENAME_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789     -_()[]&',.!#+éëöüçñ"
+
+
+def decode_with_lambda(location_series: pd.Series) -> list:
+    return location_series.apply(lambda x: x[16:].replace('%20', ' ').replace(
+        '%26', '&').replace('%27', '\'').replace('%c3%ab', 'ë').replace('%5b', '[').replace('%5d', ']').replace('%c3%b6', 'ö').replace('%c3%bc', 'ü')).to_list()
+
+
+def generate_locations(number_of_rows: int) -> pd.Series:
+    """generates locations like rekordbox writes them: lowercase escapes, a few thousand folders
+
+    Returns:
+        pd.Series: the locations
+    """
+    rng = random.Random(0)
+    folders = [f'/Volumes/Music/Genre {i % 25}/Artist {i} & Friends/Album {i}' for i in range(number_of_rows // 20)]
+    paths = [rng.choice(folders) + '/' + ''.join(rng.choices(FILENAME_CHARACTERS, k=30)) + '.mp3' for _ in range(number_of_rows)]
+    return pd.Series(['file://localhost' + quote(path, safe='/').lower() for path in paths])
+
+
+def measure(function, *args) -> tuple:
+    """runs function with the given arguments and measures the time
+
+    Returns:
+        tuple: (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/location_decoding.py...")
+    if args.path_to_rb != "":
+        location_series = dataloading.load_dataframe_from_rekordbox_xml(args.path_to_rb)['@Location']
+        location_series = location_series[locations.is_local_file(location_series)].reset_index(drop=True)
+    else:
+        location_series = generate_locations(args.number_of_rows)
+
+    lambda_paths, lambda_time = measure(decode_with_lambda, location_series)
+    paths, decode_time = measure(locations.decode_locations, location_series)
+    encoded, encode_time = measure(locations.encode_paths, paths)
+    # row by row the folders are found in the LRU cache
+    _, row_time = measure(lambda series: [locations.location_to_path(location) for location in series], location_series)
+
+    logger.info(f"{len(location_series)} rows: lambda {lambda_time:.3f}s, decode_locations {decode_time:.3f}s, "
+                + f"location_to_path row by row {row_time:.3f}s, encode_paths {encode_time:.3f}s")
+    logger.info(f"The lambda decoded {sum(a != b for a, b in zip(lambda_paths, paths))} of {len(paths)} rows wrongly")
+
+    if (locations.decode_locations(encoded) == paths).all():
+        logger.info("All the paths decode identically after encoding them again")
+    else:
+        logger.error("Some paths DIFFER after encoding and decoding them again")
+
+    logger.info("End of program: benchmarks/location_decoding.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--path_to_rb", default="")
+    parser.add_argument("-n", "--number_of_rows", type=int, default=100000)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,104 @@
+# This script checks that normalize_audio.normalize_file doesn't clip. It generates test songs with ffmpeg
+# (a sine tone as wav and flac with a peak ffmpeg rounds up, and noise encoded as mp3 and m4a), normalizes them without headroom
+# and with NORMALIZE_HEADROOM, decodes the results into floats and counts the samples at or above full scale.
+# It needs ffmpeg and ffprobe on the PATH and stops with a message if they are missing.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.append("./FilePilot/src/collection")
+
+# 3rd party imports
+import numpy as np
+
+# user imports
+from shared.logging_config import setup_logging
+import normalize_audio
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+# the largest sample of 16 bit audio, everything at or above it is clipped
+FULL_SCALE = 32767 / 32768
+# name of the test song and the ffmpeg arguments generating it
+TEST_SONGS = {
+    # a peak of -3.06 dBFS (the sine of ffmpeg is at -18.06 dBFS) is reported as -3.1 dB, so the gain overshoots by 0.04 dB
+    "sine_rounded_up.wav": ["-f", "lavfi", "-i", f"sine=frequency=1000:sample_rate={SAMPLE_RATE}", "-af", "volume=15dB",
+                            "-c:a", "pcm_s16le"],
+    "sine_rounded_up.flac": ["-f", "lavfi", "-i", f"sine=frequency=1000:sample_rate={SAMPLE_RATE}", "-af", "volume=15dB"],
+    "noise.mp3": ["-f", "lavfi", "-i", f"anoisesrc=color=pink:sample_rate={SAMPLE_RATE}:amplitude=0.3", "-b:a", "192k"],
+    "noise.m4a": ["-f", "lavfi", "-i", f"anoisesrc=color=pink:sample_rate={SAMPLE_RATE}:amplitude=0.3", "-c:a", "aac", "-b:a", "192k"],
+}
+
+
+def generate_songs(folder: str, seconds: float):
+    for name, arguments in TEST_SONGS.items():
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + arguments + ["-t", str(seconds), "-ac", "2",
+                                                                                              os.path.join(folder, name)],
+                       check=True)
+
+
+def get_samples(path: str) -> np.ndarray:
+    """decodes the file into 32 bit floats, so the samples above full scale are kept"""
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path, "-f", "f32le", "-acodec", "pcm_f32le", "-"],
+                            capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def normalize_songs(source_folder: str, destination_folder: str, headroom: float) -> dict:
+    """normalizes every test song with the headroom
+
+    Returns:
+        dict: key is the name of the test song, value (peak in dBFS, number of clipped samples)
+    """
+    normalize_audio.NORMALIZE_HEADROOM = headroom
+    results = {}
+    for name in TEST_SONGS:
+        result = normalize_audio.normalize_file(name, source_folder, destination_folder)
+        samples = np.abs(get_samples(os.path.join(destination_folder, result["output"])))
+        results[name] = (20 * np.log10(samples.max()), int((samples >= FULL_SCALE).sum()))
+    return results
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/normalize_headroom.py...")
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        logger.warning("ffmpeg and ffprobe must be on the PATH to normalize the test songs. Skipping...")
+        logger.info("End of program: benchmarks/normalize_headroom.py\n")
+        return
+
+    headroom_configured = normalize_audio.NORMALIZE_HEADROOM
+    clipping = False
+    with tempfile.TemporaryDirectory() as folder:
+        source_folder = os.path.join(folder, "source")
+        os.mkdir(source_folder)
+        generate_songs(source_folder, args.seconds)
+        for headroom in (0.0, headroom_configured):
+            destination_folder = os.path.join(folder, f"headroom {headroom}")
+            os.mkdir(destination_folder)
+            for name, (peak, clipped) in normalize_songs(source_folder, destination_folder, headroom).items():
+                logger.info(f"headroom {headroom} dB, {name}: peak {peak:+.2f} dBFS, {clipped} clipped samples")
+                if clipped and headroom == headroom_configured:
+                    clipping = True
+
+    if clipping:
+        logger.error(f"🚨 Songs normalized with the headroom of {headroom_configured} dB CLIP")
+    else:
+        logger.info(f"✅ No song normalized with the headroom of {headroom_configured} dB clips")
+    logger.info("End of program: benchmarks/normalize_headroom.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--seconds", type=float, default=10)
+
+    args = parser.parse_args()
+    main(args)
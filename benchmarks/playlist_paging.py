@@ -0,0 +1,102 @@
+# This script compares dataloading.get_playlist_total_tracks (the first page tells the total, the other pages are
+# requested concurrently by their offset, with a fields projection) against the previous way of following the next links
+# of full pages one after the other. It runs offline against the Spotify stub of spotify_stub_server.py,
+# with -n playlists of -t tracks each and the latency given with -l.
+# Besides the time it measures the bytes sent by the stub, the time until the first item arrived and checks that
+# both ways return the same tracks in the same order.
+
+
+# system imports
+from argparse import ArgumentParser
+import logging
+import sys
+import time
+import warnings
+
+sys.path.append("./src")
+
+# 3rd party imports
+import spotipy
+
+# user imports
+import shared.dataloading as dataloading
+from shared.logging_config import setup_logging
+import shared.spotify_fetching as spotify_fetching
+import spotify_stub_server
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# spotipy warns about the deprecated endpoints on every call
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+def get_tracks_following_next(sp: spotipy.Spotify, username: str, playlist_id: str, limiter: spotify_fetching.TokenBucket):
+    """the previous implementation: full pages, each one requested after the one before"""
+    results = spotify_fetching.call_with_retry(limiter, sp.user_playlist_tracks, username, playlist_id)
+    tracks = results["items"]
+    while results["next"]:
+        results = spotify_fetching.call_with_retry(limiter, sp.next, results)
+        tracks.extend(results["items"])
+    return tracks
+
+
+def get_tracks_by_offset(sp: spotipy.Spotify, username: str, playlist_id: str, limiter: spotify_fetching.TokenBucket):
+    return dataloading.get_playlist_total_tracks(sp, username, playlist_id, limiter=limiter)
+
+
+def measure(server, function, sp: spotipy.Spotify, args) -> tuple:
+    """fetches the playlists one after the other with the function
+
+    Returns:
+        tuple: (the track ids of every playlist, seconds, seconds until the first item, bytes sent by the stub)
+    """
+    limiter = spotify_fetching.TokenBucket(rate=args.client_requests_per_second)
+    bytes_before = server.counters["bytes"]
+    track_ids = []
+    first_item_seconds = None
+    start = time.perf_counter()
+    for number in range(args.number_of_playlists):
+        playlist_track_ids = []
+        for item in function(sp, "stub", f"playlist{number:04d}", limiter):
+            if first_item_seconds is None:
+                first_item_seconds = time.perf_counter() - start
+            playlist_track_ids.append(item["track"]["id"])
+        track_ids.append(playlist_track_ids)
+    seconds = time.perf_counter() - start
+    return track_ids, seconds, first_item_seconds, server.counters["bytes"] - bytes_before
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/playlist_paging.py...")
+    server = spotify_stub_server.start_server(args.latency / 1000, args.requests_per_second, args.tracks_per_playlist)
+    sp = spotipy.Spotify(auth="stub", requests_session=spotify_fetching.get_requests_session(pool_size=dataloading.PLAYLIST_PAGE_WORKERS))
+    sp.prefix = server.url
+
+    results = {}
+    for name, function in (("following next", get_tracks_following_next), ("by offset", get_tracks_by_offset)):
+        results[name] = measure(server, function, sp, args)
+        track_ids, seconds, first_item_seconds, sent = results[name]
+        logger.info(f"{name}: {seconds:.2f}s, first item after {first_item_seconds:.2f}s, {sent / 1024 ** 2:.1f} MB received")
+        # the stub's window of one second starts empty again
+        time.sleep(1)
+    server.shutdown()
+
+    if results["following next"][0] == results["by offset"][0]:
+        logger.info(f"Both returned the same {sum(len(ids) for ids in results['by offset'][0])} tracks in the same order")
+    else:
+        logger.error("The tracks DIFFER")
+
+    logger.info("End of program: benchmarks/playlist_paging.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number_of_playlists", type=int, default=5)
+    parser.add_argument("-t", "--tracks_per_playlist", type=int, default=2000)
+    parser.add_argument("-l", "--latency", type=float, default=100, help="milliseconds")
+    parser.add_argument("-r", "--requests_per_second", type=int, default=50, help="rate limit of the stub")
+    parser.add_argument("-q", "--client_requests_per_second", type=float, default=40, help="rate of the token bucket")
+
+    args = parser.parse_args()
+    main(args)
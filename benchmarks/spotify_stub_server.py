@@ -0,0 +1,206 @@
+# This script serves a stub of the Spotify Web API on localhost, so the fetching of SongSmith can be tried offline.
+# It answers the endpoints used by dataset.py (the tracks of a playlist, paged and projected to the fields parameter,
+# and the top tracks of an artist) with synthetic tracks derived from the requested ids, so every run returns the same data.
+# Each answer is delayed by the latency given with -l (milliseconds), and more than -r requests within one second
+# are answered with 429 and a Retry-After header, like Spotify does.
+# Point spotipy at it with spotipy.Spotify(auth="stub", prefix=<the printed url>), or use start_server from another script.
+
+
+# system imports
+from argparse import ArgumentParser
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+sys.path.append("./src")
+
+# user imports
+from shared.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+TOP_TRACKS_PER_ARTIST = 10
+# the markets every track is available in, they make the track objects as large as the real ones
+MARKETS = ["AD", "AE", "AR", "AT", "AU", "BE", "BG", "BR", "CA", "CH", "CL", "CO", "CZ", "DE", "DK", "ES", "FI", "FR",
+           "GB", "GR", "HU", "IE", "IT", "JP", "MX", "NL", "NO", "NZ", "PL", "PT", "SE", "US"]
+
+
+def get_track(track_id: str) -> dict:
+    """returns a track object like Spotify's, derived from the id"""
+    number = sum(track_id.encode())
+    artist = {"id": f"artist{number % 97:04d}", "name": f"Artist {number % 97}", "type": "artist"}
+    return {
+        "id": track_id,
+        "name": f"Song {track_id}",
+        "artists": [artist],
+        "popularity": number % 101,
+        "preview_url": None,
+        "duration_ms": 180000 + number % 60000,
+        "album": {"id": f"album{number % 991:04d}", "name": f"Album {number % 991}", "artists": [artist],
+                  "available_markets": MARKETS, "release_date": "2024-01-01"},
+        "available_markets": MARKETS,
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "type": "track",
+    }
+
+
+def parse_fields(text: str) -> dict:
+    """parses the fields parameter of Spotify, e.g. "total,items(track(id,artists(name)))"
+
+    Returns:
+        dict: key is the field, value the dict of its subfields (None for the whole field)
+    """
+    fields = {}
+    stack = [fields]
+    name = ""
+    for character in text + ",":
+        if character == "(":
+            stack[-1][name.strip()] = {}
+            stack.append(stack[-1][name.strip()])
+            name = ""
+        elif character in ",)":
+            if name.strip():
+                stack[-1][name.strip()] = None
+            name = ""
+            if character == ")":
+                stack.pop()
+        else:
+            name += character
+    return fields
+
+
+def project(value, fields: dict):
+    """keeps just the fields of the value (lists are projected item by item)"""
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subfields) for key, subfields in fields.items() if key in value}
+    return value
+
+
+class StubSpotifyHandler(BaseHTTPRequestHandler):
+    """answers the requests, the settings and counters are kept on the server"""
+
+    def log_message(self, format, *args):
+        # the requests are counted instead of logged
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.counters["bytes"] += len(data)
+
+    def _is_rate_limited(self) -> bool:
+        """counts the request into the sliding window of one second"""
+        with self.server.lock:
+            now = time.monotonic()
+            window = self.server.request_times
+            while window and now - window[0] >= 1:
+                window.popleft()
+            if len(window) >= self.server.requests_per_second:
+                self.server.counters["rate_limited"] += 1
+                return True
+            window.append(now)
+            self.server.counters["requests"] += 1
+            return False
+
+    def _get_playlist_tracks(self, playlist_id: str, query: dict) -> dict:
+        total = self.server.tracks_per_playlist
+        limit = int(query.get("limit", ["100"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        items = [
+            {"added_at": "2024-01-01T00:00:00Z", "track": get_track(f"{playlist_id}track{number:05d}")}
+            for number in range(offset, min(offset + limit, total))
+        ]
+        next_url = None
+        if offset + limit < total:
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query["offset"] = offset + limit
+            next_url = f"{self.server.url}playlists/{playlist_id}/items?{urlencode(next_query)}"
+        return {"items": items, "limit": limit, "offset": offset, "total": total, "next": next_url}
+
+    def do_GET(self):
+        if self._is_rate_limited():
+            self._send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}}, {"Retry-After": "1"})
+            return
+        time.sleep(self.server.latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        # /v1/playlists/<id>/items (or /tracks) and /v1/artists/<id>/top-tracks
+        if len(parts) == 4 and parts[1] == "playlists" and parts[3] in ("items", "tracks"):
+            page = self._get_playlist_tracks(parts[2], query)
+            if "fields" in query:
+                page = project(page, parse_fields(query["fields"][0]))
+            self._send_json(200, page)
+        elif len(parts) == 4 and parts[1] == "artists" and parts[3] == "top-tracks":
+            self._send_json(200, {"tracks": [get_track(f"{parts[2]}top{number:02d}") for number in range(TOP_TRACKS_PER_ARTIST)]})
+        else:
+            self._send_json(404, {"error": {"status": 404, "message": "Service not found"}})
+
+
+def start_server(latency: float = 0.1, requests_per_second: int = 50, tracks_per_playlist: int = 250,
+                 port: int = 0) -> ThreadingHTTPServer:
+    """starts the stub server in a background thread
+
+    Args:
+        latency (float, optional): seconds each answer is delayed. Defaults to 0.1.
+        requests_per_second (int, optional): the rate limit. Defaults to 50.
+        tracks_per_playlist (int, optional): number of tracks of every playlist. Defaults to 250.
+        port (int, optional): the port, 0 for any free one. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: the server, server.url is the prefix for spotipy and server.counters counts the
+            requests answered, the ones rate limited and the bytes sent
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubSpotifyHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.requests_per_second = requests_per_second
+    server.tracks_per_playlist = tracks_per_playlist
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    server.lock = threading.Lock()
+    server.request_times = deque()
+    server.counters = {"requests": 0, "rate_limited": 0, "bytes": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/spotify_stub_server.py...")
+    server = start_server(args.latency / 1000, args.requests_per_second, args.tracks_per_playlist, args.port)
+    logger.info(f"Serving the Spotify stub at {server.url}, stop it with Ctrl+C")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+    logger.info(f"Answered {server.counters['requests']} requests, {server.counters['rate_limited']} rate limited")
+    logger.info("End of program: benchmarks/spotify_stub_server.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    parser.add_argument("-l", "--latency", type=float, default=100, help="milliseconds")
+    parser.add_argument("-r", "--requests_per_second", type=int, default=50)
+    parser.add_argument("-t", "--tracks_per_playlist", type=int, default=250)
+
+    args = parser.parse_args()
+    main(args)
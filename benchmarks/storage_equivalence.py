@@ -0,0 +1,193 @@
+# This script runs dataset.update for several simulated days (-d flag) once with the csv and once with the sqlite storage
+# and checks that both end up with identical tables. The Spotify answers are simulated: every day some tracks are
+# removed from the playlists, the artists and the favourite tracks and come back a day later, and every playlist holds
+# one of its tracks twice. The playlists, artists and tracks_fav tables must also match the rows expected from the
+# simulation: one row per time a track was in the group, closed on the day it was removed.
+# The raw types SQLite stored are checked as well: the date_removed of the rows still open must be NULL.
+
+
+# system imports
+from argparse import ArgumentParser
+import datetime
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.append("./src")
+sys.path.append("./SongSmith/src/streaming")
+
+# 3rd party imports
+import pandas as pd
+
+# user imports
+from shared.logging_config import setup_logging
+import dataset
+import storage
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+FIRST_DAY = datetime.date(2024, 1, 1)
+TRACKS_PER_GROUP = 12
+# a track is missing from its group every REMOVAL_PERIOD days, shifted by the track and the group
+REMOVAL_PERIOD = 4
+
+
+def get_track(track_id: str) -> dict:
+    return {'id': track_id, 'name': f'Song {track_id}', 'artists': [{'name': f'Artist {track_id[-1]}'}],
+            'popularity': int(track_id[-2:]), 'preview_url': None}
+
+
+def get_group_track_ids(group_number: int) -> list:
+    # neighbouring groups share some of their tracks
+    return [f'track{(group_number * TRACKS_PER_GROUP // 2 + number) % 100:02d}' for number in range(TRACKS_PER_GROUP)]
+
+
+def is_present(group_number: int, track_number: int, day_number: int) -> bool:
+    return (group_number + track_number + day_number) % REMOVAL_PERIOD != 0
+
+
+def get_stints(group_number: int, track_number: int, number_of_days: int) -> list:
+    """returns (date_added, date_removed) of every time the track was in the group, date_removed is None if it still is"""
+    stints = []
+    for day_number in range(number_of_days):
+        day = FIRST_DAY + datetime.timedelta(days=day_number)
+        if is_present(group_number, track_number, day_number) and (not stints or stints[-1][1] is not None):
+            stints.append((day, None))
+        elif not is_present(group_number, track_number, day_number) and stints and stints[-1][1] is None:
+            stints[-1] = (stints[-1][0], day)
+    return stints
+
+
+class SimulatedSpotify:
+    """stands in for spotipy.Spotify, answering with the tracks the groups hold on the simulated day"""
+
+    def __init__(self, playlist_ids: list, artist_ids: list, day_number: int):
+        self.playlist_ids = playlist_ids
+        self.artist_ids = artist_ids
+        self.day_number = day_number
+
+    def _get_tracks(self, group_number: int) -> list:
+        return [get_track(track_id) for track_number, track_id in enumerate(get_group_track_ids(group_number))
+                if is_present(group_number, track_number, self.day_number)]
+
+    def user_playlists(self, username: str) -> dict:
+        return {'items': [{'id': playlist_id, 'name': playlist_id} for playlist_id in self.playlist_ids]}
+
+    def artist(self, artist_id: str) -> dict:
+        return {'name': artist_id}
+
+    def playlist_items(self, playlist_id: str, fields: str = None, limit: int = 100, offset: int = 0, additional_types=None) -> dict:
+        tracks = self._get_tracks(self.playlist_ids.index(playlist_id))
+        # the first track is in the playlist twice
+        items = [{'track': track} for track in tracks + tracks[:1]]
+        return {'items': items[offset:offset + limit], 'total': len(items)}
+
+    def artist_top_tracks(self, artist_id: str) -> dict:
+        return {'tracks': self._get_tracks(len(self.playlist_ids) + self.artist_ids.index(artist_id))}
+
+    def current_user_saved_tracks(self, limit: int = 20, offset: int = 0) -> dict:
+        group_number = len(self.playlist_ids) + len(self.artist_ids)
+        items = []
+        for track_number, track_id in enumerate(get_group_track_ids(group_number)):
+            stints = get_stints(group_number, track_number, self.day_number + 1)
+            if stints and stints[-1][1] is None:
+                items.append({'added_at': f'{stints[-1][0].isoformat()}T12:00:00Z', 'track': get_track(track_id)})
+        return {'items': items[offset:offset + limit], 'total': len(items)}
+
+
+def get_expected_rows(group_ids: list, first_group_number: int, number_of_days: int) -> pd.DataFrame:
+    rows = []
+    for group_number, group_id in enumerate(group_ids, start=first_group_number):
+        for track_number, track_id in enumerate(get_group_track_ids(group_number)):
+            rows.extend((group_id, track_id, date_added, date_removed)
+                        for date_added, date_removed in get_stints(group_number, track_number, number_of_days))
+    return pd.DataFrame(rows, columns=['id', 'track_id', 'date_added', 'date_removed'])
+
+
+def get_sorted_rows(df: pd.DataFrame, table_name: str) -> list:
+    return sorted(storage._to_comparable_rows(df[storage.TABLES[table_name]['columns']]))
+
+
+def run_days(backend_name: str, folder: str, playlist_ids: list, artist_ids: list, number_of_days: int) -> dict:
+    """creates the dataset with the storage backend and updates it once per simulated day
+
+    Returns:
+        dict: key is the table name, value the sorted rows of the table
+    """
+    config = {'datapath': folder, 'storage': backend_name,
+              'playlist_to_allowed_tracks': {playlist_id: None for playlist_id in playlist_ids}, 'artists_followed': artist_ids}
+    dataset.create(config)
+    for day_number in range(number_of_days):
+        sp = SimulatedSpotify(playlist_ids, artist_ids, day_number)
+        dataset.update(config, {'username': 'simulated'}, sp=sp, today=FIRST_DAY + datetime.timedelta(days=day_number))
+    backend = storage.get_storage(config)
+    return {table_name: get_sorted_rows(backend.read(table_name), table_name) for table_name in storage.TABLES}
+
+
+def get_stored_date_types(database: str) -> dict:
+    """counts the types SQLite stored in the date_removed columns (the raw types, not the ones pandas converts them into)
+
+    Returns:
+        dict: key is the table name, value a dict with the type (e.g. null or text) as key and the number of rows as value
+    """
+    connection = sqlite3.connect(database)
+    try:
+        return {table_name: dict(connection.execute(
+                    f'SELECT typeof(date_removed), COUNT(*) FROM {table_name} GROUP BY typeof(date_removed)').fetchall())
+                for table_name in ('playlists', 'artists', 'tracks_fav')}
+    finally:
+        connection.close()
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/storage_equivalence.py...")
+    playlist_ids = [f'playlist{number}' for number in range(args.number_of_playlists)]
+    artist_ids = [f'artist{number}' for number in range(args.number_of_artists)]
+
+    tables = {}
+    for backend_name in ('csv', 'sqlite'):
+        with tempfile.TemporaryDirectory() as folder:
+            tables[backend_name] = run_days(backend_name, folder, playlist_ids, artist_ids, args.number_of_days)
+            if backend_name == 'sqlite':
+                date_types = get_stored_date_types(os.path.join(folder, storage.DATABASE_NAME))
+
+    expected = {
+        'playlists': get_expected_rows(playlist_ids, 0, args.number_of_days),
+        'artists': get_expected_rows(artist_ids, len(playlist_ids), args.number_of_days),
+        'tracks_fav': get_expected_rows(['fav'], len(playlist_ids) + len(artist_ids), args.number_of_days)
+        .drop(columns=['id']).rename(columns={'track_id': 'id'}),
+    }
+
+    differences = 0
+    for table_name, types in date_types.items():
+        # the rows still open must hold NULL and not e.g. the text NaT
+        expected_types = expected[table_name]['date_removed'].isna().map({True: 'null', False: 'text'}).value_counts().to_dict()
+        if types != expected_types:
+            differences += 1
+            logger.error(f"🚨 The sqlite {table_name} table stores date_removed as {types}, expected {expected_types}")
+    for table_name in storage.TABLES:
+        csv_rows, sqlite_rows = tables['csv'][table_name], tables['sqlite'][table_name]
+        logger.info(f"{table_name}: {len(csv_rows)} rows with csv, {len(sqlite_rows)} rows with sqlite")
+        if csv_rows != sqlite_rows:
+            differences += 1
+            logger.error(f"🚨 The {table_name} tables of csv and sqlite DIFFER")
+        if table_name in expected and sqlite_rows != get_sorted_rows(expected[table_name], table_name):
+            differences += 1
+            logger.error(f"🚨 The {table_name} table DIFFERS from the {len(expected[table_name])} rows expected from the simulation")
+
+    if differences == 0:
+        logger.info(f"✅ Both storages hold identical tables after {args.number_of_days} days, as expected from the simulation")
+    logger.info("End of program: benchmarks/storage_equivalence.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--number_of_days", type=int, default=10)
+    parser.add_argument("-p", "--number_of_playlists", type=int, default=3)
+    parser.add_argument("-a", "--number_of_artists", type=int, default=3)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,77 @@
+# This script compares the streaming xml writer with the previous xmltodict.unparse path,
+# which builds the whole document as one string before writing it.
+# Pass the path to your rekordbox.xml file as a program argument with the -r flag.
+# Both outputs are written into the folder given with the -o flag and compared byte by byte.
+
+
+# system imports
+from argparse import ArgumentParser
+import filecmp
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append("./src")
+
+# 3rd party imports
+import xmltodict
+
+# user imports
+from shared.logging_config import setup_logging
+import shared.rekordbox_xml as rekordbox_xml
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def write_with_unparse(input_data: dict, out_path: str, pretty: bool) -> None:
+    with open(out_path, "w", encoding="utf-8") as xml_outfile:
+        xml_outfile.write(xmltodict.unparse(input_data, pretty=pretty))
+
+
+def measure(function, *args) -> tuple:
+    """runs function with the given arguments and measures the time and the peak of the allocated memory
+
+    Returns:
+        tuple: (seconds, peak memory in MB)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1024**2
+
+
+def main(args):
+    logger.info("Start of program: benchmarks/xml_writer.py...")
+    input_data = rekordbox_xml.load_rekordbox_xml(args.path_to_rb)
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    for pretty in [True, False]:
+        unparse_path = os.path.join(args.output_folder, f"unparse_pretty_{pretty}.xml")
+        stream_path = os.path.join(args.output_folder, f"stream_pretty_{pretty}.xml")
+
+        unparse_time, unparse_memory = measure(write_with_unparse, input_data, unparse_path, pretty)
+        stream_time, stream_memory = measure(rekordbox_xml.write_rekordbox_xml, input_data, stream_path, pretty)
+
+        logger.info(f"pretty={pretty}: unparse {unparse_time:.2f}s / {unparse_memory:.1f} MB peak, "
+                    + f"streaming {stream_time:.2f}s / {stream_memory:.1f} MB peak")
+        if filecmp.cmp(unparse_path, stream_path, shallow=False):
+            logger.info(f"pretty={pretty}: outputs are byte-identical")
+        else:
+            logger.error(f"pretty={pretty}: outputs DIFFER ({unparse_path} vs {stream_path})")
+
+    logger.info("End of program: benchmarks/xml_writer.py\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--path_to_rb", required=True)
+    parser.add_argument("-o", "--output_folder", default="benchmark_output")
+
+    args = parser.parse_args()
+    main(args)
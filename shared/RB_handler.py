@@ -5,19 +5,49 @@
 # system imports
 import logging
 import sys
+import unicodedata
+from urllib.parse import unquote
 
 sys.path.append("./src")
 
 # 3rd party imports
-import xmltodict
+import pandas as pd
 
 # user imports
+import shared.dataloading as dataloading
 from shared.logging_config import setup_logging
+import shared.rekordbox_xml as rekordbox_xml
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
 
+def _normalize_text(text: str) -> str:
+    """normalizes a text for comparing: unicode NFC (macOS exports use NFD), casefolded and with collapsed whitespace
+
+    Args:
+        text (str): text you want to normalize
+
+    Returns:
+        str: the normalized text
+    """
+    if text is None:
+        return ''
+    return ' '.join(unicodedata.normalize('NFC', text).casefold().split())
+
+
+def _normalize_location(location: str) -> str:
+    """normalizes a @Location information, so the same file is found regardless of the url-encoding, unicode normal form and case
+
+    Args:
+        location (str): the @Location information of a track
+
+    Returns:
+        str: the normalized location
+    """
+    return unicodedata.normalize('NFC', unquote(location)).casefold()
+
+
 class RB_handler():
     def __init__(self, rb_input_path: str) -> None:
         """constructor of class
@@ -43,10 +73,9 @@ class RB_handler():
         Returns:
             dict: the converted xml file as a dict
         """
-        with open(filepath, 'r') as xml_file:
-            input_data = xmltodict.parse(xml_file.read())
-            logger.info('Successfully loaded the XML File!')
-            return input_data
+        input_data = dataloading.get_dict_from_xml(filepath)
+        logger.info('Successfully loaded the XML File!')
+        return input_data
 
     def export_data_to_xml(self, out_path: str) -> None:
         """outputs the changed data into a xml again
@@ -55,47 +84,77 @@ class RB_handler():
             out_path (str): filepath to where you want to change it
         """
         logger.info('Exporting to XML...')
-        with open(out_path, 'w') as xml_outfile:
-            xml_outfile.write(xmltodict.unparse(self.rawdata_rb, pretty=True))
+        rekordbox_xml.write_rekordbox_xml(self.rawdata_rb, out_path, pretty=True)
 
         logger.info('Exporting to XML...Done!')
         return
 
     def change_tracks_source_path(self, old_location: str, new_location: str, location_of_interest: str) -> None:
         """chaniging the source location of the tracks, found in old_location, to new_location.
-        Tracks, which aren't stroed in old_location are removed from self.data
+        Tracks, which aren't stroed in location_of_interest are removed from self.data
 
         Args:
             old_location (str): location you want to change.
             new_location (str): location you want to change it to.
             location_of_interest (str): files that are not stored in this directory will be removed.
         """
-
-        # counter to keep track of the number of tracks, that were changed and the ones, that arn't
-        cnt_changed_tracks = 0
-        cnt_removed_tracks = 0
-
-        # going threw all the tracks
-        for i in self.data:
-            curr_location = i['@Location']
-            if location_of_interest in curr_location:
-                changed_location = curr_location.replace(
-                    old_location, new_location)
-                cnt_changed_tracks += 1
-                i['@Location'] = changed_location
-            else:    
-                logger.warning(f'Not in {location_of_interest}: ' + i['@Name'].ljust(60) + curr_location)
-                cnt_removed_tracks += 1
-                i['@Location'] = None
-
-        self.data = [i for i in self.data if i['@Location'] is not None]
-
-        logger.info(f'Went threw {cnt_removed_tracks + cnt_changed_tracks} tracks.'
-              + f'\nChanged location of {cnt_changed_tracks} trakcks from \"{old_location}\" to \"{new_location}\".'
-              + f'\nRemoved {cnt_removed_tracks} tracks.')
+        self.relocate_tracks({old_location: new_location}, location_of_interest)
 
         return
 
+    def relocate_tracks(self, rules: dict, location_of_interest: str = '') -> dict:
+        """changing the source location of the tracks according to several prefix rules in one pass.
+        Only the beginning of a location is replaced; if several rules match, the longest prefix wins.
+        Tracks whose location doesn't contain location_of_interest are removed from self.data
+
+        Args:
+            rules (dict): key is the location prefix you want to change and value the prefix you want to change it to
+            location_of_interest (str, optional): files whose location doesn't contain this text will be removed,
+                e.g. the name of the music folder. Defaults to ''.
+
+        Returns:
+            dict: key is the prefix of the rule and value the number of tracks changed by it
+        """
+        rules_pattern = rekordbox_xml.compile_location_rules(rules)
+
+        locations = pd.Series([i.get('@Location') for i in self.data], dtype=object)
+        # like change_tracks_source_path always did, the location just needs to contain the location of interest.
+        # Tracks without location are kept just if there is no location of interest
+        is_of_interest = locations.str.contains(location_of_interest, regex=False, na=location_of_interest == '')
+        matched_prefixes = locations.where(is_of_interest).str.extract(rules_pattern.pattern, expand=False)
+
+        # replacing the prefix for all the tracks of a rule at once
+        new_locations = locations.copy()
+        cnt_per_rule = {prefix: 0 for prefix in rules}
+        for prefix, indices in matched_prefixes.groupby(matched_prefixes).indices.items():
+            new_locations.iloc[indices] = rules[prefix] + locations.iloc[indices].str.slice(len(prefix))
+            cnt_per_rule[prefix] = len(indices)
+
+        tracks_to_keep = []
+        for track, new_location, keep in zip(self.data, new_locations, is_of_interest):
+            if keep:
+                if pd.notna(new_location):
+                    track['@Location'] = new_location
+                tracks_to_keep.append(track)
+            else:
+                logger.warning(f'Not in {location_of_interest}: ' + str(track.get('@Name')).ljust(60) + str(track.get('@Location')))
+
+        cnt_removed_tracks = len(self.data) - len(tracks_to_keep)
+        self.data = tracks_to_keep
+
+        # the removed tracks must also be removed from the data, that gets exported
+        collection = self.rawdata_rb['DJ_PLAYLISTS']['COLLECTION']
+        collection['TRACK'] = self.data
+        collection['@Entries'] = str(len(self.data))
+
+        logger.info(f'Went threw {len(locations)} tracks.'
+                    + f'\nChanged location of {sum(cnt_per_rule.values())} tracks.'
+                    + f'\nRemoved {cnt_removed_tracks} tracks.')
+        for prefix, count in cnt_per_rule.items():
+            logger.info(f'- {count} tracks from "{prefix}" to "{rules[prefix]}"')
+
+        return cnt_per_rule
+
 
 class RB_handler_five_six():
     def __init__(self, rb5_input_path: str, rb6_input_path: str, location_of_interest: str, keys_to_update: list) -> None:
@@ -121,16 +180,20 @@ class RB_handler_five_six():
         # the given keys will be updated in rb6 given from 5
         self.keys_to_update = keys_to_update
 
+        # key is the path of a playlist and value the number of tracks, that couldn't be converted
+        self.unmapped_playlist_entries = {}
+
         # generating the rb5 to rb6 dict
         self._generate_mapping_dict_from_5to6()
 
         return
 
-    def update_rb6_according_to_5(self, number_of_tracks: int = -1) -> None:
+    def update_rb6_according_to_5(self, number_of_tracks: int = -1, playlist_paths: list = None) -> None:
         """calls a function which updates the desired tracks and the playlists
 
         Args:
             number_of_tracks (int, optional): defines the number of tracks you want to update. If negative updates all tracks. Defaults to -1.
+            playlist_paths (list, optional): paths of the folders or playlists you want to convert (e.g. "ROOT/My Folder"). If None, all playlists are converted. Defaults to None.
         """
         indecies_of_rb5 = list(self.map_from_5_to_6.keys())
 
@@ -144,48 +207,133 @@ class RB_handler_five_six():
             self._update_file(
                 curr_rb5_index, self.map_from_5_to_6[curr_rb5_index])
 
-        self._update_playlists()
+        self._update_playlists(playlist_paths)
 
         return
 
-    def _update_playlists(self) -> None:
-        """updates the playlists on position 3 and 4 of the loaded data6 according to 5
+    def _update_playlists(self, playlist_paths: list = None) -> None:
+        """merges the playlists of data5 into the ones of data6. The @Key of every track in the
+        playlists is translated from the rekordbox 5 to the rekordbox 6 track id in one pass.
+        Tracks that couldn't be mapped are removed from the playlists, logged and counted per playlist.
+        Folders and playlists existing just in rekordbox 6 are kept.
+
+        Args:
+            playlist_paths (list, optional): paths of the folders or playlists you want to convert (e.g. "ROOT/My Folder").
+                If None, the whole playlist tree is converted. Defaults to None.
         """
 
         logger.info('Converting playlists...')
 
         # in this dict we have as key the trackid of rb5 and value is key of rb6
         trackid_mapping = self._get_trackid_mapping()
+        # for logging the tracks, that can't be converted
+        rb5_trackid_to_location = {track['@TrackID']: track.get('@Location') for track in self.data5}
 
-        # these variable holds the root folder from rekordbox; we just need 5, since 6 gets deleted anyway
-        root_folders_rb5 = self.rawdata_rb5['DJ_PLAYLISTS']['PLAYLISTS']['NODE']['NODE']
+        # the root folders from rekordbox; the ones of 5 are converted and merged into the ones of 6
+        root_rb5 = self.rawdata_rb5['DJ_PLAYLISTS']['PLAYLISTS']['NODE']
+        root_rb6 = self.rawdata_rb6['DJ_PLAYLISTS']['PLAYLISTS']['NODE']
 
-        # getting the folders you want to change; assign rb6 the values from rb5
-        folder_one = root_folders_rb5[3]['NODE'].copy()
-        folder_two = root_folders_rb5[4]['NODE'].copy()
+        if playlist_paths is None:
+            playlist_paths = [root_rb5['@Name']]
 
-        # saving them in a list, so we can then iterate over them
-        folders_to_convert = [folder_one, folder_two]
+        for curr_path in playlist_paths:
+            node_to_convert = rekordbox_xml.find_playlist_node(root_rb5, curr_path)
 
-        for curr_folder in folders_to_convert:
-            for curr_playlist in curr_folder:
-                # check if the playlist is empty
-                if curr_playlist['@Entries'] != '0':
-                    for curr_song in curr_playlist['TRACK']:
-                        try:
-                            curr_song['@Key'] = trackid_mapping[curr_song['@Key']]
-                        except:
-                            logger.warning(f'Could not convert song {curr_song}')
+            for curr_playlist_path, curr_node in rekordbox_xml.iter_playlist_nodes(node_to_convert, curr_path.rpartition('/')[0]):
+                # folders have no tracks and playlists with KeyType 1 reference the tracks by location
+                if curr_node['@Type'] != '1' or curr_node.get('@KeyType', '0') != '0':
+                    continue
+                self._remap_playlist_tracks(curr_playlist_path, curr_node, trackid_mapping, rb5_trackid_to_location)
 
-        # updating the raw_data of rb6
-        root_folders_rb6 = self.rawdata_rb6['DJ_PLAYLISTS']['PLAYLISTS']['NODE']['NODE']
-        root_folders_rb6[3]['NODE'] = folder_one
-        root_folders_rb6[4]['NODE'] = folder_two
+            self._merge_playlist_node(root_rb6, curr_path, node_to_convert)
 
         logger.info('Converting playlists...Done!')
 
         return
 
+    def _remap_playlist_tracks(self, playlist_path: str, playlist: dict, trackid_mapping: dict,
+                               rb5_trackid_to_location: dict) -> None:
+        """translates the @Key of the tracks in the playlist with trackid_mapping
+
+        Args:
+            playlist_path (str): path of the playlist, used for the statistics
+            playlist (dict): the playlist NODE element
+            trackid_mapping (dict): key is track id of rekordbox 5 and value is track id of rekordbox 6
+            rb5_trackid_to_location (dict): key is track id of rekordbox 5 and value its @Location, used for the log
+        """
+        tracks = []
+        unmapped = []
+        for curr_track in rekordbox_xml.as_list(playlist.get('TRACK')):
+            new_key = trackid_mapping.get(curr_track['@Key'])
+            if new_key is None:
+                unmapped.append(curr_track['@Key'])
+            else:
+                curr_track['@Key'] = new_key
+                tracks.append(curr_track)
+
+        if len(unmapped) > 0:
+            self.unmapped_playlist_entries[playlist_path] = len(unmapped)
+            logger.warning(f'Could not convert {len(unmapped)} tracks in playlist {playlist_path}, removed them:')
+            for track_id in unmapped:
+                logger.warning(f'- {rb5_trackid_to_location.get(track_id, "TrackID " + track_id)}')
+
+        if len(tracks) > 0:
+            playlist['TRACK'] = rekordbox_xml.from_list(tracks)
+        else:
+            playlist.pop('TRACK', None)
+        playlist['@Entries'] = str(len(tracks))
+
+        return
+
+    def _merge_playlist_node(self, root: dict, path: str, node: dict) -> None:
+        """merges node into the playlist tree of root at the given path. Missing parent folders are created.
+        The other folders and playlists of root stay untouched and in their position.
+
+        Args:
+            root (dict): the ROOT node of the playlist tree you want to change
+            path (str): path of the node (e.g. "ROOT/My Folder")
+            node (dict): the folder or playlist you want to put there
+        """
+        names = path.split('/')
+        if names[0] != root['@Name']:
+            raise ValueError(f'Playlist path "{path}" must start with "{root["@Name"]}"')
+        if len(names) == 1:
+            self._merge_playlist_children(root, node)
+            return
+
+        parent = root
+        for name in names[1:-1]:
+            folders = [child for child in rekordbox_xml.as_list(parent.get('NODE')) if child['@Name'] == name and child['@Type'] == '0']
+            if len(folders) == 0:
+                folders = [{'@Type': '0', '@Name': name, '@Count': '0'}]
+                self._put_playlist_child(parent, folders[0])
+            parent = folders[0]
+        self._put_playlist_child(parent, node)
+
+        return
+
+    def _merge_playlist_children(self, target: dict, source: dict) -> None:
+        """merges the children of the folder source into the folder target"""
+        for child in rekordbox_xml.as_list(source.get('NODE')):
+            self._put_playlist_child(target, child)
+
+    def _put_playlist_child(self, parent: dict, node: dict) -> None:
+        """puts node into the folder parent: a folder of the same name is merged, a playlist of the same name is
+        replaced in its position, otherwise node is appended
+        """
+        children = rekordbox_xml.as_list(parent.get('NODE'))
+        for position, child in enumerate(children):
+            if child['@Name'] == node['@Name'] and child['@Type'] == node['@Type']:
+                if node['@Type'] == '0':
+                    self._merge_playlist_children(child, node)
+                else:
+                    children[position] = node
+                break
+        else:
+            children.append(node)
+        parent['NODE'] = rekordbox_xml.from_list(children)
+        parent['@Count'] = str(len(children))
+
     def _get_trackid_mapping(self) -> dict:
         """calculates and returns a dict to translate between the track ids from rekordbox 5 to 6
 
@@ -242,24 +390,95 @@ class RB_handler_five_six():
 
     def _generate_mapping_dict_from_5to6(self) -> None:
         """generates and saves a dict which translates the index locations of the tracks.
-        key is the index of the track in rekordbox 5 and value is the index you can find the same track in the data of rekordbox 6
+        key is the index of the track in rekordbox 5 and value is the index you can find the same track in the data of rekordbox 6.
+        The tracks are matched in tiers through hash indexes: first by the normalized @Location,
+        then the remaining ones by filename and @Size and finally by the normalized @Name, @Artist and @TotalTime.
+        A key shared by several tracks of rekordbox 5 or 6 is ambiguous, these tracks are not matched by it. Just in the first tier
+        a track with exactly the same @Location is still matched, to the first one of rekordbox 6 (like before the tiers).
         """
         rb5_index_to_location_dict = self._get_index_location_dict(
             self.data5)
         rb6_index_to_location_dict = self._get_index_location_dict(
             self.data6)
 
-        # init an empty dict
-        map_from_5_to_6 = {}
+        def filename_and_size(track: dict) -> tuple:
+            return (_normalize_location(track['@Location']).rsplit('/', 1)[-1], track.get('@Size'))
+
+        def name_artist_duration(track: dict) -> tuple:
+            return (_normalize_text(track.get('@Name')), _normalize_text(track.get('@Artist')), track.get('@TotalTime'))
 
-        # with this list we want to keep track of all the tracks which couldn't be mapped
-        failed = []
-        for curr_key_5 in rb5_index_to_location_dict:
-            try:
-                map_from_5_to_6[curr_key_5] = list(rb6_index_to_location_dict.keys())[list(
-                    rb6_index_to_location_dict.values()).index(rb5_index_to_location_dict[curr_key_5])]
-            except:
-                failed.append(curr_key_5)
+        tiers = [
+            ('location', lambda track: _normalize_location(track['@Location'])),
+            ('filename and size', filename_and_size),
+            ('name, artist and duration', name_artist_duration),
+        ]
+
+        map_from_5_to_6 = {}
+        self.match_statistics = {}
+        # the tracks which aren't matched yet
+        failed = list(rb5_index_to_location_dict)
+        unmatched_rb6 = list(rb6_index_to_location_dict)
+
+        ambiguous = set()
+        # the tracks of rekordbox 6 with the same @Location as the one matched, they are left as they are
+        duplicates_rb6 = []
+        for tier_name, get_key in tiers:
+            index_rb6 = {}
+            ambiguous_keys = set()
+            # the tracks of rekordbox 6 by their exact @Location, in their order
+            exact_locations_rb6 = {}
+            if tier_name == 'location':
+                for curr_index_6 in unmatched_rb6:
+                    exact_locations_rb6.setdefault(self.data6[curr_index_6]['@Location'], []).append(curr_index_6)
+            for curr_index_6 in unmatched_rb6:
+                curr_key = get_key(self.data6[curr_index_6])
+                if curr_key in index_rb6:
+                    ambiguous_keys.add(curr_key)
+                else:
+                    index_rb6[curr_key] = curr_index_6
+
+            # the normalization (case, url-encoding) can give several tracks the same key on either side,
+            # then the tracks can't be told apart and just the unique hits are kept
+            keys_rb5 = {curr_key_5: get_key(self.data5[curr_key_5]) for curr_key_5 in failed}
+            key_counts_rb5 = {}
+            for curr_key in keys_rb5.values():
+                key_counts_rb5[curr_key] = key_counts_rb5.get(curr_key, 0) + 1
+            ambiguous_keys.update(curr_key for curr_key, count in key_counts_rb5.items() if count > 1)
+            for curr_key in ambiguous_keys:
+                index_rb6.pop(curr_key, None)
+
+            still_failed = []
+            for curr_key_5 in failed:
+                curr_index_6 = index_rb6.get(keys_rb5[curr_key_5])
+                if curr_index_6 is None and self.data5[curr_key_5]['@Location'] in exact_locations_rb6:
+                    curr_index_6 = exact_locations_rb6[self.data5[curr_key_5]['@Location']][0]
+                if curr_index_6 is None:
+                    still_failed.append(curr_key_5)
+                    if keys_rb5[curr_key_5] in ambiguous_keys:
+                        ambiguous.add(curr_key_5)
+                else:
+                    map_from_5_to_6[curr_key_5] = curr_index_6
+                    ambiguous.discard(curr_key_5)
+
+            self.match_statistics[tier_name] = len(failed) - len(still_failed)
+            failed = still_failed
+            matched_rb6 = set(map_from_5_to_6.values())
+            duplicates_rb6.extend(curr_index_6 for indexes_6 in exact_locations_rb6.values()
+                                  if indexes_6[0] in matched_rb6 for curr_index_6 in indexes_6[1:])
+            unmatched_rb6 = [i for i in unmatched_rb6 if i not in matched_rb6]
+
+        if len(ambiguous) > 0:
+            logger.warning('FILES WITH AMBIGUOUS MATCHES (several tracks share the same key), NOT MATCHED:')
+            for ambiguous_index in sorted(ambiguous):
+                logger.warning(rb5_index_to_location_dict[ambiguous_index])
+
+        if len(duplicates_rb6) > 0:
+            logger.warning('FILES IN REKORDBOX 6 SEVERAL TIMES, JUST THE FIRST TRACK IS UPDATED:')
+            for duplicate_index in duplicates_rb6:
+                logger.warning(rb6_index_to_location_dict[duplicate_index])
+
+        self.match_statistics['not matched'] = len(failed)
+        self.match_statistics['of these ambiguous'] = len(ambiguous)
         self.map_from_5_to_6 = map_from_5_to_6
 
         # writing the files that couldn't be matched
@@ -271,6 +490,21 @@ class RB_handler_five_six():
 
         return
 
+    def write_log_message(self) -> None:
+        """writes the statistics of the conversion into the log
+        """
+        logger.info('Matched tracks from rekordbox 5 to 6:')
+        for tier_name, count in self.match_statistics.items():
+            logger.info(f'- {tier_name}:'.ljust(30) + str(count))
+
+        if len(self.unmapped_playlist_entries) > 0:
+            logger.warning(f'Removed {sum(self.unmapped_playlist_entries.values())} tracks, that could not be converted, '
+                           + f'from {len(self.unmapped_playlist_entries)} playlists:')
+            for playlist_path, count in self.unmapped_playlist_entries.items():
+                logger.warning(f'- {playlist_path}: {count}')
+
+        return
+
     def _get_index_location_dict(self, data: list) -> dict:
         """First the tracks are filtered based on the previously set location_of_interest information. 
         Then sets up a dict to map the indecies to the corresponding @Location information
@@ -311,9 +545,7 @@ class RB_handler_five_six():
         Returns:
             dict: the converted xml file as a dict
         """
-        with open(filepath, 'r') as xml_file:
-            input_data = xmltodict.parse(xml_file.read())
-            return input_data
+        return dataloading.get_dict_from_xml(filepath)
 
     def export_data_to_xml(self, out_path: str) -> None:
         """outputs the changed data into a xml again
@@ -322,8 +554,7 @@ class RB_handler_five_six():
             out_path (str): filepath to where you want to change it
         """
         logger.info('Exporting to XML...')
-        with open(out_path, 'w') as xml_outfile:
-            xml_outfile.write(xmltodict.unparse(self.rawdata_rb6))
+        rekordbox_xml.write_rekordbox_xml(self.rawdata_rb6, out_path, pretty=False)
 
         logger.info('Exporting to XML...Done!')
 
@@ -0,0 +1,227 @@
+# This file holds the acoustic fingerprints of the audio files, to find the same song in different encodings.
+# The audio is decoded with pydub (ffmpeg under the hood), downmixed and resampled, and every frame of it is
+# turned into a 32 bit sub-fingerprint: each bit tells if the energy difference of two neighbouring frequency bands
+# rises or falls compared to the previous frame. Re-encoding changes the samples, but hardly these bits.
+# The fingerprints are cached on disk, keyed by path, size and modification time of the audio file,
+# so just new or changed files are decoded again.
+# Similar tracks are found through an inverted index of the sub-fingerprints instead of comparing all pairs.
+
+
+# system imports
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import os
+
+# 3rd party imports
+import numpy as np
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_VERSION = 1
+SAMPLE_RATE = 5512
+# just the first minutes are decoded, that's plenty to identify a track
+FINGERPRINT_DURATION = 120
+FRAME_SIZE = 2048
+HOP_SIZE = 1024
+NUMBER_OF_BANDS = 33
+MIN_FREQUENCY = 300
+MAX_FREQUENCY = 2000
+
+# sub-fingerprints shared by more tracks are ignored (e.g. silence), like stop words in a text search
+MAX_TRACKS_PER_SUB_FINGERPRINT = 20
+# number of identical sub-fingerprints two tracks need to be compared at all
+MIN_VOTES = 5
+MIN_OVERLAP = 50
+MAX_BIT_ERROR_RATE = 0.35
+
+
+def _get_band_matrix() -> np.ndarray:
+    """returns the matrix summing up the fft bins into the logarithmically spaced frequency bands"""
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+    edges = np.geomspace(MIN_FREQUENCY, MAX_FREQUENCY, NUMBER_OF_BANDS + 1)
+    band_index = np.searchsorted(edges, frequencies, side='right') - 1
+    is_in_band = (band_index >= 0) & (band_index < NUMBER_OF_BANDS)
+
+    band_matrix = np.zeros((len(frequencies), NUMBER_OF_BANDS), dtype=np.float32)
+    band_matrix[np.flatnonzero(is_in_band), band_index[is_in_band]] = 1
+    return band_matrix
+
+
+def decode_audio(path: str) -> np.ndarray:
+    """decodes the beginning of the audio file into mono samples at SAMPLE_RATE
+
+    Args:
+        path (str): path to the audio file
+
+    Returns:
+        np.ndarray: the samples as float32
+    """
+    segment = AudioSegment.from_file(path, duration=FINGERPRINT_DURATION)
+    segment = segment.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+    return np.frombuffer(segment.raw_data, dtype=np.int16).astype(np.float32)
+
+
+def compute_fingerprint(samples: np.ndarray) -> np.ndarray:
+    """computes the fingerprint of the samples: one 32 bit sub-fingerprint per frame
+
+    Args:
+        samples (np.ndarray): mono samples at SAMPLE_RATE
+
+    Returns:
+        np.ndarray: the sub-fingerprints as uint32
+    """
+    if len(samples) < FRAME_SIZE + 2 * HOP_SIZE:
+        return np.zeros(0, dtype=np.uint32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1)) ** 2
+    energies = spectrum.astype(np.float32) @ _get_band_matrix()
+
+    band_differences = energies[:, :-1] - energies[:, 1:]
+    bits = (band_differences[1:] - band_differences[:-1]) > 0
+    return np.packbits(bits, axis=1, bitorder='little').view('<u4').ravel().astype(np.uint32)
+
+
+def _get_cache_path(cache_folder: str, path: str, stat: os.stat_result) -> str:
+    key = hashlib.sha1(f'{FINGERPRINT_VERSION}|{path}|{stat.st_size}|{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()
+    return os.path.join(cache_folder, key[:2], key + '.npy')
+
+
+def _fingerprint_file(path: str, cache_path: str):
+    """decodes the audio file, computes its fingerprint and stores it in the cache. Runs in the worker processes.
+
+    Returns:
+        np.ndarray: the fingerprint, or None if the file could not be decoded
+    """
+    try:
+        fingerprint = compute_fingerprint(decode_audio(path))
+    except Exception as e:
+        # pydub raises all kind of errors for files ffmpeg can't decode
+        logger.warning(f'Could not decode {path}: {e}')
+        return None
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = cache_path + f'.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        np.save(file, fingerprint)
+    os.replace(temp_path, cache_path)
+    return fingerprint
+
+
+def load_fingerprints(paths: list, cache_folder: str, workers: int = None) -> list:
+    """returns the fingerprints of the audio files. Cached fingerprints are loaded from the cache folder,
+    all the others are computed in parallel and added to the cache.
+
+    Args:
+        paths (list): paths to the audio files
+        cache_folder (str): folder of the fingerprint cache
+        workers (int, optional): number of processes used for decoding. Defaults to the number of cpus.
+
+    Returns:
+        list: the fingerprint of each file, None for the files that are missing or could not be decoded
+    """
+    fingerprints = [None] * len(paths)
+    jobs = []
+    missing = 0
+    for index, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            missing += 1
+            continue
+        cache_path = _get_cache_path(cache_folder, path, stat)
+        if os.path.exists(cache_path):
+            fingerprints[index] = np.load(cache_path)
+        else:
+            jobs.append((index, path, cache_path))
+
+    logger.info(f'Fingerprints: {len(paths) - len(jobs) - missing} from the cache, {missing} files missing, computing {len(jobs)} new ones...')
+    if len(jobs) > 0:
+        indices, job_paths, cache_paths = zip(*jobs)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for index, fingerprint in zip(indices, executor.map(_fingerprint_file, job_paths, cache_paths, chunksize=4)):
+                fingerprints[index] = fingerprint
+    return fingerprints
+
+
+def _get_candidate_pairs(fingerprints: list) -> np.ndarray:
+    """looks up the pairs of tracks sharing at least MIN_VOTES sub-fingerprints in an inverted index
+
+    Args:
+        fingerprints (list): the fingerprint of each track, None for missing ones
+
+    Returns:
+        np.ndarray: the pairs as (n, 2) array of track indices
+    """
+    values = []
+    track_ids = []
+    for index, fingerprint in enumerate(fingerprints):
+        if fingerprint is not None and len(fingerprint) > 0:
+            values.append(np.unique(fingerprint))
+            track_ids.append(np.full(len(values[-1]), index, dtype=np.uint64))
+    if len(values) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    # the inverted index: sorted by sub-fingerprint, each run of equal values holds the tracks containing it
+    keys = np.sort((np.concatenate(values).astype(np.uint64) << np.uint64(32)) | np.concatenate(track_ids))
+    sub_fingerprints = keys >> np.uint64(32)
+    tracks = (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, sub_fingerprints[1:] != sub_fingerprints[:-1]])
+    run_lengths = np.diff(np.r_[starts, len(keys)])
+
+    pair_keys = []
+    number_of_tracks = len(fingerprints)
+    for run_length in np.unique(run_lengths[(run_lengths >= 2) & (run_lengths <= MAX_TRACKS_PER_SUB_FINGERPRINT)]):
+        members = tracks[starts[run_lengths == run_length][:, None] + np.arange(run_length)]
+        first, second = np.triu_indices(run_length, 1)
+        pair_keys.append((members[:, first] * number_of_tracks + members[:, second]).ravel())
+    if len(pair_keys) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    pair_keys, votes = np.unique(np.concatenate(pair_keys), return_counts=True)
+    pair_keys = pair_keys[votes >= MIN_VOTES]
+    return np.column_stack([pair_keys // number_of_tracks, pair_keys % number_of_tracks])
+
+
+def get_bit_error_rate(fingerprint_a: np.ndarray, fingerprint_b: np.ndarray) -> float:
+    """aligns the two fingerprints by their identical sub-fingerprints and returns the share of differing bits
+
+    Args:
+        fingerprint_a (np.ndarray): the first fingerprint
+        fingerprint_b (np.ndarray): the second fingerprint
+
+    Returns:
+        float: the bit error rate of the overlapping part, 1.0 if they can't be aligned
+    """
+    _, positions_a, positions_b = np.intersect1d(fingerprint_a, fingerprint_b, return_indices=True)
+    if len(positions_a) == 0:
+        return 1.0
+    offsets, counts = np.unique(positions_b - positions_a, return_counts=True)
+    offset = int(offsets[np.argmax(counts)])
+
+    start_a = max(0, -offset)
+    end_a = min(len(fingerprint_a), len(fingerprint_b) - offset)
+    if end_a - start_a < MIN_OVERLAP:
+        return 1.0
+    differences = fingerprint_a[start_a:end_a] ^ fingerprint_b[start_a + offset:end_a + offset]
+    return float(np.bitwise_count(differences).sum()) / (32 * (end_a - start_a))
+
+
+def find_similar_tracks(fingerprints: list, max_bit_error_rate: float = MAX_BIT_ERROR_RATE) -> list:
+    """finds the pairs of tracks with a similar fingerprint
+
+    Args:
+        fingerprints (list): the fingerprint of each track, None for missing ones
+        max_bit_error_rate (float, optional): maximum share of differing bits of a match. Defaults to MAX_BIT_ERROR_RATE.
+
+    Returns:
+        list: tuples (index_a, index_b, bit_error_rate) of the similar tracks
+    """
+    similar_tracks = []
+    for index_a, index_b in _get_candidate_pairs(fingerprints):
+        bit_error_rate = get_bit_error_rate(fingerprints[index_a], fingerprints[index_b])
+        if bit_error_rate <= max_bit_error_rate:
+            similar_tracks.append((int(index_a), int(index_b), bit_error_rate))
+    return similar_tracks
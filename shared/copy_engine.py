@@ -0,0 +1,236 @@
+# This file copies many audio files at once, e.g. for exporting parts of the collection to another folder or drive.
+# The files are copied in a thread pool, with a limited number of copies per destination device
+# (an SSD takes a few copies at the same time, a hard disk or USB stick just slows down with too many of them).
+# On Linux the data is copied inside the kernel (copy-on-write reflink if the file system supports it,
+# otherwise os.copy_file_range or os.sendfile), on the other systems with shutil.copyfile (fcopyfile on macOS).
+# With link=True files on the same file system as their destination are hardlinked instead of copied.
+# Files already existing in the destination with the same size and modification time (or content hash) are skipped.
+# Each file is written into a hidden partial file first, so an interrupted copy never looks complete.
+# Files with the same filename copied into one folder get a number appended, e.g. 'song (2).mp3'.
+
+
+# system imports
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+# 3rd party imports
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+COPY_WORKERS_PER_DEVICE = 4
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# FAT and exFAT drives store the modification time in steps of two seconds
+MTIME_TOLERANCE = 2
+# ioctl number of FICLONE on Linux, creating a copy-on-write clone (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def get_file_hash(path: str) -> str:
+    """returns the blake2b hash of the content of the file
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: the hex digest
+    """
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'blake2b').hexdigest()
+
+
+def is_up_to_date(source: str, destination: str, compare_hash: bool = False) -> bool:
+    """tells if the destination already holds a copy of the source file
+
+    Args:
+        source (str): path to the source file
+        destination (str): path to the copy
+        compare_hash (bool, optional): compare the content hashes if the modification times differ. Defaults to False.
+
+    Returns:
+        bool: True if the destination has the same size and modification time (or content) as the source
+    """
+    try:
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+    source_stat = os.stat(source)
+    if destination_stat.st_size != source_stat.st_size:
+        return False
+    if abs(destination_stat.st_mtime - source_stat.st_mtime) <= MTIME_TOLERANCE:
+        return True
+    return compare_hash and get_file_hash(source) == get_file_hash(destination)
+
+
+def _copy_in_kernel(source_file, destination_file, size: int) -> bool:
+    """copies the data of the open files inside the kernel, without passing it through python (Linux only)
+
+    Returns:
+        bool: False if the file systems support none of the ways
+    """
+    try:
+        import fcntl
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        return True
+    except (ImportError, OSError):
+        pass
+
+    for copy_function in (os.copy_file_range, os.sendfile):
+        offset = 0
+        try:
+            while offset < size:
+                if copy_function is os.sendfile:
+                    copied = os.sendfile(destination_file.fileno(), source_file.fileno(), offset, COPY_CHUNK_SIZE)
+                else:
+                    copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), COPY_CHUNK_SIZE, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return True
+        except OSError as e:
+            # e.g. copy_file_range between file systems on older kernels, try the next way from the start
+            if offset != 0 or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    return False
+
+
+def copy_file(source: str, destination: str, link: bool = False) -> str:
+    """copies the file with its modification time
+
+    Args:
+        source (str): path to the source file
+        destination (str): path to the copy, an existing file is replaced
+        link (bool, optional): hardlink the file if source and destination share a file system. Defaults to False.
+
+    Returns:
+        str: 'linked' or 'copied'
+    """
+    folder, filename = os.path.split(destination)
+    temp_path = os.path.join(folder, '.partial-' + filename)
+    try:
+        if link and os.stat(source).st_dev == os.stat(folder or '.').st_dev:
+            os.link(source, temp_path)
+            os.replace(temp_path, destination)
+            return 'linked'
+
+        if sys.platform == 'linux':
+            with open(source, 'rb') as source_file, open(temp_path, 'wb') as destination_file:
+                if not _copy_in_kernel(source_file, destination_file, os.fstat(source_file.fileno()).st_size):
+                    shutil.copyfileobj(source_file, destination_file, COPY_CHUNK_SIZE)
+        else:
+            shutil.copyfile(source, temp_path)
+        shutil.copystat(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return 'copied'
+
+
+def _get_device(folder: str) -> int:
+    # the destination folder may not exist yet, then the device of the first existing parent folder is used
+    while not os.path.exists(folder) and os.path.dirname(folder) != folder:
+        folder = os.path.dirname(folder)
+    return os.stat(folder).st_dev
+
+
+def copy_files(pairs: list, workers_per_device: int = COPY_WORKERS_PER_DEVICE, compare_hash: bool = False,
+               link: bool = False) -> dict:
+    """copies many files in parallel, skipping the ones already copied
+
+    Args:
+        pairs (list): (source path, destination path) of each file, missing destination folders are created
+        workers_per_device (int, optional): number of files copied at the same time to each destination device.
+            Defaults to COPY_WORKERS_PER_DEVICE.
+        compare_hash (bool, optional): skip files with the same content even if their modification time differs.
+            Defaults to False.
+        link (bool, optional): hardlink the files on the same file system instead of copying them. Defaults to False.
+
+    Returns:
+        dict: number of files copied, linked, skipped and failed, the bytes copied and the seconds it took
+    """
+    start = time.perf_counter()
+    # the same file listed twice is copied once, two different files must not share the destination (nor its partial file)
+    pairs = list(dict.fromkeys((source, os.path.normpath(destination)) for source, destination in pairs))
+    duplicates = sorted(destination for destination, count in Counter(destination for _, destination in pairs).items() if count > 1)
+    if duplicates:
+        raise ValueError(f'Several files would be copied to {duplicates[0]} ({len(duplicates)} destinations in total)')
+    folders = {os.path.dirname(destination) for _, destination in pairs}
+    for folder in folders:
+        os.makedirs(folder or '.', exist_ok=True)
+    device_per_folder = {folder: _get_device(folder or '.') for folder in folders}
+    semaphores = {device: threading.Semaphore(workers_per_device) for device in set(device_per_folder.values())}
+
+    def copy_pair(source: str, destination: str) -> tuple:
+        if is_up_to_date(source, destination, compare_hash):
+            return 'skipped', 0
+        with semaphores[device_per_folder[os.path.dirname(destination)]]:
+            return copy_file(source, destination, link=link), os.path.getsize(source)
+
+    statistics = {'copied': 0, 'linked': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers_per_device * len(semaphores))) as executor:
+        futures = {executor.submit(copy_pair, source, destination): source for source, destination in pairs}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Copying', unit='file'):
+            try:
+                status, size = future.result()
+            except OSError as e:
+                statistics['failed'] += 1
+                logger.error(f'Could not copy {futures[future]}: {e}')
+                continue
+            statistics[status] += 1
+            if status == 'copied':
+                statistics['bytes'] += size
+
+    statistics['seconds'] = time.perf_counter() - start
+    megabytes = statistics['bytes'] / 1024 ** 2
+    logger.info(f'Copied {statistics["copied"]} files ({megabytes:.1f} MB, {megabytes / max(statistics["seconds"], 1e-9):.1f} MB/s), '
+                + f'linked {statistics["linked"]}, skipped {statistics["skipped"]} already existing ones, {statistics["failed"]} failed.')
+    return statistics
+
+
+def _get_unique_filenames(sources: list) -> list:
+    """returns the filename of each source in the destination folder. The first file keeps its filename, the other ones
+    with the same filename (ignoring the case, like FAT, exFAT and macOS do) get the first free number appended.
+    """
+    taken = {os.path.basename(source).casefold() for source in sources}
+    used = set()
+    filenames = []
+    for source in sources:
+        filename = os.path.basename(source)
+        if filename.casefold() in used:
+            name, extension = os.path.splitext(filename)
+            number = 2
+            while f'{name} ({number}){extension}'.casefold() in taken:
+                number += 1
+            filename = f'{name} ({number}){extension}'
+            taken.add(filename.casefold())
+            logger.warning(f'{source} has the same filename as another file, copying it as {filename}')
+        used.add(filename.casefold())
+        filenames.append(filename)
+    return filenames
+
+
+def copy_files_to_folder(sources: list, destination_folder: str, **kwargs) -> dict:
+    """copies the files into one folder, keeping their filenames. Files with the same filename get a number appended,
+    in the order of the sources. Takes the same keyword arguments as copy_files.
+
+    Args:
+        sources (list): paths to the files
+        destination_folder (str): the folder
+
+    Returns:
+        dict: the statistics, like copy_files
+    """
+    sources = list(dict.fromkeys(sources))
+    filenames = _get_unique_filenames(sources)
+    return copy_files([(source, os.path.join(destination_folder, filename)) for source, filename in zip(sources, filenames)],
+                      **kwargs)
@@ -2,12 +2,80 @@
 
 
 # system imports
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import hashlib
+import json
+import logging
+import os
+import pickle
+from typing import Iterator
 import yaml
 
 # 3rd party imports
 import pandas as pd
 import spotipy
-import xmltodict
+
+# user imports
+from shared.logging_config import setup_logging
+import shared.rekordbox_xml as rekordbox_xml
+import shared.spotify_fetching as spotify_fetching
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# the parsed rekordbox collections are cached in this folder next to the xml file
+CACHE_FOLDER_NAME = ".rekordbox_cache"
+# increase this, when the format of the cached data changes
+CACHE_VERSION = 1
+# when the cache folder grows larger than this, the least recently used entries are evicted
+CACHE_MAX_SIZE = 2 * 1024**3
+
+# the maximum number of items Spotify returns per page of a playlist
+PLAYLIST_PAGE_SIZE = 100
+# the pages of a playlist requested at the same time, inside each of the threads fetching the playlists
+PLAYLIST_PAGE_WORKERS = 4
+# the fields of the playlist items used by SongSmith, everything else is left out of the answers
+PLAYLIST_ITEM_FIELDS = "total,items(track(id,name,artists(name),popularity,preview_url))"
+
+# dtypes of the attributes of the rekordbox elements. The attributes that are not listed stay strings.
+# The nullable integer types are used, since not every track has every attribute.
+TRACK_SCHEMA = {
+    "@TrackID": "Int64",
+    "@Artist": "category",
+    "@Genre": "category",
+    "@Kind": "category",
+    "@Size": "Int64",
+    "@TotalTime": "Int32",
+    "@DiscNumber": "Int16",
+    "@TrackNumber": "Int32",
+    "@Year": "Int16",
+    "@AverageBpm": "float32",
+    "@DateAdded": "datetime64[ns]",
+    "@BitRate": "Int32",
+    "@SampleRate": "Int32",
+    "@PlayCount": "Int32",
+    "@Rating": "UInt8",
+    "@Tonality": "category",
+    "@Colour": "category",
+}
+TEMPO_SCHEMA = {
+    "@TrackID": "Int64",
+    "@Inizio": "float64",
+    "@Bpm": "float32",
+    "@Metro": "category",
+    "@Battito": "Int8",
+}
+POSITION_MARK_SCHEMA = {
+    "@TrackID": "Int64",
+    "@Type": "Int8",
+    "@Start": "float64",
+    "@End": "float64",
+    "@Num": "Int8",
+    "@Red": "UInt8",
+    "@Green": "UInt8",
+    "@Blue": "UInt8",
+}
 
 
 def load_yaml(filepath: str) -> dict:
@@ -47,12 +115,13 @@ def write_yaml(filepath: str, data_dict: dict) -> None:
         yaml.dump(data_dict, file, default_flow_style=False)
 
 
-def load_dataframe_from_rekordbox_xml(filepath: str) -> pd.DataFrame:
+def load_dataframe_from_rekordbox_xml(filepath: str, use_cache: bool = True) -> pd.DataFrame:
     """
     Loads data from a Rekordbox XML file and returns it as a pandas DataFrame.
 
     Args:
         filepath (str): The path to the Rekordbox XML file.
+        use_cache (bool): If True, the parsed file is cached next to the XML file. Defaults to True.
 
     Returns:
         pd.DataFrame: A DataFrame containing the data from the Rekordbox XML file.
@@ -66,32 +135,280 @@ def load_dataframe_from_rekordbox_xml(filepath: str) -> pd.DataFrame:
             f"Please provide a .xml file. You passed a {filepath[-4:]} file."
         )
 
-    with open(filepath, "r") as xml_file:
-        input_data = xmltodict.parse(xml_file.read())
+    def load():
+        # the tracks are streamed one at a time, so the whole xml file is never held in memory
+        return pd.DataFrame.from_records(rekordbox_xml.iter_collection_tracks(filepath))
 
-    # converting the needed data into a dataframe
-    input_data = input_data["DJ_PLAYLISTS"]["COLLECTION"]["TRACK"]
-    return pd.DataFrame(input_data)
+    if not use_cache:
+        return load()
+    return load_cached_collection(filepath, "dataframe", load)
 
 
-def get_dict_from_xml(filepath: str) -> dict:
+def get_dict_from_xml(filepath: str, use_cache: bool = True) -> dict:
     """reading and parsing a xml file into a dict
 
     Args:
         filepath (str): path to the xml file you want to open and convert
+        use_cache (bool, optional): if True the parsed file is cached next to the xml file. Defaults to True.
 
     Returns:
         dict: the converted xml file as a dict
     """
-    with open(filepath, "r") as xml_file:
-        input_data = xmltodict.parse(xml_file.read())
-        return input_data
+    if not use_cache:
+        return rekordbox_xml.load_rekordbox_xml(filepath)
+    return load_cached_collection(filepath, "dict", lambda: rekordbox_xml.load_rekordbox_xml(filepath))
+
+
+def _apply_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """converts the string columns of df into the dtypes given in schema. Values that cannot be converted become missing values.
+
+    Args:
+        df (pd.DataFrame): the DataFrame with the string columns
+        schema (dict): key is the column and value the dtype it should have
+
+    Returns:
+        pd.DataFrame: the DataFrame with the converted columns
+    """
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == "category":
+            df[column] = df[column].astype("category")
+        elif dtype.startswith("datetime"):
+            df[column] = pd.to_datetime(df[column], format="%Y-%m-%d", errors="coerce")
+        else:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+    return df
+
+
+def _load_collection_tables(filepath: str) -> tuple:
+    """parses the tracks of the rekordbox xml file into a typed track table and the side tables of the nested elements
+
+    Args:
+        filepath (str): The path to the Rekordbox XML file.
+
+    Returns:
+        tuple: the tracks, tempos and position marks as DataFrames
+    """
+    tempos = []
+    position_marks = []
+
+    def iter_flat_tracks():
+        for track in rekordbox_xml.iter_collection_tracks(filepath):
+            for tempo in rekordbox_xml.as_list(track.pop("TEMPO", None)):
+                tempos.append({"@TrackID": track["@TrackID"], **tempo})
+            for position_mark in rekordbox_xml.as_list(track.pop("POSITION_MARK", None)):
+                position_marks.append({"@TrackID": track["@TrackID"], **position_mark})
+            yield track
+
+    def to_table(records, schema: dict) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(records)
+        if len(df.columns) == 0:
+            # keeping the columns of the schema, so an empty side table can be used like a filled one
+            df = pd.DataFrame(columns=list(schema))
+        return _apply_schema(df, schema)
+
+    # the side tables are filled while the tracks are consumed, so the tracks must be converted first
+    df_tracks = to_table(iter_flat_tracks(), TRACK_SCHEMA)
+    return df_tracks, to_table(tempos, TEMPO_SCHEMA), to_table(position_marks, POSITION_MARK_SCHEMA)
+
+
+def load_collection_from_rekordbox_xml(filepath: str, use_cache: bool = True) -> tuple:
+    """
+    Loads the collection of a Rekordbox XML file into typed DataFrames.
+    The attributes listed in TRACK_SCHEMA get numeric, datetime and categorical dtypes instead of strings.
+    The nested TEMPO and POSITION_MARK elements are stored in side tables, referencing the track by @TrackID.
+
+    Args:
+        filepath (str): The path to the Rekordbox XML file.
+        use_cache (bool): If True, the parsed file is cached next to the XML file. Defaults to True.
+
+    Returns:
+        tuple: the tracks, tempos and position marks as DataFrames
+
+    Raises:
+        ValueError: If the provided file does not have a .xml extension.
+    """
+    if not filepath.endswith(".xml"):
+        raise ValueError(
+            f"Please provide a .xml file. You passed a {filepath[-4:]} file."
+        )
+
+    if not use_cache:
+        return _load_collection_tables(filepath)
+    return load_cached_collection(filepath, "typed", lambda: _load_collection_tables(filepath))
+
+
+def load_typed_dataframe_from_rekordbox_xml(filepath: str, use_cache: bool = True) -> pd.DataFrame:
+    """
+    Loads the tracks of a Rekordbox XML file into a DataFrame with the dtypes of TRACK_SCHEMA.
+    The nested TEMPO and POSITION_MARK elements are not part of it, see load_collection_from_rekordbox_xml.
+
+    Args:
+        filepath (str): The path to the Rekordbox XML file.
+        use_cache (bool): If True, the parsed file is cached next to the XML file. Defaults to True.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing the typed tracks from the Rekordbox XML file.
+    """
+    df_tracks, _, _ = load_collection_from_rekordbox_xml(filepath, use_cache)
+    return df_tracks
+
+
+def _get_content_hash(filepath: str) -> str:
+    """calculates the sha256 hash of the content of the given file
+
+    Args:
+        filepath (str): path to the file
+
+    Returns:
+        str: the hex digest of the content
+    """
+    with open(filepath, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def _get_cache_key(filepath: str, cache_folder: str) -> str:
+    """returns the content hash of the xml file. The hash is only calculated again,
+    if the size or the modification time changed since the last time.
+
+    Args:
+        filepath (str): path to the xml file
+        cache_folder (str): folder holding the cache and its index file
+
+    Returns:
+        str: the content hash of the xml file
+    """
+    index_path = os.path.join(cache_folder, "index.json")
+    try:
+        with open(index_path, encoding="utf-8") as file:
+            index = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        index = {}
+
+    stat = os.stat(filepath)
+    filename = os.path.basename(filepath)
+    entry = index.get(filename)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["hash"]
+
+    content_hash = _get_content_hash(filepath)
+    index[filename] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}
+    with open(index_path, "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=2)
+    return content_hash
+
+
+def _evict_cache_entries(cache_folder: str, max_size: int) -> None:
+    """removes the least recently used cache entries, until the cache folder is smaller than max_size
+
+    Args:
+        cache_folder (str): folder holding the cached collections
+        max_size (int): max size of all the cached collections in bytes
+    """
+    entries = [f for f in os.scandir(cache_folder) if f.name.endswith(".pkl")]
+    total_size = sum(f.stat().st_size for f in entries)
+
+    for entry in sorted(entries, key=lambda f: f.stat().st_mtime):
+        if total_size <= max_size:
+            break
+        total_size -= entry.stat().st_size
+        os.remove(entry.path)
+        logger.info(f"Evicted {entry.name} from the collection cache")
+
+
+def load_cached_collection(filepath: str, kind: str, loader, max_size: int = CACHE_MAX_SIZE):
+    """returns the parsed collection of the xml file from the cache, or parses it with loader and stores it in the cache.
+    The cache is stored in a folder next to the xml file and keyed by the size, modification time and content hash of the file.
+
+    Args:
+        filepath (str): path to the rekordbox xml file
+        kind (str): name of the parsed representation (e.g. "dataframe" or "dict")
+        loader (callable): function without arguments, that parses the xml file
+        max_size (int, optional): max size of the cache folder in bytes. Defaults to CACHE_MAX_SIZE.
+
+    Returns:
+        the parsed collection, as returned by loader
+    """
+    cache_folder = os.path.join(os.path.dirname(os.path.abspath(filepath)), CACHE_FOLDER_NAME)
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        content_hash = _get_cache_key(filepath, cache_folder)
+    except OSError as e:
+        logger.warning(f"Collection cache not available for {filepath}: {e}")
+        return loader()
+
+    cache_path = os.path.join(cache_folder, f"{content_hash}_{kind}_v{CACHE_VERSION}.pkl")
+    if os.path.exists(cache_path):
+        logger.info(f"Collection cache HIT for {filepath} ({kind})")
+        # marking the entry as recently used for the eviction
+        os.utime(cache_path)
+        # the garbage collector would be triggered over and over by the many small objects being created
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(cache_path, "rb") as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError) as e:
+            # a broken entry (e.g. truncated on a full disk) is treated like a missing one
+            logger.warning(f"The collection cache entry {cache_path} is broken ({e!r}), removing it")
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    logger.info(f"Collection cache MISS for {filepath} ({kind}), parsing the xml file...")
+    data = loader()
+    try:
+        # writing to a temporary file first, so an interrupted run never leaves a broken cache entry
+        with open(cache_path + ".tmp", "wb") as file:
+            pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + ".tmp", cache_path)
+        _evict_cache_entries(cache_folder, max_size)
+    except OSError as e:
+        logger.warning(f"Could not write the collection cache for {filepath}: {e}")
+    return data
+
+
+def get_playlist_total_tracks(sp: spotipy.Spotify, username: str, playlist_id: str,
+                              limiter: spotify_fetching.TokenBucket = None,
+                              workers: int = PLAYLIST_PAGE_WORKERS) -> Iterator[dict]:
+    """yields the items of the playlist in their order. The first page tells the total number of items,
+    the other pages are then requested concurrently by their offset. Just the fields in PLAYLIST_ITEM_FIELDS are requested.
+
+    Args:
+        sp (spotipy.Spotify): the Spotify client
+        username (str): the owner of the playlist (not needed by the Spotify API anymore)
+        playlist_id (str): the playlist
+        limiter (spotify_fetching.TokenBucket, optional): the rate limiter, may be shared with other threads.
+            Defaults to None (a new one).
+        workers (int, optional): number of pages requested at the same time. Defaults to PLAYLIST_PAGE_WORKERS.
+
+    Yields:
+        dict: the items, {'track': {'id', 'name', 'artists': [{'name'}], 'popularity', 'preview_url'}} (track can be None)
+    """
+    limiter = limiter or spotify_fetching.TokenBucket()
 
+    def get_page(offset: int) -> dict:
+        return spotify_fetching.call_with_retry(
+            limiter, sp.playlist_items, playlist_id, fields=PLAYLIST_ITEM_FIELDS,
+            limit=PLAYLIST_PAGE_SIZE, offset=offset, additional_types=("track",))
 
-def get_playlist_total_tracks(sp: spotipy.Spotify, username: str, playlist_id: str):
-    results = sp.user_playlist_tracks(username, playlist_id)
-    tracks = results["items"]
-    while results["next"]:
-        results = sp.next(results)
-        tracks.extend(results["items"])
-    return tracks
+    first_page = get_page(0)
+    yield from first_page["items"]
+    offsets = range(PLAYLIST_PAGE_SIZE, first_page["total"], PLAYLIST_PAGE_SIZE)
+    if len(offsets) == 0:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [executor.submit(get_page, offset) for offset in offsets]
+        # the pages are handed out in the order of the offsets, each as soon as it and the ones before it arrived
+        for future in futures:
+            yield from future.result()["items"]
+    finally:
+        # if the generator is closed early (or a page failed), the pages not requested yet are cancelled
+        # and the ones on their way are not waited for
+        executor.shutdown(wait=False, cancel_futures=True)
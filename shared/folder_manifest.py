@@ -0,0 +1,224 @@
+# This file keeps a manifest of a folder tree: the size and modification time (and optionally the content hash)
+# of every file, and the modification time and subfolders of every folder. It is stored as .sync_manifest.json
+# inside the folder itself, so it belongs to the folder and not to the computer running the scripts.
+# Adding, removing or renaming a file changes the modification time of its folder, so when the folder tree is scanned
+# again, just the folders whose modification time changed are listed again. The subfolders of all the others are taken
+# from the manifest, but their files are still checked one by one, since a file changed in place (same name)
+# doesn't change its folder. Pass full=True to list every folder again.
+# Hidden files and folders (starting with a dot) are ignored.
+# For verifying a copy, the content hashes of the files are summed up into a Merkle tree: the hash of a folder is the hash
+# of the names and hashes of its files and subfolders, so two folders with the same hash hold the same content.
+# The content hashes are kept in the manifest as long as size and modification time of the file don't change.
+
+
+# system imports
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".sync_manifest.json"
+MANIFEST_VERSION = 1
+SCAN_WORKERS = 16
+HASH_WORKERS = 8
+
+
+def get_empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "directories": {}, "files": {}}
+
+
+def join_relative_path(folder: str, name: str) -> str:
+    """joins the relative path of a folder (empty for the root) and a name with a slash, on every system"""
+    return folder + "/" + name if folder else name
+
+
+def to_absolute_path(root: str, relative_path: str) -> str:
+    return os.path.join(root, *relative_path.split("/")) if relative_path else root
+
+
+def load_manifest(folder: str) -> dict:
+    """loads the manifest stored in the folder
+
+    Args:
+        folder (str): the folder
+
+    Returns:
+        dict: the manifest, an empty one if there is none (or it was written by another version)
+    """
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return get_empty_manifest()
+    with open(manifest_path, "rt", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning(f"The manifest of {folder} has another version, scanning the whole folder again")
+        return get_empty_manifest()
+    return manifest
+
+
+def write_manifest(manifest: dict, folder: str) -> None:
+    """stores the manifest in the folder. It is written into a temporary file first, so it is never half written.
+
+    Args:
+        manifest (dict): the manifest
+        folder (str): the folder
+    """
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "wt", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+
+def _get_file_entry(stat: os.stat_result, old_file: dict) -> dict:
+    file = {"size": stat.st_size, "mtime": stat.st_mtime}
+    # the hash stays valid as long as the file didn't change
+    if old_file is not None and "hash" in old_file and old_file["size"] == file["size"] and old_file["mtime"] == file["mtime"]:
+        file["hash"] = old_file["hash"]
+    return file
+
+
+def _scan_directory(root: str, relative_folder: str, old_directory: dict, old_files: dict, full: bool) -> tuple:
+    """lists the folder, or takes its entries from the old manifest if its modification time didn't change.
+    The files are always checked again, so files changed in place get their new size and modification time.
+
+    Returns:
+        tuple: (the entry of the folder, its files, True if it was listed) or None if the folder doesn't exist anymore
+    """
+    folder = to_absolute_path(root, relative_folder)
+    try:
+        mtime_ns = os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+    if not full and old_directory is not None and old_directory["mtime_ns"] == mtime_ns:
+        files = {}
+        for relative_path, old_file in old_files.items():
+            try:
+                stat = os.stat(to_absolute_path(root, relative_path), follow_symlinks=False)
+            except OSError:
+                continue
+            files[relative_path] = _get_file_entry(stat, old_file)
+        return old_directory, files, False
+
+    subdirectories = []
+    files = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+                continue
+            relative_path = join_relative_path(relative_folder, entry.name)
+            files[relative_path] = _get_file_entry(entry.stat(follow_symlinks=False), old_files.get(relative_path))
+    return {"mtime_ns": mtime_ns, "subdirectories": sorted(subdirectories)}, files, True
+
+
+def group_files_by_directory(files: dict) -> dict:
+    """returns the files of the manifest grouped by the relative path of their folder"""
+    files_by_directory = {}
+    for relative_path, file in files.items():
+        files_by_directory.setdefault(relative_path.rpartition("/")[0], {})[relative_path] = file
+    return files_by_directory
+
+
+def scan_folder(root: str, manifest: dict = None, full: bool = False, workers: int = SCAN_WORKERS) -> dict:
+    """scans the folder tree level by level, the folders of each level in parallel.
+    Folders that didn't change since the manifest was made are not listed again, just their files are checked.
+
+    Args:
+        root (str): the folder
+        manifest (dict, optional): the manifest of the last scan. Defaults to None.
+        full (bool, optional): list every folder again. Defaults to False.
+        workers (int, optional): number of threads. Defaults to SCAN_WORKERS.
+
+    Raises:
+        ValueError: if the folder doesn't exist
+
+    Returns:
+        dict: the new manifest
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f"The folder {root} does not exist")
+    manifest = manifest or get_empty_manifest()
+    old_directories = manifest["directories"]
+    old_files_by_directory = group_files_by_directory(manifest["files"])
+
+    new_manifest = get_empty_manifest()
+    listed = 0
+    level = [""]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while level:
+            results = executor.map(
+                lambda folder: _scan_directory(root, folder, old_directories.get(folder), old_files_by_directory.get(folder, {}), full),
+                level,
+            )
+            next_level = []
+            for folder, result in zip(level, results):
+                if result is None:
+                    continue
+                directory, files, was_listed = result
+                new_manifest["directories"][folder] = directory
+                new_manifest["files"].update(files)
+                listed += was_listed
+                next_level.extend(join_relative_path(folder, subdirectory) for subdirectory in directory["subdirectories"])
+            level = next_level
+
+    logger.info(
+        f"Scanned {root}: listed {listed} of {len(new_manifest['directories'])} folders, {len(new_manifest['files'])} files"
+    )
+    return new_manifest
+
+
+def _hash_file(path: str):
+    try:
+        with open(path, "rb") as file:
+            return hashlib.file_digest(file, "blake2b").hexdigest()
+    except OSError as e:
+        logger.error(f"Could not read {path}: {e}")
+        return None
+
+
+def hash_files(root: str, manifest: dict, workers: int = HASH_WORKERS) -> None:
+    """adds the content hash to the files of the manifest, that don't have one yet. The files are read in parallel.
+
+    Args:
+        root (str): the folder of the manifest
+        manifest (dict): the manifest, it is changed in place
+        workers (int, optional): number of threads. Defaults to HASH_WORKERS.
+    """
+    files = manifest["files"]
+    missing = [path for path, file in files.items() if "hash" not in file]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = executor.map(_hash_file, [to_absolute_path(root, path) for path in missing])
+        for path, content_hash in zip(missing, hashes):
+            if content_hash is not None:
+                files[path]["hash"] = content_hash
+    logger.info(f"Hashed {len(missing)} files of {root}, {len(files) - len(missing)} hashes taken from the manifest")
+
+
+def build_merkle_tree(manifest: dict) -> dict:
+    """computes the hash of every folder from the hashes of its files and subfolders, the deepest folders first
+
+    Args:
+        manifest (dict): the manifest, with the hashes of the files
+
+    Returns:
+        dict: key is the relative path of the folder (empty for the root) and value its hash
+    """
+    files_by_directory = group_files_by_directory(manifest["files"])
+    tree = {}
+    for folder in sorted(manifest["directories"], key=lambda path: path.count("/") + 1 if path else 0, reverse=True):
+        entries = [("f", path.rpartition("/")[2], file.get("hash", "")) for path, file in files_by_directory.get(folder, {}).items()]
+        entries += [
+            ("d", subdirectory, tree.get(join_relative_path(folder, subdirectory), ""))
+            for subdirectory in manifest["directories"][folder]["subdirectories"]
+        ]
+        digest = hashlib.blake2b()
+        for kind, name, content_hash in sorted(entries):
+            digest.update(f"{kind}\0{name}\0{content_hash}\n".encode("utf-8", errors="surrogateescape"))
+        tree[folder] = digest.hexdigest()
+    return tree
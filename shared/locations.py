@@ -0,0 +1,128 @@
+# This file converts the @Location information of the rekordbox xml files (file://localhost/... URIs)
+# into filesystem paths and back. Every script touching @Location should use it, so all of them decode identically.
+# The paths are percent-decoded as UTF-8 (RFC 3986 / RFC 8089); bytes that aren't valid UTF-8 are kept as
+# surrogate escapes (like os.fsdecode does), so a path always converts back into the same location.
+# The functions convert each folder just once (LRU-cached), since most tracks share them,
+# and the functions for series convert each distinct value just once.
+
+
+# system imports
+from functools import lru_cache
+import re
+from urllib.parse import quote, unquote
+
+# 3rd party imports
+import pandas as pd
+
+
+LOCATION_PREFIX = 'file://localhost'
+# rekordbox for Windows writes the drive letter after the host: file://localhost/C:/Users/...
+WINDOWS_DRIVE_PATTERN = re.compile(r'^/[A-Za-z]:(/|$)')
+WINDOWS_PATH_PATTERN = re.compile(r'^[A-Za-z]:([\\/]|$)')
+FOLDER_CACHE_SIZE = 16384
+
+
+def _split_host(location: str) -> str:
+    """returns the path part of the location, after file://localhost or file://
+
+    Raises:
+        ValueError: if the location isn't a local file URI
+    """
+    if location.startswith(LOCATION_PREFIX + '/'):
+        return location[len(LOCATION_PREFIX):]
+    if location.startswith('file:///'):
+        return location[len('file://'):]
+    raise ValueError(f'The location "{location}" is not a local file URI starting with {LOCATION_PREFIX}')
+
+
+@lru_cache(maxsize=FOLDER_CACHE_SIZE)
+def _decode(encoded_path: str) -> str:
+    if WINDOWS_DRIVE_PATTERN.match(encoded_path):
+        encoded_path = encoded_path[1:]
+    return unquote(encoded_path, encoding='utf-8', errors='surrogateescape')
+
+
+@lru_cache(maxsize=FOLDER_CACHE_SIZE)
+def _encode(path: str) -> str:
+    if WINDOWS_PATH_PATTERN.match(path):
+        # the colon of the drive letter stays as it is
+        return '/' + path[:2] + quote(path[2:].replace('\\', '/').encode('utf-8', errors='surrogateescape'), safe='/')
+    return quote(path.encode('utf-8', errors='surrogateescape'), safe='/')
+
+
+def location_to_path(location: str) -> str:
+    """converts the @Location of a track into the path of its file
+
+    Args:
+        location (str): the location, like file://localhost/Users/me/My%20Song.mp3
+
+    Raises:
+        ValueError: if the location isn't a local file URI
+
+    Returns:
+        str: the path, like /Users/me/My Song.mp3
+    """
+    folder, _, filename = _split_host(location).rpartition('/')
+    return _decode(folder) + '/' + unquote(filename, encoding='utf-8', errors='surrogateescape')
+
+
+def path_to_location(path: str) -> str:
+    """converts the path of a file into the @Location rekordbox uses for it.
+    Everything except the unreserved characters of RFC 3986 and the slashes is percent-encoded.
+
+    Args:
+        path (str): the absolute path, like /Users/me/My Song.mp3
+
+    Returns:
+        str: the location, like file://localhost/Users/me/My%20Song.mp3
+    """
+    if WINDOWS_PATH_PATTERN.match(path):
+        return LOCATION_PREFIX + _encode(path)
+    folder, separator, filename = path.rpartition('/')
+    return LOCATION_PREFIX + _encode(folder) + separator + quote(filename.encode('utf-8', errors='surrogateescape'), safe='')
+
+
+def decode_locations(locations: pd.Series) -> pd.Series:
+    """converts the @Location of many tracks into the paths of their files.
+    Each distinct location is converted just once with location_to_path.
+
+    Args:
+        locations (pd.Series): the locations
+
+    Raises:
+        ValueError: if a location isn't a local file URI
+
+    Returns:
+        pd.Series: the paths, same index as locations
+    """
+    values = locations.astype(str)
+    paths = {location: location_to_path(location) for location in values.unique()}
+    return pd.Series(values.map(paths).tolist(), index=locations.index, dtype=object)
+
+
+def encode_paths(paths: pd.Series) -> pd.Series:
+    """converts the paths of many files into the @Location rekordbox uses for them.
+    Each distinct path is converted just once with path_to_location.
+
+    Args:
+        paths (pd.Series): the absolute paths
+
+    Returns:
+        pd.Series: the locations, same index as paths
+    """
+    values = paths.astype(str)
+    locations = {path: path_to_location(path) for path in values.unique()}
+    return pd.Series(values.map(locations).tolist(), index=paths.index, dtype=object)
+
+
+def is_local_file(locations: pd.Series) -> pd.Series:
+    """tells which locations point to local files (and not e.g. to a streaming service)
+
+    Args:
+        locations (pd.Series): the locations
+
+    Returns:
+        pd.Series: True for the local files, same index as locations
+    """
+    locations = locations.astype(str)
+    return locations.str.startswith(LOCATION_PREFIX + '/') | locations.str.startswith('file:///')
@@ -0,0 +1,243 @@
+# This file measures the loudness of the audio files like ITU-R BS.1770 / EBU R 128 define it:
+# the integrated loudness (LUFS), the maximum short-term loudness (3 s windows) and the sample peak (dBFS).
+# Each file is decoded once with pydub (ffmpeg under the hood) into a numpy array. The K-weighting filters are applied
+# to the whole signal at once in the frequency domain, and the energies of all the 100 ms sub-blocks are summed up
+# with reshape and cumsum, so there is no python loop over the samples.
+# The results are kept in a cache table (.csv), keyed by path, size and modification time of the audio file,
+# so just new or changed files are analyzed again, in parallel.
+
+
+# system imports
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import os
+
+# 3rd party imports
+import numpy as np
+import pandas as pd
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+LOUDNESS_VERSION = 1
+CACHE_COLUMNS = ['path', 'size', 'mtime_ns', 'version', 'integrated_loudness', 'short_term_max', 'sample_peak']
+# the cache table is written after this many newly analyzed files, so an interruption doesn't lose the work
+CACHE_WRITE_INTERVAL = 100
+
+SUB_BLOCK_DURATION = 0.1
+# the momentary loudness uses blocks of 400 ms, the short-term loudness windows of 3 s, both moving in 100 ms steps
+MOMENTARY_SUB_BLOCKS = 4
+SHORT_TERM_SUB_BLOCKS = 30
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# channel weights for 5.1 (L, R, C, LFE, Ls, Rs), the LFE channel isn't measured
+SURROUND_WEIGHTS = [1.0, 1.0, 1.0, 0.0, 1.41, 1.41]
+
+# the two stages of the K-weighting: a high shelf modelling the head and a high pass (RLB weighting)
+SHELF_GAIN = 3.999843853973347
+SHELF_FREQUENCY = 1681.974450955533
+SHELF_Q = 0.7071752369554196
+SHELF_BAND_EXPONENT = 0.4996667741545416
+HIGH_PASS_FREQUENCY = 38.13547087602444
+HIGH_PASS_Q = 0.5003270373238773
+
+
+def get_k_weighting_coefficients(sample_rate: int) -> list:
+    """returns the biquad coefficients of the K-weighting at the sample rate.
+    At 48 kHz they are identical to the ones of the standard.
+
+    Args:
+        sample_rate (int): sample rate of the audio
+
+    Returns:
+        list: (b, a) of the high shelf and of the high pass
+    """
+    # bilinear transform of the analog prototypes (like libebur128 does it)
+    K = np.tan(np.pi * SHELF_FREQUENCY / sample_rate)
+    high_gain = 10 ** (SHELF_GAIN / 20)
+    band_gain = high_gain ** SHELF_BAND_EXPONENT
+    a0 = 1 + K / SHELF_Q + K * K
+    shelf_b = np.array([high_gain + band_gain * K / SHELF_Q + K * K, 2 * (K * K - high_gain), high_gain - band_gain * K / SHELF_Q + K * K]) / a0
+    shelf_a = np.array([a0, 2 * (K * K - 1), 1 - K / SHELF_Q + K * K]) / a0
+
+    K = np.tan(np.pi * HIGH_PASS_FREQUENCY / sample_rate)
+    a0 = 1 + K / HIGH_PASS_Q + K * K
+    high_pass_b = np.array([1.0, -2.0, 1.0])
+    high_pass_a = np.array([a0, 2 * (K * K - 1), 1 - K / HIGH_PASS_Q + K * K]) / a0
+
+    return [(shelf_b, shelf_a), (high_pass_b, high_pass_a)]
+
+
+def _get_frequency_response(b: np.ndarray, a: np.ndarray, length: int) -> np.ndarray:
+    """returns the response of the biquad at the frequencies of np.fft.rfft for a signal of the given length"""
+    # in units of the nyquist frequency, for odd lengths the last bin lies just below it
+    z = np.exp(-1j * np.pi * np.fft.rfftfreq(length) * 2)
+    return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+
+def decode_audio(path: str) -> tuple:
+    """decodes the whole audio file
+
+    Args:
+        path (str): path to the audio file
+
+    Returns:
+        tuple: (samples as float32 array of shape (channels, samples) scaled to [-1, 1], sample rate)
+    """
+    segment = AudioSegment.from_file(path)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / (1 << (8 * segment.sample_width - 1))
+    return samples.reshape(-1, segment.channels).T, segment.frame_rate
+
+
+def compute_loudness(samples: np.ndarray, sample_rate: int) -> dict:
+    """computes the loudness of the samples
+
+    Args:
+        samples (np.ndarray): float samples of shape (channels, samples) scaled to [-1, 1]
+        sample_rate (int): sample rate of the samples
+
+    Returns:
+        dict: integrated_loudness and short_term_max in LUFS, sample_peak in dBFS (-inf if the audio is too short or silent)
+    """
+    channels, length = samples.shape
+    sample_peak = float(np.abs(samples).max()) if length > 0 else 0.0
+    result = {'integrated_loudness': -np.inf, 'short_term_max': -np.inf,
+              'sample_peak': 20 * float(np.log10(sample_peak)) if sample_peak > 0 else -np.inf}
+
+    sub_block_size = round(sample_rate * SUB_BLOCK_DURATION)
+    number_of_sub_blocks = length // sub_block_size
+    if number_of_sub_blocks < MOMENTARY_SUB_BLOCKS:
+        return result
+
+    response = 1.0
+    for b, a in get_k_weighting_coefficients(sample_rate):
+        response = response * _get_frequency_response(b, a, length)
+    weights = SURROUND_WEIGHTS[:channels] if channels > 2 else [1.0] * channels
+
+    # energy of each 100 ms sub-block, summed over the weighted channels
+    energies = np.zeros(number_of_sub_blocks)
+    for channel, weight in enumerate(weights):
+        if weight == 0:
+            continue
+        filtered = np.fft.irfft(np.fft.rfft(samples[channel]) * response.astype(np.complex64), n=length)
+        sub_blocks = filtered[:number_of_sub_blocks * sub_block_size].reshape(number_of_sub_blocks, sub_block_size)
+        energies += weight * np.einsum('ij,ij->i', sub_blocks, sub_blocks, dtype=np.float64)
+    cumulative_energies = np.concatenate([[0.0], np.cumsum(energies)])
+
+    def get_block_powers(sub_blocks_per_block: int) -> np.ndarray:
+        block_energies = cumulative_energies[sub_blocks_per_block:] - cumulative_energies[:-sub_blocks_per_block]
+        return block_energies / (sub_blocks_per_block * sub_block_size)
+
+    def to_loudness(power):
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(power)
+
+    powers = get_block_powers(MOMENTARY_SUB_BLOCKS)
+    powers = powers[to_loudness(powers) > ABSOLUTE_GATE]
+    if len(powers) > 0:
+        relative_gate = to_loudness(powers.mean()) + RELATIVE_GATE
+        result['integrated_loudness'] = float(to_loudness(powers[to_loudness(powers) > relative_gate].mean()))
+
+    if number_of_sub_blocks >= SHORT_TERM_SUB_BLOCKS:
+        result['short_term_max'] = float(to_loudness(get_block_powers(SHORT_TERM_SUB_BLOCKS).max()))
+    return result
+
+
+def _analyze_file(path: str):
+    """decodes the audio file and computes its loudness. Runs in the worker processes.
+
+    Returns:
+        dict: the loudness, or None if the file could not be decoded
+    """
+    try:
+        return compute_loudness(*decode_audio(path))
+    except Exception as e:
+        # pydub raises all kind of errors for files ffmpeg can't decode
+        logger.warning(f'Could not decode {path}: {e}')
+        return None
+
+
+def _load_cache(cache_file: str) -> pd.DataFrame:
+    if not os.path.exists(cache_file):
+        return pd.DataFrame(columns=CACHE_COLUMNS)
+    df_cache = pd.read_csv(cache_file, dtype={'path': str})
+    return df_cache[df_cache['version'] == LOUDNESS_VERSION]
+
+
+def _write_cache(df_cache: pd.DataFrame, cache_file: str) -> None:
+    temp_path = cache_file + '.tmp'
+    df_cache.to_csv(temp_path, index=False)
+    os.replace(temp_path, cache_file)
+
+
+def load_loudness(paths: list, cache_file: str, workers: int = None) -> pd.DataFrame:
+    """returns the loudness of the audio files. Files whose size and modification time didn't change since they were
+    analyzed are taken from the cache table, all the others are analyzed in parallel and added to the cache table.
+
+    Args:
+        paths (list): paths to the audio files
+        cache_file (str): path to the .csv cache table
+        workers (int, optional): number of processes used for decoding. Defaults to the number of cpus.
+
+    Returns:
+        pd.DataFrame: the columns path, integrated_loudness, short_term_max and sample_peak, one row per path
+            (NaN for the files that are missing or could not be decoded)
+    """
+    df_cache = _load_cache(cache_file).drop_duplicates(subset=['path'], keep='last').set_index('path', drop=False)
+    cached = df_cache.to_dict('index')
+
+    rows = {}
+    jobs = {}
+    missing = 0
+    for path in dict.fromkeys(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            missing += 1
+            continue
+        row = cached.get(path)
+        if row is not None and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+            rows[path] = row
+        else:
+            jobs[path] = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': LOUDNESS_VERSION}
+
+    logger.info(f'Loudness: {len(rows)} files from the cache, {missing} files missing, analyzing {len(jobs)} new ones...')
+
+    if jobs:
+        analyzed = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_analyze_file, path): path for path in jobs}
+            try:
+                for future in as_completed(futures):
+                    loudness = future.result()
+                    if loudness is None:
+                        continue
+                    path = futures[future]
+                    cached[path] = rows[path] = jobs[path] | loudness
+                    analyzed += 1
+                    if analyzed % CACHE_WRITE_INTERVAL == 0:
+                        _write_cache(pd.DataFrame(cached.values(), columns=CACHE_COLUMNS), cache_file)
+            finally:
+                _write_cache(pd.DataFrame(cached.values(), columns=CACHE_COLUMNS), cache_file)
+
+    df_loudness = pd.DataFrame(rows.values(), columns=CACHE_COLUMNS)
+    df_loudness = pd.DataFrame({'path': paths}).merge(df_loudness, on='path', how='left')
+    return df_loudness[['path', 'integrated_loudness', 'short_term_max', 'sample_peak']]
+
+
+def get_quiet_paths(df_loudness: pd.DataFrame, min_loudness: float, max_peak: float) -> list:
+    """selects the files that are too quiet and can be made louder. Normalizing the peak can't make a file quieter,
+    so the files above the loudness are not selected, neither are the ones whose peak can't be raised any further
+    or the ones too short or silent to be measured.
+
+    Args:
+        df_loudness (pd.DataFrame): the loudness, as returned by load_loudness
+        min_loudness (float): integrated loudness in LUFS, the files below it are too quiet
+        max_peak (float): sample peak in dBFS the files are normalized to
+
+    Returns:
+        list: the paths of the files that are too quiet
+    """
+    loudness = df_loudness['integrated_loudness']
+    is_quiet = np.isfinite(loudness) & (loudness < min_loudness) & (df_loudness['sample_peak'] < max_peak)
+    return df_loudness.loc[is_quiet, 'path'].tolist()
@@ -0,0 +1,136 @@
+# This file scans the folders holding the audio files with os.scandir.
+# The folders are scanned in a thread pool: the time goes into waiting for the disk, not into python,
+# and a folder is listed with one call instead of one stat per file.
+
+
+# system imports
+from concurrent.futures import ThreadPoolExecutor
+import os
+import unicodedata
+
+# 3rd party imports
+import pandas as pd
+
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.aif', '.aiff', '.flac', '.m4a', '.aac', '.alac', '.ogg', '.mp4')
+SCAN_WORKERS = 16
+
+
+def normalize_path(path: str) -> str:
+    """brings a path into the form used for comparisons: the unicode form NFC (macOS stores the filenames decomposed)
+    and / as separator, like in the paths decoded from the @Location (os.scandir uses \\ on Windows)
+
+    Args:
+        path (str): the path
+
+    Returns:
+        str: the NFC normalized path with / as separator
+    """
+    return unicodedata.normalize('NFC', path).replace(os.sep, '/')
+
+
+def get_path_key(path: str) -> str:
+    """brings a path into the form used to tell if two paths point to the same file.
+    The file systems of macOS are case insensitive, so the case is ignored.
+
+    Args:
+        path (str): the path
+
+    Returns:
+        str: the normalized and casefolded path
+    """
+    return normalize_path(path).casefold()
+
+
+def list_directory(folder: str):
+    """lists the names of the files in the folder
+
+    Args:
+        folder (str): path to the folder
+
+    Returns:
+        set: the NFC normalized filenames, None if the folder doesn't exist
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return {normalize_path(entry.name) for entry in entries if not entry.is_dir()}
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return None
+
+
+def list_directories(folders: list, workers: int = SCAN_WORKERS) -> dict:
+    """lists the files of many folders in parallel
+
+    Args:
+        folders (list): paths to the folders
+        workers (int, optional): number of threads. Defaults to SCAN_WORKERS.
+
+    Returns:
+        dict: key is the folder and value the set of its filenames (None if the folder doesn't exist)
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(folders, executor.map(list_directory, folders)))
+
+
+def _walk(folder: str, extensions: tuple) -> list:
+    """walks recursively through the folder. Hidden files and folders (like ._ files of macOS) are skipped.
+
+    Returns:
+        list: (path, size, modification time) of each file
+    """
+    files = []
+    folders = [folder]
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif extensions is None or entry.name.lower().endswith(extensions):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def walk_music_folder(root: str, extensions: tuple = AUDIO_EXTENSIONS, workers: int = SCAN_WORKERS) -> pd.DataFrame:
+    """walks once through the music folder, the top-level folders are walked in parallel
+
+    Args:
+        root (str): path to the music folder
+        extensions (tuple, optional): lowercase extensions of the files to list, None for all files. Defaults to AUDIO_EXTENSIONS.
+        workers (int, optional): number of threads. Defaults to SCAN_WORKERS.
+
+    Raises:
+        ValueError: if the music folder doesn't exist
+
+    Returns:
+        pd.DataFrame: the columns path, size and mtime (modification time as timestamp)
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f'The music folder {root} does not exist')
+
+    files = []
+    top_level_folders = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                top_level_folders.append(entry.path)
+            elif extensions is None or entry.name.lower().endswith(extensions):
+                stat = entry.stat(follow_symlinks=False)
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for folder_files in executor.map(_walk, top_level_folders, [extensions] * len(top_level_folders)):
+            files.extend(folder_files)
+
+    df = pd.DataFrame(files, columns=['path', 'size', 'mtime'])
+    # naive timestamps in UTC
+    df['mtime'] = pd.to_datetime(df['mtime'], unit='s')
+    return df
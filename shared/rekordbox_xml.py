@@ -0,0 +1,325 @@
+# This file holds the streaming reader for the rekordbox xml files.
+# The records are built with the same shape xmltodict produces ('@' prefixed attributes,
+# repeated children as lists, '#text' for text next to attributes), so existing callers can switch to it.
+# In contrast to xmltodict.parse(xml_file.read()) the raw text and the element tree are never held in memory.
+# The writer streams the elements straight into the output file instead of building one big string first.
+
+
+# system imports
+import html
+import mmap
+import os
+import re
+from typing import Iterator
+import xml.etree.ElementTree as ET
+
+# 3rd party imports
+import xmltodict
+
+
+ROOT_PATH = ("DJ_PLAYLISTS",)
+COLLECTION_PATH = ("DJ_PLAYLISTS", "COLLECTION")
+TRACK_PATH = ("DJ_PLAYLISTS", "COLLECTION", "TRACK")
+PLAYLISTS_PATH = ("DJ_PLAYLISTS", "PLAYLISTS")
+
+# size of the write buffer of the output file, the elements are written in many small pieces
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# the Location attribute of a TRACK element. The other attributes are skipped as a whole, since their values may contain a '>'
+TRACK_LOCATION_PATTERN = re.compile(rb'<TRACK(?:\s+[^\s=>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*?\s+Location\s*=\s*"([^"]*)"')
+
+
+def _push_child(parent: dict, key: str, value) -> None:
+    """adds value to parent like xmltodict does: a repeated key is turned into a list
+
+    Args:
+        parent (dict): the dict of the parent element
+        key (str): tag of the child element
+        value: the converted child element
+    """
+    if key not in parent:
+        parent[key] = value
+    elif isinstance(parent[key], list):
+        parent[key].append(value)
+    else:
+        parent[key] = [parent[key], value]
+
+
+def _finalize_item(item: dict, text: str):
+    """converts the collected attributes, children and text of an element into its xmltodict value
+
+    Args:
+        item (dict): the attributes and children of the element
+        text (str): the stripped text of the element
+
+    Returns:
+        the value xmltodict would produce (dict, str or None)
+    """
+    if not item:
+        return text if text else None
+    if text:
+        item["#text"] = text
+    return item
+
+
+def _iterparse_dicts(filepath: str, emit_paths: tuple = (), skip_paths: tuple = ()) -> Iterator[tuple]:
+    """parses the xml file incrementally and converts the elements into xmltodict shaped values.
+    Every element is released as soon as it is closed, so only the currently open elements are kept in memory.
+
+    Args:
+        filepath (str): path to the xml file
+        emit_paths (tuple, optional): paths (tuples of tags) of the elements that are yielded instead of being attached to their parent. Defaults to ().
+        skip_paths (tuple, optional): paths of the elements that are dropped together with their children. Defaults to ().
+
+    Yields:
+        tuple: (path, value) for each emitted element and finally for the root element
+    """
+    path = []
+    elements = []
+    items = []
+    skip_depth = None
+
+    with open(filepath, "rb") as xml_file:
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            if event == "start":
+                path.append(elem.tag)
+                elements.append(elem)
+                if skip_depth is None and tuple(path) in skip_paths:
+                    skip_depth = len(path)
+                if skip_depth is None:
+                    items.append({"@" + key: value for key, value in elem.attrib.items()})
+                else:
+                    items.append(None)
+                continue
+
+            curr_path = tuple(path)
+            item = items.pop()
+            path.pop()
+            elements.pop()
+
+            value = None
+            if item is not None:
+                value = _finalize_item(item, (elem.text or "").strip())
+
+            # releasing the element; all its children were already released when they were closed
+            elem.clear()
+            if elements:
+                elements[-1].remove(elem)
+
+            if skip_depth is not None:
+                if len(path) < skip_depth:
+                    skip_depth = None
+                continue
+
+            if curr_path in emit_paths or not items:
+                yield curr_path, value
+            else:
+                _push_child(items[-1], curr_path[-1], value)
+
+
+def as_list(value) -> list:
+    """xmltodict returns a single child element as dict and several ones as list. This always returns a list.
+
+    Args:
+        value: the child element(s) as returned by xmltodict, or None if there are none
+
+    Returns:
+        list: the child elements
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def from_list(values: list):
+    """reverse of as_list: brings the child elements back into the shape xmltodict would return
+
+    Args:
+        values (list): the child elements
+
+    Returns:
+        None for no element, the element itself for a single one, otherwise the list
+    """
+    if len(values) == 0:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def iter_playlist_nodes(node: dict, parent_path: str = "") -> Iterator[tuple]:
+    """walks recursively through the playlist tree, starting at node (e.g. the ROOT node of the PLAYLISTS).
+    The path of a node are the @Name information of it and its parents, joined with '/'
+
+    Args:
+        node (dict): the NODE element you want to start from
+        parent_path (str, optional): path of the parent of node. Defaults to "".
+
+    Yields:
+        tuple: (path, node) for node itself and all the folders and playlists below it
+    """
+    curr_path = node["@Name"] if parent_path == "" else parent_path + "/" + node["@Name"]
+    yield curr_path, node
+    for child in as_list(node.get("NODE")):
+        yield from iter_playlist_nodes(child, curr_path)
+
+
+def find_playlist_node(root: dict, path: str) -> dict:
+    """returns the folder or playlist at the given path (e.g. "ROOT/My Folder/My Playlist")
+
+    Args:
+        root (dict): the ROOT node of the PLAYLISTS
+        path (str): names of the nodes, starting with the root node, joined with '/'
+
+    Raises:
+        ValueError: if there is no node at the given path
+
+    Returns:
+        dict: the NODE element
+    """
+    names = path.split("/")
+    if names[0] != root["@Name"]:
+        raise ValueError(f'Playlist path "{path}" must start with "{root["@Name"]}"')
+
+    node = root
+    for name in names[1:]:
+        children = [child for child in as_list(node.get("NODE")) if child["@Name"] == name]
+        if len(children) == 0:
+            raise ValueError(f'No folder or playlist found at "{path}"')
+        node = children[0]
+    return node
+
+
+def iter_collection_tracks(filepath: str) -> Iterator[dict]:
+    """yields the TRACK records of the COLLECTION one at a time. The PLAYLISTS are skipped.
+
+    Args:
+        filepath (str): path to the rekordbox xml file
+
+    Yields:
+        dict: one track, in the same format as xmltodict would return it
+    """
+    for curr_path, value in _iterparse_dicts(filepath, emit_paths=(TRACK_PATH,), skip_paths=(PLAYLISTS_PATH,)):
+        if curr_path == TRACK_PATH:
+            yield value
+
+
+def load_playlists(filepath: str) -> dict:
+    """builds just the PLAYLISTS tree of the rekordbox xml file. The TRACK records of the COLLECTION are skipped.
+
+    Args:
+        filepath (str): path to the rekordbox xml file
+
+    Returns:
+        dict: the PLAYLISTS element, in the same format as xmltodict would return it
+    """
+    for curr_path, value in _iterparse_dicts(filepath, emit_paths=(PLAYLISTS_PATH,), skip_paths=(TRACK_PATH,)):
+        if curr_path == PLAYLISTS_PATH:
+            return value
+    raise ValueError(f"No PLAYLISTS element found in {filepath}")
+
+
+def load_rekordbox_xml(filepath: str) -> dict:
+    """reading and parsing a rekordbox xml file into a dict, without reading the whole text into memory first.
+    The result is identical to xmltodict.parse(xml_file.read())
+
+    Args:
+        filepath (str): path to the xml file you want to open and convert
+
+    Returns:
+        dict: the converted xml file as a dict
+    """
+    input_data = {}
+    for curr_path, value in _iterparse_dicts(filepath):
+        input_data[curr_path[-1]] = value
+    return input_data
+
+
+def write_rekordbox_xml(input_data: dict, out_path: str, pretty: bool = True) -> None:
+    """writes the data into a xml file. Every element (e.g. each COLLECTION/TRACK and PLAYLISTS/NODE)
+    is streamed through a buffered writer into the file, so no string of the whole document is built.
+    The output is byte-identical to xmltodict.unparse(input_data, pretty=pretty).
+    Lists in input_data can also be iterators (e.g. iter_collection_tracks), then they are consumed while writing.
+
+    Args:
+        input_data (dict): the data in the format xmltodict returns it
+        out_path (str): filepath of the xml file you want to write
+        pretty (bool, optional): if True the elements are written on separate, indented lines. Defaults to True.
+    """
+    with open(out_path, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as xml_outfile:
+        xmltodict.unparse(input_data, output=xml_outfile, pretty=pretty)
+
+
+def compile_location_rules(rules: dict) -> re.Pattern:
+    """compiles the prefix rules into one regex, that matches the beginning of a location.
+    The longest prefixes come first, since the alternation takes the first alternative that matches.
+
+    Args:
+        rules (dict): key is the location prefix you want to change and value the prefix you want to change it to
+
+    Raises:
+        ValueError: if no rules are given
+
+    Returns:
+        re.Pattern: the compiled regex, its first group is the matching prefix
+    """
+    if len(rules) == 0:
+        raise ValueError("Please provide at least one rule to relocate the tracks.")
+    prefixes = sorted(rules, key=len, reverse=True)
+    return re.compile("^(" + "|".join(re.escape(prefix) for prefix in prefixes) + ")")
+
+
+def _escape_attribute(value: str) -> str:
+    """escapes a value for a double quoted xml attribute
+
+    Args:
+        value (str): the value you want to escape
+
+    Returns:
+        str: the escaped value
+    """
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def patch_track_locations(in_path: str, out_path: str, rules: dict) -> dict:
+    """changes the Location attribute of the TRACK elements according to the prefix rules without parsing the xml file.
+    The file is memory-mapped and scanned as bytes; everything except the changed Location values is copied unchanged,
+    so the playlists, cue points and the formatting stay byte-identical.
+
+    Args:
+        in_path (str): path to the rekordbox xml file
+        out_path (str): filepath of the xml file you want to write
+        rules (dict): key is the location prefix you want to change and value the prefix you want to change it to
+
+    Raises:
+        ValueError: if the xml file is empty (it can't be memory-mapped)
+
+    Returns:
+        dict: key is the prefix of the rule and value the number of tracks changed by it
+    """
+    if os.path.getsize(in_path) == 0:
+        raise ValueError(f"The xml file {in_path} is empty")
+    rules_pattern = compile_location_rules(rules)
+    cnt_per_rule = {prefix: 0 for prefix in rules}
+
+    with open(in_path, "rb") as in_file, open(out_path, "wb", buffering=WRITE_BUFFER_SIZE) as out_file:
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            last_end = 0
+            for match in TRACK_LOCATION_PATTERN.finditer(data):
+                location = html.unescape(match.group(1).decode("utf-8"))
+                prefix_match = rules_pattern.match(location)
+                if prefix_match is None:
+                    continue
+
+                prefix = prefix_match.group(1)
+                cnt_per_rule[prefix] += 1
+                new_location = rules[prefix] + location[len(prefix):]
+
+                out_file.write(data[last_end:match.start(1)])
+                out_file.write(_escape_attribute(new_location).encode("utf-8"))
+                last_end = match.end(1)
+            out_file.write(data[last_end:])
+
+    return cnt_per_rule
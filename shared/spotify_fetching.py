@@ -0,0 +1,142 @@
+# This file fetches many Spotify resources at the same time (e.g. the tracks of every followed playlist and artist).
+# The requests run in a bounded thread pool and share one token bucket, so all the threads together stay below
+# REQUESTS_PER_SECOND. When Spotify answers 429 (too many requests), the whole bucket is paused for the seconds
+# of the Retry-After header (or an exponential backoff, if there is none) and the request is sent again.
+# The results are returned in the order of the keys, independent of the order the requests finish in.
+# Note: the session spotipy creates retries 429 answers itself (sleeping in the waiting thread), just the ones it gives up
+# on would get here. Pass requests_session=get_requests_session() to spotipy.Spotify, so all of them are handled with
+# the shared bucket (the session still retries failed connections and server errors).
+
+
+# system imports
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+# 3rd party imports
+import requests
+import spotipy
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_PER_SECOND = 10
+FETCH_WORKERS = 8
+MAX_RETRIES = 5
+# the first wait after a 429 without Retry-After header, doubled with every further retry
+BACKOFF_SECONDS = 1.0
+# the answers the session retries itself, 429 is left to call_with_retry
+SESSION_RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+class TokenBucket():
+    """Rate limiter shared by threads: holds up to capacity tokens, refilled with rate tokens per second"""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, capacity: float = None):
+        if rate <= 0:
+            raise ValueError('The rate must be positive')
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """blocks until a token is available and takes it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """hands out no tokens for the given seconds, to any thread. The bucket starts empty afterwards."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+def get_requests_session(retries: int = 3, pool_size: int = FETCH_WORKERS) -> requests.Session:
+    """returns a session for spotipy.Spotify, that retries failed connections and server errors like spotipy's own session,
+    but not 429 answers: they reach call_with_retry, which pauses the shared token bucket
+
+    Args:
+        retries (int, optional): number of retries of a request. Defaults to 3.
+        pool_size (int, optional): number of connections kept open, at least the number of requests at the same time.
+            Defaults to FETCH_WORKERS.
+
+    Returns:
+        requests.Session: the session
+    """
+    retry = Retry(total=retries, connect=None, read=False, status=retries, backoff_factor=0.3,
+                  allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                  status_forcelist=SESSION_RETRY_STATUS_CODES, respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_retry_after(exception: spotipy.SpotifyException):
+    """returns the seconds of the Retry-After header, or None"""
+    headers = getattr(exception, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(limiter: TokenBucket, function, *args, **kwargs):
+    """calls the function (a request to Spotify) once the limiter allows it, again after a 429 answer
+
+    Args:
+        limiter (TokenBucket): the rate limiter shared by all the requests
+        function (callable): e.g. sp.artist_top_tracks, called with the other arguments
+
+    Raises:
+        spotipy.SpotifyException: if the request fails for another reason, or still gets 429 after MAX_RETRIES retries
+
+    Returns:
+        the result of the function
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            return function(*args, **kwargs)
+        except spotipy.SpotifyException as e:
+            if e.http_status != 429 or attempt == MAX_RETRIES:
+                raise
+            wait = _get_retry_after(e)
+            if wait is None:
+                wait = BACKOFF_SECONDS * 2 ** attempt
+            logger.warning(f'Rate limited by Spotify, pausing all requests for {wait:.1f}s (retry {attempt + 1}/{MAX_RETRIES})')
+            limiter.pause(wait)
+
+
+def fetch_in_order(function, keys: list, workers: int = FETCH_WORKERS, desc: str = 'Fetching') -> list:
+    """calls function(key) for every key in a thread pool
+
+    Args:
+        function (callable): fetches the data of one key, its requests should go through call_with_retry
+        keys (list): e.g. the ids of the playlists
+        workers (int, optional): number of requests at the same time. Defaults to FETCH_WORKERS.
+        desc (str, optional): description of the progress bar. Defaults to 'Fetching'.
+
+    Returns:
+        list: the results, in the order of the keys
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(tqdm(executor.map(function, keys), total=len(keys), desc=desc))
@@ -58,9 +58,10 @@ def open_file(filepath: str) -> None:
         subprocess.call(("xdg-open", filepath))
 
 
-def get_auth_spotipy_obj(config: dict, scope: str) -> spotipy.Spotify:
+def get_auth_spotipy_obj(config: dict, scope: str, requests_session=True) -> spotipy.Spotify:
     """Create spotipy object from given username and environmental
-    SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET and SPOTIPY_REDIRECT_URI
+    SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET and SPOTIPY_REDIRECT_URI.
+    requests_session is passed to spotipy.Spotify (True for spotipy's own session, retrying 429 answers itself)
     """
 
     # getting the environmental variables
@@ -82,6 +83,7 @@ def get_auth_spotipy_obj(config: dict, scope: str) -> spotipy.Spotify:
             client_secret=config["client_secret"],
             redirect_uri=config["redirect_uri"],
         ),
+        requests_session=requests_session,
     )
     return sp
 